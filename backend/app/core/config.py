@@ -13,6 +13,47 @@ class Settings(BaseSettings):
     secret_key: str = "your-secret-key-change-this-in-production"
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 30
+    principal_cache_max_entries: int = 10000  # 認証済みユーザーのキャッシュ
+    principal_cache_ttl_seconds: float = 60
+    bcrypt_rounds: int = 12  # 変更すると次回ログイン時に再ハッシュされる
+    password_hash_workers: int = 2  # パスワードハッシュ計算プロセス数（0で同じプロセス内）
+    password_hash_max_queue: int = 8  # 計算待ちの上限（超えると503）
+    password_hash_retry_after_seconds: int = 1
+    
+    # ファイル設定
+    thumbnail_workers: int = 2  # サムネイル生成プロセス数
+    upload_session_ttl_hours: float = 24  # 放置されたアップロードセッションの保持期間
+    upload_session_gc_interval_seconds: int = 600
+    upload_session_max_per_user: int = 10  # 未完了の再開可能アップロードの数
+    upload_session_max_bytes_per_user: int = 500 * 1024 * 1024  # 未完了のセッションが確保する合計サイズ
+    file_gc_grace_hours: float = 24  # 投稿されなかったアップロードを残しておく時間
+    file_gc_interval_seconds: int = 300
+    file_gc_batch_size: int = 500
+    
+    # ストレージ設定
+    storage_backend: str = "local"  # local または s3
+    storage_s3_bucket: str = ""
+    storage_s3_endpoint_url: Optional[str] = None  # MinIOなどS3互換サービスのURL
+    storage_s3_region: Optional[str] = None
+    storage_s3_access_key: Optional[str] = None
+    storage_s3_secret_key: Optional[str] = None
+    storage_s3_prefix: str = ""
+    storage_presign_expires_seconds: int = 3600  # ダウンロード用署名付きURLの有効期間
+    
+    # レート制限設定
+    rate_limit_enabled: bool = True
+    rate_limit_per_second: float = 20  # クライアントごとの全リクエストの上限
+    rate_limit_burst: int = 60
+    search_rate_limit_per_second: float = 2
+    search_rate_limit_burst: int = 10
+    search_max_concurrent: int = 16  # 検索の同時実行数（超えると503）
+    upload_max_concurrent: int = 8
+    login_rate_limit_per_second: float = 0.2  # ログイン・登録の試行
+    login_rate_limit_burst: int = 10
+    threadpool_size: int = 40  # 同期ハンドラーを実行するスレッド数
+    
+    # 運用設定
+    admin_usernames: list = []  # /cache-stats などの運用エンドポイントを使えるユーザー
     
     # CORS設定
     allowed_origins: list = ["*"]
@@ -20,6 +61,23 @@ class Settings(BaseSettings):
     # WebSocket設定
     websocket_heartbeat_interval: int = 30
     
+    # 検索設定
+    search_candidate_limit: int = 1000  # ランキング対象とする最新の候補数
+    search_recency_half_life_days: float = 0  # 0で新しさによる減衰なし
+    search_cache_max_entries: int = 1000
+    search_cache_max_bytes: int = 32 * 1024 * 1024
+    search_index_batch_size: int = 500
+    search_index_interval_seconds: float = 2.0
+    
+    # チャンネル一覧設定
+    channel_directory_cache_ttl_seconds: float = 30  # 公開チャンネル一覧の1ページ目のキャッシュ期間
+    
+    # 既読位置設定
+    read_marker_flush_interval_seconds: float = 5.0  # メモリ上の既読位置をDBへ反映する間隔
+    
+    # ドラフト設定
+    draft_flush_interval_seconds: float = 2.0  # メモリ上のドラフトをDBへ反映する間隔
+    
     class Config:
         env_file = ".env"
 
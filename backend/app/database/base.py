@@ -20,4 +20,17 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def _insert_ignore(table):
+    return table.insert().prefix_with("IGNORE", dialect="mysql").prefix_with("OR IGNORE", dialect="sqlite")
+
+def insert_ignore_rows(db, table, rows, batch_size: int = 1000) -> None:
+    """複数行をまとめてINSERTし、一意キーが重複する行は無視する（MySQLの INSERT IGNORE）"""
+    statement = _insert_ignore(table)
+    for start in range(0, len(rows), batch_size):
+        db.execute(statement, rows[start:start + batch_size])
+
+def insert_ignore_select(db, table, columns, query) -> None:
+    """SELECTの結果をそのままINSERTし、一意キーが重複する行は無視する（INSERT IGNORE ... SELECT）"""
+    db.execute(_insert_ignore(table).from_select(columns, query))
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, Table
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, Table, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database.base import Base
@@ -11,7 +11,8 @@ channel_members = Table(
     Column('user_id', Integer, ForeignKey('users.id')),
     Column('channel_id', Integer, ForeignKey('channels.id')),
     Column('role', String(20), default='member'),  # enum: owner, admin, member
-    Column('joined_at', DateTime, default=func.now())
+    Column('joined_at', DateTime, default=func.now()),
+    UniqueConstraint('channel_id', 'user_id', name='unique_channel_user')
 )
 
 
@@ -53,6 +54,10 @@ class Channel(Base):
     members = relationship("User", secondary=channel_members, back_populates="channels")
     messages = relationship("Message", back_populates="channel")
 
+    __table_args__ = (
+        Index("idx_type_name", "channel_type", "name"),
+    )
+
 
 class Message(Base):
     __tablename__ = "messages"
@@ -73,6 +78,12 @@ class Message(Base):
     reactions = relationship("Reaction", back_populates="message")
     replies = relationship("Message", remote_side=[id])  # Self-referential for threading
 
+    # Composite indexes so search filters (in:#channel, from:@user + dates) are range scans
+    __table_args__ = (
+        Index("idx_user_created", "user_id", "created_at"),
+        Index("idx_channel_created", "channel_id", "created_at"),
+    )
+
 
 class Reaction(Base):
     __tablename__ = "reactions"
@@ -90,4 +101,103 @@ class Reaction(Base):
     # Ensure unique reaction per user per message
     __table_args__ = (
         {"mysql_engine": "InnoDB"},
-    )
\ No newline at end of file
+    )
+
+
+# Inverted index for search: term -> messages containing it
+class MessageTerm(Base):
+    __tablename__ = "message_terms"
+
+    # Binary collation: terms that the default collation treats as equal (café/cafe) must not collide
+    term = Column(String(64).with_variant(String(64, collation="utf8mb4_bin"), "mysql"), primary_key=True)
+    message_id = Column(Integer, primary_key=True, index=True)  # No FK so postings can be removed after the message
+    tf = Column(Integer, nullable=False, default=1)
+
+
+# Messages waiting to be (re)indexed by the background search indexer
+class SearchIndexQueue(Base):
+    __tablename__ = "search_index_queue"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    message_id = Column(Integer, nullable=False)
+    enqueued_at = Column(DateTime, default=func.now())
+
+
+# Content-addressed upload storage: one blob per distinct content, shared by reference
+class FileBlob(Base):
+    __tablename__ = "file_blobs"
+
+    name = Column(String(80), primary_key=True)  # <sha256><extension>, the stored file name
+    sha256 = Column(String(64), nullable=False, index=True)
+    size = Column(Integer, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=func.now())
+
+
+# One row per upload: who uploaded what, and which message (if any) references it
+class FileRecord(Base):
+    __tablename__ = "files"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(80), nullable=False, unique=True)  # <uuid><extension>, the unguessable name in the file URL
+    blob_name = Column(String(80), nullable=False, index=True)  # FileBlob.name; each record holds one reference
+    filename = Column(String(255), nullable=False)  # Original file name
+    size = Column(Integer, nullable=False)
+    mime_type = Column(String(100), nullable=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    channel_id = Column(Integer, ForeignKey("channels.id"), nullable=True)
+    message_id = Column(Integer, nullable=True, index=True)  # NULL until posted, and again after the message is deleted
+    created_at = Column(DateTime, default=func.now())
+
+    __table_args__ = (
+        Index("idx_files_channel_created", "channel_id", "created_at"),
+        Index("idx_files_user_created", "user_id", "created_at"),
+    )
+
+
+# Per-channel counters kept up to date on every post, so unread counts need no COUNT scans
+class ChannelStats(Base):
+    __tablename__ = "channel_stats"
+
+    channel_id = Column(Integer, ForeignKey("channels.id"), primary_key=True)
+    message_count = Column(Integer, nullable=False, default=0)  # Top-level messages only
+    last_message_id = Column(Integer, nullable=True)
+    last_message_at = Column(DateTime, nullable=True)
+
+
+# Per-user read pointer in each channel
+class ChannelRead(Base):
+    __tablename__ = "channel_reads"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    channel_id = Column(Integer, ForeignKey("channels.id"), primary_key=True)
+    last_read_message_id = Column(Integer, nullable=False, default=0)
+    read_message_count = Column(Integer, nullable=False, default=0)  # ChannelStats.message_count covered by the pointer
+    mention_count = Column(Integer, nullable=False, default=0)  # Mentions since the pointer
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+
+# One DM channel per unordered user pair, found by primary key lookup
+class DirectMessagePair(Base):
+    __tablename__ = "direct_message_pairs"
+
+    user_low_id = Column(Integer, ForeignKey("users.id"), primary_key=True)  # min(user ids)
+    user_high_id = Column(Integer, ForeignKey("users.id"), primary_key=True)  # max(user ids)
+    channel_id = Column(Integer, ForeignKey("channels.id"), nullable=False, unique=True)
+    created_at = Column(DateTime, default=func.now())
+
+
+class MessageDraft(Base):
+    __tablename__ = "message_drafts"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    channel_id = Column(Integer, ForeignKey("channels.id"), nullable=False)
+    content = Column(Text, nullable=False)
+    reply_to_id = Column(Integer, nullable=True)  # Quoted message; no FK so deleting it is not blocked
+    created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "channel_id", name="unique_draft_user_channel"),
+    )
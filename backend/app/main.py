@@ -1,14 +1,26 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import Depends, FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+import anyio
 from typing import List
 import json
 import asyncio
 import logging
 from sqlalchemy.orm import Session
 
-from app.routers import auth, channels, messages, files, search
+from app.routers import auth, channels, messages, files, search, drafts
 from app.database.base import engine, get_db
 from app.database.models import Base, User
+from app.core.config import settings
+from app.services.channel_directory import directory_cache
+from app.services.channel_stats import initialize_channel_stats
+from app.services.password_hashing import password_hasher
+from app.services.drafts import draft_buffer, run_draft_flusher
+from app.services.read_markers import read_markers, run_read_marker_flusher
+from app.services.principal_cache import principal_cache
+from app.services.rate_limit import RateLimitMiddleware
+from app.services.search_cache import search_cache
+from app.services.search_indexer import run_search_indexer
+from app.services.thumbnails import shutdown_thumbnail_executor, start_thumbnail_executor
 
 # ログ設定
 logging.basicConfig(
@@ -26,6 +38,9 @@ app = FastAPI(title="Slack Clone API", version="1.0.0")
 # Create database tables
 Base.metadata.create_all(bind=engine)
 
+# クライアントごとのレート制限（CORSの内側なので429にもCORSヘッダーが付く）
+app.add_middleware(RateLimitMiddleware)
+
 # CORS設定
 app.add_middleware(
     CORSMiddleware,
@@ -41,6 +56,7 @@ app.include_router(channels.router, prefix="/channels", tags=["channels"])
 app.include_router(messages.router, prefix="/messages", tags=["messages"])
 app.include_router(files.router, prefix="/files", tags=["files"])
 app.include_router(search.router, prefix="/search", tags=["search"])
+app.include_router(drafts.router, prefix="/drafts", tags=["drafts"])
 
 # WebSocket接続管理
 class ConnectionManager:
@@ -122,17 +138,58 @@ async def cleanup_stale_connections():
 
 # クリーンアップタスクは後で開始する
 cleanup_task = None
+search_indexer_task = None
+upload_session_gc_task = None
+file_gc_task = None
+read_marker_task = None
+draft_task = None
 
 @app.on_event("startup")
 async def startup_event():
-    global cleanup_task
+    global cleanup_task, search_indexer_task, upload_session_gc_task, file_gc_task, read_marker_task, draft_task
+    db = next(get_db())
+    try:
+        initialize_channel_stats(db)
+    finally:
+        db.close()
+    
+    # Sync route handlers share this threadpool
+    anyio.to_thread.current_default_thread_limiter().total_tokens = settings.threadpool_size
+    password_hasher.start()
+    start_thumbnail_executor()
     cleanup_task = asyncio.create_task(cleanup_stale_connections())
+    search_indexer_task = asyncio.create_task(run_search_indexer())
+    upload_session_gc_task = asyncio.create_task(files.run_upload_session_gc())
+    file_gc_task = asyncio.create_task(files.run_file_gc())
+    read_marker_task = asyncio.create_task(run_read_marker_flusher())
+    draft_task = asyncio.create_task(run_draft_flusher())
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    global cleanup_task
+    global cleanup_task, search_indexer_task, upload_session_gc_task, file_gc_task, read_marker_task, draft_task
     if cleanup_task:
         cleanup_task.cancel()
+    if search_indexer_task:
+        search_indexer_task.cancel()
+    if upload_session_gc_task:
+        upload_session_gc_task.cancel()
+    if file_gc_task:
+        file_gc_task.cancel()
+    if read_marker_task:
+        read_marker_task.cancel()
+    if draft_task:
+        draft_task.cancel()
+    # Persist read positions and drafts still held in memory
+    try:
+        read_markers.flush()
+    except Exception as e:
+        logger.error(f"Read marker flush failed: {e}")
+    try:
+        draft_buffer.flush()
+    except Exception as e:
+        logger.error(f"Draft flush failed: {e}")
+    shutdown_thumbnail_executor()
+    password_hasher.shutdown()
 
 @app.get("/")
 async def root():
@@ -142,6 +199,17 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/cache-stats", dependencies=[Depends(auth.get_admin_user)])
+async def get_cache_stats():
+    """インメモリキャッシュのヒット率とメモリ使用量（運用者のみ）"""
+    return {
+        "search_results": search_cache.stats(),
+        "principals": principal_cache.stats(),
+        "read_markers": read_markers.stats(),
+        "channel_directory": directory_cache.stats(),
+        "drafts": draft_buffer.stats()
+    }
+
 @app.post("/reset-online-status")
 async def reset_online_status():
     """全ユーザーのオンライン状態をリセット（デバッグ用）"""
@@ -149,6 +217,7 @@ async def reset_online_status():
     try:
         db.query(User).update({"is_online": False})
         db.commit()
+        principal_cache.clear()
         return {"message": "All users set to offline"}
     finally:
         db.close()
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List
 from datetime import datetime
 from enum import Enum
@@ -33,6 +33,14 @@ class ChannelUpdate(BaseModel):
     name: Optional[str] = None
     description: Optional[str] = None
     is_private: Optional[bool] = None
+    is_archived: Optional[bool] = None
+
+class ChannelDirectoryEntry(ChannelResponse):
+    last_message_at: Optional[datetime] = None
+
+class ChannelDirectoryResponse(BaseModel):
+    channels: List[ChannelDirectoryEntry]
+    next_cursor: Optional[str] = None  # 次のページが無ければNone
 
 class ChannelMemberBase(BaseModel):
     channel_id: int
@@ -46,4 +54,21 @@ class ChannelMemberResponse(ChannelMemberBase):
     joined_at: datetime
     
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class ChannelReadUpdate(BaseModel):
+    message_id: Optional[int] = None  # 省略時は最新まで既読
+
+class ChannelSummaryResponse(BaseModel):
+    id: int
+    name: str
+    channel_type: str
+    unread_count: int = 0
+    mention_count: int = 0
+    last_read_message_id: Optional[int] = None
+    last_message: Optional[dict] = None
+
+class BulkMembershipRequest(BaseModel):
+    channel_ids: List[int] = Field(..., min_length=1, max_length=100)
+    user_ids: List[int] = Field(..., min_length=1, max_length=10000)
+    role: str = Field("member", pattern="^(member|admin)$")  # 追加時のロール
@@ -1,9 +1,12 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional
 from datetime import datetime
 
+# message_drafts.content is TEXT (64KB); 4 bytes per character in utf8mb4
+MAX_DRAFT_LENGTH = 16000
+
 class DraftBase(BaseModel):
-    content: str
+    content: str = Field(..., max_length=MAX_DRAFT_LENGTH)
     channel_id: int
     reply_to_id: Optional[int] = None
 
@@ -15,12 +18,12 @@ class DraftUpdate(BaseModel):
     reply_to_id: Optional[int] = None
 
 class DraftResponse(BaseModel):
-    id: int
+    id: Optional[int] = None  # DBへ未反映のドラフトはNone
     content: str
     channel_id: int
     user_id: int
     reply_to_id: Optional[int] = None
-    created_at: datetime
+    created_at: Optional[datetime] = None
     updated_at: datetime
     reply_to: Optional[dict] = None  # 引用元メッセージ
     
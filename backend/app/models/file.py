@@ -0,0 +1,23 @@
+from pydantic import BaseModel, Field
+from typing import Optional
+from datetime import datetime
+
+class FileHashUpload(BaseModel):
+    sha256: str = Field(..., pattern="^[0-9a-f]{64}$")
+    filename: str
+
+class ResumableUploadCreate(BaseModel):
+    filename: str
+    size: int = Field(..., ge=0)
+    content_type: str
+
+class FileRecordResponse(BaseModel):
+    id: int
+    filename: str
+    file_url: str
+    size: int
+    mime_type: Optional[str] = None
+    user_id: int
+    channel_id: Optional[int] = None
+    message_id: Optional[int] = None
+    created_at: datetime
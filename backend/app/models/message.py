@@ -37,6 +37,11 @@ class MessageResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class SearchResultResponse(MessageResponse):
+    snippet: Optional[str] = None  # 検索語周辺の抜粋
+    highlights: List[List[int]] = []  # snippet内の[開始, 終了)オフセット
+    score: float = 0.0
+
 class MessageUpdate(BaseModel):
     content: Optional[str] = None
 
@@ -1,30 +1,50 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 import logging
 
 from app.database.base import get_db
 from app.database.models import User, Channel, channel_members
 from app.core.config import settings
-from app.models.user import UserCreate, UserResponse, UserLogin, Token
+from app.models.user import UserCreate, UserResponse, UserLogin, UserUpdate, Token
+from app.services.access_cache import access_cache
+from app.services.autocomplete import prefix_index
+from app.services.password_hashing import PasswordHasherBusy, password_hasher
+from app.services.principal_cache import UserPrincipal, principal_cache
+from app.services.rate_limit import RateLimiter, ip_key, route_limit, too_many_requests
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Password checks are deliberately slow; limit attempts per client
+login_limit = route_limit(
+    rate=settings.login_rate_limit_per_second, burst=settings.login_rate_limit_burst, by_ip=True
+)
+# Failed sign-ins per account and address: only wrong passwords are charged, and someone
+# guessing from elsewhere cannot lock the owner out of their account
+login_failure_limiter = RateLimiter(settings.login_rate_limit_per_second, settings.login_rate_limit_burst)
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    valid, _ = password_hasher.verify_and_update(plain_password, hashed_password)
+    return valid
 
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    return password_hasher.hash(password)
+
+
+def password_hasher_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many concurrent sign-ins, please retry shortly",
+        headers={"Retry-After": str(settings.password_hash_retry_after_seconds)},
+    )
 
 
 def get_user_by_email(db: Session, email: str) -> User:
@@ -39,8 +59,14 @@ def authenticate_user(db: Session, username: str, password: str) -> User:
     user = get_user_by_username(db, username)
     if not user:
         user = get_user_by_email(db, username)  # Allow login with email
-    if not user or not verify_password(password, user.password_hash):
+    if not user:
+        return False
+    valid, new_hash = password_hasher.verify_and_update(password, user.password_hash)
+    if not valid:
         return False
+    if new_hash:
+        # Stored with an outdated cost: upgrade it now that we know the password
+        user.password_hash = new_hash
     return user
 
 
@@ -55,7 +81,15 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     return encoded_jwt
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> UserPrincipal:
+    """トークンのユーザーを返す（キャッシュにあればDBにアクセスしない）
+
+    返すのは読み取り専用のスナップショット。更新する場合は load_user でDBから読み直す。
+    """
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+    
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -69,13 +103,31 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     except JWTError:
         raise credentials_exception
     
+    generation = principal_cache.generation
     user = get_user_by_username(db, username=username)
     if user is None:
         raise credentials_exception
+    principal = UserPrincipal.from_user(user)
+    principal_cache.put(token, principal, payload.get("exp"), generation)
+    return principal
+
+
+async def get_admin_user(current_user: UserPrincipal = Depends(get_current_user)) -> UserPrincipal:
+    """運用者（settings.admin_usernames）のみ許可"""
+    if current_user.username not in settings.admin_usernames:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
+
+def load_user(db: Session, principal: UserPrincipal) -> User:
+    """更新用に認証済みユーザーをDBから読み込む"""
+    user = db.query(User).filter(User.id == principal.id).first()
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials")
     return user
 
 
-@router.post("/register", response_model=UserResponse)
+@router.post("/register", response_model=UserResponse, dependencies=[Depends(login_limit)])
 def register_user(user: UserCreate, db: Session = Depends(get_db)):
     try:
         logger.info(f"Registration attempt for user: {user.username}, email: {user.email}")
@@ -109,6 +161,7 @@ def register_user(user: UserCreate, db: Session = Depends(get_db)):
         db.add(db_user)
         db.commit()
         db.refresh(db_user)
+        prefix_index.upsert_user(db_user.id, db_user.username, db_user.display_name)
         
         # Add user to default general channel
         general_channel = db.query(Channel).filter(Channel.name == "general").first()
@@ -130,6 +183,7 @@ def register_user(user: UserCreate, db: Session = Depends(get_db)):
                     )
                 )
                 db.commit()
+                access_cache.invalidate_user(db_user.id)
                 logger.info(f"User {user.username} added to general channel")
         
         logger.info(f"User {user.username} registered successfully with ID: {db_user.id}")
@@ -137,6 +191,9 @@ def register_user(user: UserCreate, db: Session = Depends(get_db)):
         
     except HTTPException:
         raise
+    except PasswordHasherBusy:
+        db.rollback()
+        raise password_hasher_busy()
     except Exception as e:
         logger.error(f"Unexpected error during registration for {user.username}: {str(e)}", exc_info=True)
         db.rollback()
@@ -146,19 +203,34 @@ def register_user(user: UserCreate, db: Session = Depends(get_db)):
         )
 
 
-@router.post("/token", response_model=Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+@router.post("/token", response_model=Token, dependencies=[Depends(login_limit)])
+def login_for_access_token(
+    request: Request,
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    db: Session = Depends(get_db)
+):
+    failure_key = f"{form_data.username.lower()}|{ip_key(request.scope)}"
+    if settings.rate_limit_enabled:
+        allowed, retry_after = login_failure_limiter.check(failure_key)
+        if not allowed:
+            raise too_many_requests(retry_after)
+    try:
+        user = authenticate_user(db, form_data.username, form_data.password)
+    except PasswordHasherBusy:
+        raise password_hasher_busy()
     if not user:
+        if settings.rate_limit_enabled:
+            login_failure_limiter.take(failure_key)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    # Set user as online when logging in
+    # Set user as online when logging in (also saves an upgraded password hash)
     user.is_online = True
     db.commit()
+    principal_cache.invalidate_user(user.id)
     
     access_token_expires = timedelta(minutes=settings.access_token_expire_minutes)
     access_token = create_access_token(
@@ -168,7 +240,34 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db:
 
 
 @router.get("/me", response_model=UserResponse)
-def read_users_me(current_user: User = Depends(get_current_user)):
+def read_users_me(current_user: UserPrincipal = Depends(get_current_user)):
+    return current_user
+
+
+@router.put("/me", response_model=UserResponse)
+def update_profile(
+    profile: UserUpdate,
+    db: Session = Depends(get_db),
+    principal: UserPrincipal = Depends(get_current_user)
+):
+    # Tokens are issued for the username, so it cannot be changed here
+    if profile.username is not None and profile.username != principal.username:
+        raise HTTPException(status_code=400, detail="Username cannot be changed")
+    
+    current_user = load_user(db, principal)
+    if profile.display_name is not None:
+        current_user.display_name = profile.display_name
+    if profile.avatar_url is not None:
+        current_user.avatar_url = profile.avatar_url
+    if profile.status is not None:
+        if profile.status not in ['active', 'away', 'busy']:
+            raise HTTPException(status_code=400, detail="Invalid status")
+        current_user.status = profile.status
+    
+    db.commit()
+    db.refresh(current_user)
+    principal_cache.invalidate_user(current_user.id)
+    prefix_index.upsert_user(current_user.id, current_user.username, current_user.display_name)
     return current_user
 
 
@@ -177,16 +276,18 @@ def update_user_status(
     status: str,
     is_online: bool = True,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    principal: UserPrincipal = Depends(get_current_user)
 ):
     # Validate status
     valid_statuses = ['active', 'away', 'busy']
     if status not in valid_statuses:
         raise HTTPException(status_code=400, detail="Invalid status")
     
+    current_user = load_user(db, principal)
     current_user.status = status
     current_user.is_online = is_online
     db.commit()
+    principal_cache.invalidate_user(current_user.id)
     
     return {"message": "Status updated successfully"}
 
@@ -194,10 +295,12 @@ def update_user_status(
 @router.post("/logout")
 def logout(
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    principal: UserPrincipal = Depends(get_current_user)
 ):
     # Set user as offline when logging out
+    current_user = load_user(db, principal)
     current_user.is_online = False
     db.commit()
+    principal_cache.invalidate_user(current_user.id)
     
     return {"message": "Logged out successfully"}
\ No newline at end of file
@@ -1,23 +1,64 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, status
+from sqlalchemy import and_, func, or_, select
 from sqlalchemy.orm import Session
-from typing import List
+from typing import Dict, List, Optional
+import json
 import logging
 
-from app.database.base import get_db
-from app.database.models import Channel, User, channel_members
-from app.models.channel import ChannelCreate, ChannelResponse, ChannelUpdate
+from app.database.base import get_db, insert_ignore_rows
+from app.database.models import Channel, ChannelRead, ChannelStats, Message, User, channel_members
+from app.models.channel import (
+    BulkMembershipRequest, ChannelCreate, ChannelDirectoryResponse, ChannelReadUpdate, ChannelResponse,
+    ChannelSummaryResponse, ChannelUpdate
+)
 from app.routers.auth import get_current_user
+from app.services.principal_cache import UserPrincipal
+from app.services.read_markers import read_markers
+from app.services.access_cache import ChannelInfo, access_cache
+from app.services.channel_auth import ADMIN, authorize_channel, can_admin_channel, can_read_channel
+from app.services.channel_directory import SORTS, decode_cursor, directory_cache, encode_cursor
+from app.services.autocomplete import prefix_index
+from app.services.direct_messages import find_or_create_dm_channel
+from app.services.channel_stats import mark_read, messages_after, start_reads_at_latest
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 
+def member_count_column():
+    """参加者数（一覧のクエリに相関サブクエリとして埋め込み、チャンネルごとのCOUNTを発行しない）"""
+    return select(func.count(channel_members.c.user_id)).where(
+        channel_members.c.channel_id == Channel.id
+    ).correlate(Channel).scalar_subquery().label("member_count")
+
+
+def serialize_channel(channel: Channel, member_count: int) -> dict:
+    return {
+        "id": channel.id,
+        "name": channel.name,
+        "description": channel.description,
+        "channel_type": channel.channel_type,
+        "is_private": channel.channel_type == 'private',
+        "is_direct_message": channel.channel_type == 'dm',
+        "is_archived": channel.is_archived,
+        "created_by": channel.created_by,
+        "created_at": channel.created_at,
+        "updated_at": channel.updated_at,
+        "member_count": member_count or 0
+    }
+
+
+def get_channel_with_count(db: Session, channel_id: int) -> dict:
+    channel, member_count = db.query(Channel, member_count_column()).filter(Channel.id == channel_id).one()
+    return serialize_channel(channel, member_count)
+
+
 @router.post("/", response_model=ChannelResponse)
 def create_channel(
     channel: ChannelCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: UserPrincipal = Depends(get_current_user)
 ):
     try:
         logger.info(f"Channel creation request from user {current_user.username}: {channel.dict()}")
@@ -40,6 +81,8 @@ def create_channel(
             created_by=current_user.id
         )
         db.add(db_channel)
+        db.flush()
+        db.add(ChannelStats(channel_id=db_channel.id, message_count=0))
         db.commit()
         db.refresh(db_channel)
         
@@ -52,10 +95,16 @@ def create_channel(
                 role='owner'
             )
         )
+        mark_read(db, current_user.id, db_channel.id)
         db.commit()
+        access_cache.invalidate_user(current_user.id)
+        if db_channel.channel_type == 'public':
+            access_cache.invalidate_public()
+            directory_cache.invalidate()
+        prefix_index.upsert_channel(db_channel.id, db_channel.name, db_channel.channel_type)
         
         logger.info(f"Channel {channel.name} created successfully with ID: {db_channel.id}")
-        return db_channel
+        return serialize_channel(db_channel, 1)
         
     except HTTPException:
         raise
@@ -73,14 +122,14 @@ def get_channels(
     skip: int = 0,
     limit: int = 100,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: UserPrincipal = Depends(get_current_user)
 ):
     # Get channels that user is a member of
-    channels = db.query(Channel).join(channel_members).filter(
+    rows = db.query(Channel, member_count_column()).join(channel_members).filter(
         channel_members.c.user_id == current_user.id
     ).offset(skip).limit(limit).all()
     
-    return channels
+    return [serialize_channel(channel, member_count) for channel, member_count in rows]
 
 
 @router.get("/public", response_model=List[ChannelResponse])
@@ -88,36 +137,226 @@ def get_public_channels(
     skip: int = 0,
     limit: int = 100,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: UserPrincipal = Depends(get_current_user)
 ):
     # Get all public channels
-    channels = db.query(Channel).filter(
+    rows = db.query(Channel, member_count_column()).filter(
         Channel.channel_type == 'public'
     ).offset(skip).limit(limit).all()
     
-    return channels
+    return [serialize_channel(channel, member_count) for channel, member_count in rows]
 
 
-@router.get("/{channel_id}", response_model=ChannelResponse)
-def get_channel(
-    channel_id: int,
+@router.get("/directory", response_model=ChannelDirectoryResponse)
+def get_channel_directory(
+    q: Optional[str] = Query(None, max_length=80, description="Channel name filter"),
+    match: str = Query("prefix", pattern="^(prefix|substring)$"),
+    sort: str = Query("name", pattern=f"^({'|'.join(SORTS)})$"),
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=100),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: UserPrincipal = Depends(get_current_user)
 ):
-    channel = db.query(Channel).filter(Channel.id == channel_id).first()
-    if not channel:
-        raise HTTPException(status_code=404, detail="Channel not found")
+    """公開チャンネルの一覧（名前で絞り込み、名前・参加者数・最終投稿順、カーソルでページ送り）
+
+    アーカイブ済みのチャンネルは含めない。検索語なしの1ページ目はキャッシュする。
+    """
+    q = (q or "").strip()
+    cache_key = (sort, limit)
+    cacheable = not q and cursor is None
+    if cacheable:
+        cached = directory_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    generation = directory_cache.generation
+    
+    position = None
+    if cursor is not None:
+        position = decode_cursor(cursor, sort)
+        if position is None:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    last_message_id = func.coalesce(ChannelStats.last_message_id, 0)
+    if sort == "members":
+        # One grouped scan of the membership index instead of a count per channel
+        counts = select(
+            channel_members.c.channel_id, func.count(channel_members.c.user_id).label("member_count")
+        ).group_by(channel_members.c.channel_id).subquery()
+        member_count = func.coalesce(counts.c.member_count, 0)
+        query = db.query(Channel, member_count, ChannelStats.last_message_at).outerjoin(
+            counts, counts.c.channel_id == Channel.id
+        )
+        key = member_count
+    else:
+        query = db.query(Channel, member_count_column(), ChannelStats.last_message_at)
+        key = Channel.name if sort == "name" else last_message_id
+    query = query.outerjoin(ChannelStats, ChannelStats.channel_id == Channel.id).filter(
+        Channel.channel_type == 'public',
+        or_(Channel.is_archived.is_(None), Channel.is_archived == False)
+    )
+    if q:
+        escaped = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        pattern = f"{escaped}%" if match == "prefix" else f"%{escaped}%"
+        query = query.filter(Channel.name.like(pattern, escape="\\"))
+    
+    # Names ascend; member counts and activity descend. Ties are broken by id.
+    if position is not None:
+        position_key, position_id = position
+        after = key > position_key if sort == "name" else key < position_key
+        query = query.filter(or_(after, and_(key == position_key, Channel.id > position_id)))
+    order = key.asc() if sort == "name" else key.desc()
+    if sort == "activity":
+        query = query.add_columns(last_message_id)
+    rows = query.order_by(order, Channel.id).limit(limit + 1).all()
+    
+    channels = []
+    for row in rows[:limit]:
+        channel, member_count_value, last_message_at = row[0], row[1], row[2]
+        entry = serialize_channel(channel, member_count_value)
+        entry["last_message_at"] = last_message_at
+        channels.append(entry)
+    
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        if sort == "name":
+            next_key = last[0].name
+        elif sort == "members":
+            next_key = last[1] or 0
+        else:
+            next_key = last[3]
+        next_cursor = encode_cursor(sort, next_key, last[0].id)
     
-    # Check if user is a member of the channel
-    member = db.query(channel_members).filter(
-        channel_members.c.user_id == current_user.id,
-        channel_members.c.channel_id == channel_id
-    ).first()
+    page = {"channels": channels, "next_cursor": next_cursor}
+    if cacheable:
+        directory_cache.put(cache_key, page, generation)
+    return page
+
+
+PREVIEW_LENGTH = 100
+
+
+@router.get("/summary", response_model=List[ChannelSummaryResponse])
+def get_channels_summary(
+    db: Session = Depends(get_db),
+    current_user: UserPrincipal = Depends(get_current_user)
+):
+    """サイドバー用: 参加中の全チャンネルの未読数・メンション数・最新メッセージ（クエリ数は一定）"""
+    rows = db.query(Channel, ChannelStats, ChannelRead).join(
+        channel_members, channel_members.c.channel_id == Channel.id
+    ).outerjoin(
+        ChannelStats, ChannelStats.channel_id == Channel.id
+    ).outerjoin(
+        ChannelRead, (ChannelRead.channel_id == Channel.id) & (ChannelRead.user_id == current_user.id)
+    ).filter(
+        channel_members.c.user_id == current_user.id
+    ).order_by(Channel.name).all()
+    
+    # Latest message previews and their senders, two queries for all channels
+    last_message_ids = [stats.last_message_id for _, stats, _ in rows if stats and stats.last_message_id]
+    last_messages = {
+        message.id: message
+        for message in db.query(Message).filter(Message.id.in_(last_message_ids)).all()
+    } if last_message_ids else {}
+    sender_ids = {message.user_id for message in last_messages.values()}
+    senders = {
+        user.id: user for user in db.query(User).filter(User.id.in_(sender_ids)).all()
+    } if sender_ids else {}
     
-    if not member and channel.channel_type == 'private':
-        raise HTTPException(status_code=403, detail="Access denied")
+    # Overlay read positions not yet flushed from memory; only partial reads need a count
+    pending = read_markers.pending(current_user.id)
+    partial = {}
+    for channel, stats, read in rows:
+        position = pending.get(channel.id)
+        last_message_id = (stats.last_message_id if stats else None) or 0
+        if position and position > (read.last_read_message_id if read else 0) and position < last_message_id:
+            partial[channel.id] = position
+    unread_after = messages_after(db, partial)
     
-    return channel
+    summaries = []
+    for channel, stats, read in rows:
+        message_count = stats.message_count if stats else 0
+        unread_count = max(message_count - (read.read_message_count if read else 0), 0)
+        mention_count = read.mention_count if read else 0
+        last_read_message_id = read.last_read_message_id if read else None
+        position = pending.get(channel.id)
+        if position and position > (last_read_message_id or 0):
+            if channel.id in partial:
+                unread_count = unread_after.get(channel.id, 0)
+                last_read_message_id = position
+            else:
+                unread_count = mention_count = 0
+                last_read_message_id = (stats.last_message_id if stats else None) or position
+        last_message = last_messages.get(stats.last_message_id) if stats else None
+        preview = None
+        if last_message:
+            sender = senders.get(last_message.user_id)
+            preview = {
+                "id": last_message.id,
+                "content": last_message.content[:PREVIEW_LENGTH],
+                "user_id": last_message.user_id,
+                "sender_name": (sender.display_name or sender.username) if sender else None,
+                "created_at": last_message.created_at
+            }
+        summaries.append({
+            "id": channel.id,
+            "name": channel.name,
+            "channel_type": channel.channel_type,
+            "unread_count": unread_count,
+            "mention_count": mention_count,
+            "last_read_message_id": last_read_message_id,
+            "last_message": preview
+        })
+    return summaries
+
+
+@router.put("/{channel_id}/read")
+def mark_channel_read(
+    channel_id: int,
+    update: ChannelReadUpdate,
+    db: Session = Depends(get_db),
+    current_user: UserPrincipal = Depends(get_current_user),
+    _: ChannelInfo = Depends(can_read_channel)
+):
+    """既読位置を更新（message_id省略時は最新まで）
+
+    スクロールに合わせて頻繁に呼ばれるため、メモリ上に記録して定期的にまとめてDBへ反映する。
+    """
+    message_id = update.message_id
+    if message_id is None:
+        message_id = db.query(ChannelStats.last_message_id).filter(
+            ChannelStats.channel_id == channel_id
+        ).scalar()
+    if message_id:
+        read_markers.record(current_user.id, channel_id, message_id)
+    return {"message": "Marked as read"}
+
+
+@router.get("/{channel_id}/read")
+def get_channel_read(
+    channel_id: int,
+    db: Session = Depends(get_db),
+    current_user: UserPrincipal = Depends(get_current_user),
+    _: ChannelInfo = Depends(can_read_channel)
+):
+    """既読位置（未反映の値を含む）"""
+    last_read_message_id = db.query(ChannelRead.last_read_message_id).filter(
+        ChannelRead.user_id == current_user.id,
+        ChannelRead.channel_id == channel_id
+    ).scalar()
+    pending = read_markers.pending_for(current_user.id, channel_id)
+    if pending and pending > (last_read_message_id or 0):
+        last_read_message_id = pending
+    return {"channel_id": channel_id, "last_read_message_id": last_read_message_id}
+
+
+@router.get("/{channel_id}", response_model=ChannelResponse)
+def get_channel(
+    channel_id: int,
+    db: Session = Depends(get_db),
+    _: ChannelInfo = Depends(can_read_channel)
+):
+    return get_channel_with_count(db, channel_id)
 
 
 @router.put("/{channel_id}", response_model=ChannelResponse)
@@ -125,21 +364,9 @@ def update_channel(
     channel_id: int,
     channel_update: ChannelUpdate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    _: ChannelInfo = Depends(can_admin_channel)
 ):
     channel = db.query(Channel).filter(Channel.id == channel_id).first()
-    if not channel:
-        raise HTTPException(status_code=404, detail="Channel not found")
-    
-    # Check if user is admin of the channel
-    member = db.query(channel_members).filter(
-        channel_members.c.user_id == current_user.id,
-        channel_members.c.channel_id == channel_id,
-        channel_members.c.role.in_(['admin', 'owner'])
-    ).first()
-    
-    if not member:
-        raise HTTPException(status_code=403, detail="Admin access required")
     
     # Update channel
     if channel_update.name is not None:
@@ -155,34 +382,143 @@ def update_channel(
     if channel_update.description is not None:
         channel.description = channel_update.description
     
+    visibility_changed = False
     if channel_update.is_private is not None:
-        channel.channel_type = 'private' if channel_update.is_private else 'public'
+        new_type = 'private' if channel_update.is_private else 'public'
+        visibility_changed = new_type != channel.channel_type
+        channel.channel_type = new_type
+    
+    if channel_update.is_archived is not None:
+        channel.is_archived = channel_update.is_archived
     
     db.commit()
     db.refresh(channel)
-    return channel
+    access_cache.invalidate_channel(channel.id)
+    if visibility_changed:
+        access_cache.invalidate_public()
+    directory_cache.invalidate()
+    prefix_index.upsert_channel(channel.id, channel.name, channel.channel_type)
+    return get_channel_with_count(db, channel.id)
+
+
+async def notify_membership_changed(event: str, counts: Dict[int, int]):
+    """チャンネルごとに1件だけメンバー変更を通知"""
+    from app.main import manager  # Imported lazily: app.main imports this router
+    for channel_id, count in counts.items():
+        await manager.broadcast_to_channel(
+            json.dumps({"type": event, "channel_id": channel_id, "count": count}),
+            str(channel_id)
+        )
+
+
+def authorize_bulk_membership(db: Session, current_user: UserPrincipal, request: BulkMembershipRequest):
+    """一括操作の対象を検証し、(チャンネルID一覧, ユーザーID一覧) を返す"""
+    channel_ids = sorted(set(request.channel_ids))
+    for channel_id in channel_ids:
+        authorize_channel(db, current_user.id, channel_id, ADMIN)
+    user_ids = sorted(set(request.user_ids))
+    known = {row.id for row in db.query(User.id).filter(User.id.in_(user_ids))}
+    unknown = [user_id for user_id in user_ids if user_id not in known]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown user ids: {unknown[:20]}")
+    return channel_ids, user_ids
+
+
+@router.post("/members/bulk-add")
+def bulk_add_members(
+    request: BulkMembershipRequest,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    current_user: UserPrincipal = Depends(get_current_user)
+):
+    """複数ユーザーを複数チャンネルへ1トランザクションで追加（参加済みのユーザーは無視）
+
+    全チャンネルの管理者のみ実行できる。
+    """
+    channel_ids, user_ids = authorize_bulk_membership(db, current_user, request)
+    existing = set(
+        db.query(channel_members.c.channel_id, channel_members.c.user_id).filter(
+            channel_members.c.channel_id.in_(channel_ids),
+            channel_members.c.user_id.in_(user_ids)
+        ).all()
+    )
+    added = {
+        channel_id: [user_id for user_id in user_ids if (channel_id, user_id) not in existing]
+        for channel_id in channel_ids
+    }
+    rows = [
+        {"channel_id": channel_id, "user_id": user_id, "role": request.role}
+        for channel_id, new_user_ids in added.items()
+        for user_id in new_user_ids
+    ]
+    # Rows added concurrently are skipped by the unique key instead of failing the batch
+    insert_ignore_rows(db, channel_members, rows)
+    start_reads_at_latest(db, added)
+    db.commit()
+    access_cache.invalidate_users(user_ids)
+    
+    counts = {channel_id: len(new_user_ids) for channel_id, new_user_ids in added.items() if new_user_ids}
+    background_tasks.add_task(notify_membership_changed, "members_added", counts)
+    return {"added": len(rows), "channels": counts}
+
+
+@router.post("/members/bulk-remove")
+def bulk_remove_members(
+    request: BulkMembershipRequest,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    current_user: UserPrincipal = Depends(get_current_user)
+):
+    """複数ユーザーを複数チャンネルから1トランザクションで削除（オーナーは削除しない）"""
+    channel_ids, user_ids = authorize_bulk_membership(db, current_user, request)
+    condition = (
+        channel_members.c.channel_id.in_(channel_ids)
+        & channel_members.c.user_id.in_(user_ids)
+        & (channel_members.c.role != 'owner')
+    )
+    counts = dict(
+        db.query(channel_members.c.channel_id, func.count(channel_members.c.id)).filter(
+            condition
+        ).group_by(channel_members.c.channel_id).all()
+    )
+    db.execute(channel_members.delete().where(condition))
+    db.commit()
+    access_cache.invalidate_users(user_ids)
+    
+    background_tasks.add_task(notify_membership_changed, "members_removed", counts)
+    return {"removed": sum(counts.values()), "channels": counts}
+
+
+@router.post("/dm/{user_id}", response_model=ChannelResponse)
+def open_direct_message(
+    user_id: int,
+    db: Session = Depends(get_db),
+    current_user: UserPrincipal = Depends(get_current_user)
+):
+    """指定ユーザーとのDMチャンネルを取得（無ければ作成）"""
+    if db.query(User.id).filter(User.id == user_id).first() is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    channel_id, created = find_or_create_dm_channel(db, current_user.id, user_id)
+    if created:
+        logger.info(f"Direct message channel {channel_id} created for users {current_user.id} and {user_id}")
+    return get_channel_with_count(db, channel_id)
 
 
 @router.post("/{channel_id}/join")
 def join_channel(
     channel_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: UserPrincipal = Depends(get_current_user)
 ):
-    channel = db.query(Channel).filter(Channel.id == channel_id).first()
+    channel = access_cache.channel(db, channel_id)
     if not channel:
         raise HTTPException(status_code=404, detail="Channel not found")
     
-    if channel.channel_type == 'private':
+    if channel.channel_type != 'public':
         raise HTTPException(status_code=403, detail="Cannot join private channel")
     
     # Check if already a member
-    existing_member = db.query(channel_members).filter(
-        channel_members.c.user_id == current_user.id,
-        channel_members.c.channel_id == channel_id
-    ).first()
-    
-    if existing_member:
+    if access_cache.is_member(db, current_user.id, channel_id):
         raise HTTPException(status_code=400, detail="Already a member")
     
     # Add user to channel
@@ -193,7 +529,10 @@ def join_channel(
             role='member'
         )
     )
+    # Start with the existing history marked as read
+    mark_read(db, current_user.id, channel_id)
     db.commit()
+    access_cache.invalidate_user(current_user.id)
     
     return {"message": "Successfully joined channel"}
 
@@ -202,15 +541,10 @@ def join_channel(
 def leave_channel(
     channel_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: UserPrincipal = Depends(get_current_user)
 ):
     # Check if user is a member
-    member = db.query(channel_members).filter(
-        channel_members.c.user_id == current_user.id,
-        channel_members.c.channel_id == channel_id
-    ).first()
-    
-    if not member:
+    if not access_cache.is_member(db, current_user.id, channel_id):
         raise HTTPException(status_code=400, detail="Not a member of this channel")
     
     # Remove user from channel
@@ -221,5 +555,6 @@ def leave_channel(
         )
     )
     db.commit()
+    access_cache.invalidate_user(current_user.id)
     
     return {"message": "Successfully left channel"}
\ No newline at end of file
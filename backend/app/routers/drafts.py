@@ -4,35 +4,92 @@ from typing import List, Optional
 import logging
 
 from app.database.base import get_db
-from app.database.models import MessageDraft, Channel, User, channel_members, Message
+from app.database.models import MessageDraft, User, Message
 from app.models.draft import DraftCreate, DraftResponse, DraftUpdate
 from app.routers.auth import get_current_user
+from app.services.principal_cache import UserPrincipal
+from app.services.channel_auth import authorize_channel, can_read
+from app.services.drafts import PendingDraft, draft_buffer
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 
+def draft_data(
+    user_id: int,
+    channel_id: int,
+    draft: Optional[MessageDraft],
+    pending: Optional[PendingDraft] = None
+) -> dict:
+    """DBのドラフトに未反映の保存内容を重ねたレスポンス（reply_to は呼び出し側で設定）"""
+    source = pending if pending is not None else draft
+    return {
+        "id": draft.id if draft else None,
+        "content": source.content,
+        "channel_id": channel_id,
+        "user_id": user_id,
+        "reply_to_id": source.reply_to_id,
+        "created_at": draft.created_at if draft else None,
+        "updated_at": source.updated_at,
+        "reply_to": None
+    }
+
+
+def attach_quoted_messages(db: Session, user_id: int, responses: List[dict]) -> List[dict]:
+    """ドラフトの引用元メッセージと送信者をまとめて読み込み reply_to に設定（ドラフト数によらず2クエリ）
+
+    引用元はドラフトと同じチャンネルにあり、ユーザーが閲覧できる場合だけ返す。
+    """
+    message_ids = {response["reply_to_id"] for response in responses if response["reply_to_id"]}
+    if not message_ids:
+        return responses
+    messages = {
+        message.id: message
+        for message in db.query(Message).filter(Message.id.in_(message_ids)).all()
+    }
+    sender_ids = {message.user_id for message in messages.values()}
+    senders = {
+        user.id: user for user in db.query(User).filter(User.id.in_(sender_ids)).all()
+    } if sender_ids else {}
+    
+    for response in responses:
+        quoted_message = messages.get(response["reply_to_id"])
+        if (
+            quoted_message is None
+            or quoted_message.channel_id != response["channel_id"]
+            or not can_read(db, user_id, quoted_message.channel_id)
+        ):
+            continue
+        quoted_sender = senders.get(quoted_message.user_id)
+        response["reply_to"] = {
+            "id": quoted_message.id,
+            "content": quoted_message.content,
+            "user_id": quoted_message.user_id,
+            "created_at": quoted_message.created_at,
+            "sender": {
+                "id": quoted_sender.id,
+                "username": quoted_sender.username,
+                "display_name": quoted_sender.display_name
+            } if quoted_sender else None
+        }
+    return responses
+
+
 @router.get("/channel/{channel_id}", response_model=Optional[DraftResponse])
 def get_channel_draft(
     channel_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: UserPrincipal = Depends(get_current_user)
 ):
     """指定チャンネルのユーザーのドラフトを取得"""
     # Check if channel exists and user has access
-    channel = db.query(Channel).filter(Channel.id == channel_id).first()
-    if not channel:
-        raise HTTPException(status_code=404, detail="Channel not found")
-    
-    # Check if user is a member of the channel
-    member = db.query(channel_members).filter(
-        channel_members.c.user_id == current_user.id,
-        channel_members.c.channel_id == channel_id
-    ).first()
+    authorize_channel(db, current_user.id, channel_id)
     
-    if not member and channel.channel_type == 'private':
-        raise HTTPException(status_code=403, detail="Access denied")
+    # Saves not yet flushed take precedence over the stored draft
+    pending = draft_buffer.get(current_user.id, channel_id)
+    if pending is not None and pending.deleted:
+        return None
     
     # Get draft
     draft = db.query(MessageDraft).filter(
@@ -40,39 +97,10 @@ def get_channel_draft(
         MessageDraft.user_id == current_user.id
     ).first()
     
-    if not draft:
+    if not draft and pending is None:
         return None
-    
-    # Get quoted message data if this is a quoted reply
-    reply_to_data = None
-    if draft.reply_to_id:
-        quoted_message = db.query(Message).filter(Message.id == draft.reply_to_id).first()
-        if quoted_message:
-            quoted_sender = db.query(User).filter(User.id == quoted_message.user_id).first()
-            reply_to_data = {
-                "id": quoted_message.id,
-                "content": quoted_message.content,
-                "user_id": quoted_message.user_id,
-                "created_at": quoted_message.created_at,
-                "sender": {
-                    "id": quoted_sender.id,
-                    "username": quoted_sender.username,
-                    "display_name": quoted_sender.display_name
-                } if quoted_sender else None
-            }
-    
-    # Manually serialize the response
-    response_data = {
-        "id": draft.id,
-        "content": draft.content,
-        "channel_id": draft.channel_id,
-        "user_id": draft.user_id,
-        "reply_to_id": draft.reply_to_id,
-        "created_at": draft.created_at,
-        "updated_at": draft.updated_at,
-        "reply_to": reply_to_data
-    }
-    return response_data
+    response_data = draft_data(current_user.id, channel_id, draft, pending)
+    return attach_quoted_messages(db, current_user.id, [response_data])[0]
 
 
 @router.post("/channel/{channel_id}", response_model=DraftResponse)
@@ -80,121 +108,45 @@ def save_channel_draft(
     channel_id: int,
     draft: DraftCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: UserPrincipal = Depends(get_current_user)
 ):
-    """チャンネルのドラフトを保存または更新"""
+    """チャンネルのドラフトを保存または更新
+
+    自動保存で頻繁に呼ばれるため、メモリ上に記録して定期的にまとめてDBへ反映する。
+    """
     # Check if channel exists and user has access
-    channel = db.query(Channel).filter(Channel.id == channel_id).first()
-    if not channel:
-        raise HTTPException(status_code=404, detail="Channel not found")
-    
-    # Check if user is a member of the channel
-    member = db.query(channel_members).filter(
-        channel_members.c.user_id == current_user.id,
-        channel_members.c.channel_id == channel_id
-    ).first()
-    
-    if not member and channel.channel_type == 'private':
-        raise HTTPException(status_code=403, detail="Access denied")
+    authorize_channel(db, current_user.id, channel_id)
     
     # Empty content means delete draft
     if not draft.content.strip():
-        existing_draft = db.query(MessageDraft).filter(
-            MessageDraft.channel_id == channel_id,
-            MessageDraft.user_id == current_user.id
-        ).first()
-        if existing_draft:
-            db.delete(existing_draft)
-            db.commit()
+        draft_buffer.delete(current_user.id, channel_id)
         raise HTTPException(status_code=204, detail="Draft deleted")
     
-    # Check if draft already exists
-    existing_draft = db.query(MessageDraft).filter(
-        MessageDraft.channel_id == channel_id,
-        MessageDraft.user_id == current_user.id
-    ).first()
-    
-    if existing_draft:
-        # Update existing draft
-        existing_draft.content = draft.content
-        existing_draft.reply_to_id = draft.reply_to_id
-        db.commit()
-        db.refresh(existing_draft)
-        db_draft = existing_draft
-    else:
-        # Create new draft
-        db_draft = MessageDraft(
-            content=draft.content,
-            channel_id=channel_id,
-            user_id=current_user.id,
-            reply_to_id=draft.reply_to_id
-        )
-        db.add(db_draft)
-        db.commit()
-        db.refresh(db_draft)
-    
-    # Get quoted message data if this is a quoted reply
-    reply_to_data = None
-    if db_draft.reply_to_id:
-        quoted_message = db.query(Message).filter(Message.id == db_draft.reply_to_id).first()
-        if quoted_message:
-            quoted_sender = db.query(User).filter(User.id == quoted_message.user_id).first()
-            reply_to_data = {
-                "id": quoted_message.id,
-                "content": quoted_message.content,
-                "user_id": quoted_message.user_id,
-                "created_at": quoted_message.created_at,
-                "sender": {
-                    "id": quoted_sender.id,
-                    "username": quoted_sender.username,
-                    "display_name": quoted_sender.display_name
-                } if quoted_sender else None
-            }
-    
-    # Manually serialize the response
-    response_data = {
-        "id": db_draft.id,
-        "content": db_draft.content,
-        "channel_id": db_draft.channel_id,
-        "user_id": db_draft.user_id,
-        "reply_to_id": db_draft.reply_to_id,
-        "created_at": db_draft.created_at,
-        "updated_at": db_draft.updated_at,
-        "reply_to": reply_to_data
-    }
-    return response_data
+    # Only messages from the draft's own channel can be quoted; autosaves that keep the
+    # buffered quote were already checked when it was set
+    previous = draft_buffer.get(current_user.id, channel_id)
+    if draft.reply_to_id is not None and (previous is None or previous.reply_to_id != draft.reply_to_id):
+        quoted_channel_id = db.query(Message.channel_id).filter(Message.id == draft.reply_to_id).scalar()
+        if quoted_channel_id != channel_id:
+            raise HTTPException(status_code=400, detail="Quoted message is not in this channel")
+    
+    pending = draft_buffer.save(current_user.id, channel_id, draft.content, draft.reply_to_id)
+    # The client already has the quoted message; reply_to is filled in when drafts are read
+    return draft_data(current_user.id, channel_id, None, pending)
 
 
 @router.delete("/channel/{channel_id}")
 def delete_channel_draft(
     channel_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: UserPrincipal = Depends(get_current_user)
 ):
     """チャンネルのドラフトを削除"""
     # Check if channel exists and user has access
-    channel = db.query(Channel).filter(Channel.id == channel_id).first()
-    if not channel:
-        raise HTTPException(status_code=404, detail="Channel not found")
+    authorize_channel(db, current_user.id, channel_id)
     
-    # Check if user is a member of the channel
-    member = db.query(channel_members).filter(
-        channel_members.c.user_id == current_user.id,
-        channel_members.c.channel_id == channel_id
-    ).first()
-    
-    if not member and channel.channel_type == 'private':
-        raise HTTPException(status_code=403, detail="Access denied")
-    
-    # Delete draft
-    draft = db.query(MessageDraft).filter(
-        MessageDraft.channel_id == channel_id,
-        MessageDraft.user_id == current_user.id
-    ).first()
-    
-    if draft:
-        db.delete(draft)
-        db.commit()
+    # Recorded like a save; the row is removed on the next flush
+    draft_buffer.delete(current_user.id, channel_id)
     
     return {"message": "Draft deleted successfully"}
 
@@ -202,44 +154,21 @@ def delete_channel_draft(
 @router.get("/", response_model=List[DraftResponse])
 def get_all_drafts(
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: UserPrincipal = Depends(get_current_user)
 ):
     """現在のユーザーの全てのドラフトを取得"""
-    drafts = db.query(MessageDraft).filter(
-        MessageDraft.user_id == current_user.id
-    ).all()
+    stored = {
+        draft.channel_id: draft
+        for draft in db.query(MessageDraft).filter(MessageDraft.user_id == current_user.id).all()
+    }
+    pending = draft_buffer.pending(current_user.id)
     
     serialized_drafts = []
-    for draft in drafts:
-        # Get quoted message data if this is a quoted reply
-        reply_to_data = None
-        if draft.reply_to_id:
-            quoted_message = db.query(Message).filter(Message.id == draft.reply_to_id).first()
-            if quoted_message:
-                quoted_sender = db.query(User).filter(User.id == quoted_message.user_id).first()
-                reply_to_data = {
-                    "id": quoted_message.id,
-                    "content": quoted_message.content,
-                    "user_id": quoted_message.user_id,
-                    "created_at": quoted_message.created_at,
-                    "sender": {
-                        "id": quoted_sender.id,
-                        "username": quoted_sender.username,
-                        "display_name": quoted_sender.display_name
-                    } if quoted_sender else None
-                }
-        
-        # Manually serialize the response
-        response_data = {
-            "id": draft.id,
-            "content": draft.content,
-            "channel_id": draft.channel_id,
-            "user_id": draft.user_id,
-            "reply_to_id": draft.reply_to_id,
-            "created_at": draft.created_at,
-            "updated_at": draft.updated_at,
-            "reply_to": reply_to_data
-        }
-        serialized_drafts.append(response_data)
+    for channel_id in sorted(set(stored) | set(pending)):
+        if channel_id in pending and pending[channel_id].deleted:
+            continue
+        serialized_drafts.append(
+            draft_data(current_user.id, channel_id, stored.get(channel_id), pending.get(channel_id))
+        )
     
-    return serialized_drafts
\ No newline at end of file
+    return attach_quoted_messages(db, current_user.id, serialized_drafts)
\ No newline at end of file
@@ -1,14 +1,37 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import RedirectResponse
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import hashlib
 import os
 import uuid
 import mimetypes
+import tempfile
+from collections import Counter
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Dict
+from typing import List, Optional, Tuple
 import logging
+from multipart.multipart import MultipartParser, parse_options_header
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
 
+from app.core.config import settings
+from app.database.base import SessionLocal, get_db
+from app.database.models import FileBlob, FileRecord
+from app.models.file import FileHashUpload, FileRecordResponse, ResumableUploadCreate
 from app.routers.auth import get_current_user
-from app.database.models import User
+from app.services.principal_cache import UserPrincipal
+from app.services.access_cache import ChannelInfo, access_cache
+from app.services.channel_auth import can_read_channel
+from app.services.file_responses import cached_file_response
+from app.services.rate_limit import route_limit
+from app.services.storage import create_storage, is_valid_name
+from app.services.upload_sessions import UploadLimitExceeded, UploadSessionStore
+from app.services.thumbnails import (
+    THUMBNAIL_SIZES, get_or_create_thumbnail, remove_thumbnails, schedule_thumbnails,
+    supports_thumbnail, thumbnail_path
+)
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +40,10 @@ router = APIRouter()
 # ファイルアップロード設定
 UPLOAD_DIRECTORY = Path("uploads")
 UPLOAD_DIRECTORY.mkdir(exist_ok=True)
+THUMBNAIL_DIRECTORY = UPLOAD_DIRECTORY / "thumbs"
+THUMBNAIL_DIRECTORY.mkdir(exist_ok=True)
+storage = create_storage(UPLOAD_DIRECTORY)
+upload_sessions = UploadSessionStore(UPLOAD_DIRECTORY / ".sessions")
 
 # 許可されるファイル拡張子とMIMEタイプ
 ALLOWED_EXTENSIONS = {
@@ -33,64 +60,361 @@ ALLOWED_MIME_TYPES = {
 }
 
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB
+RESUMABLE_CHUNK_SIZE = 5 * 1024 * 1024  # 再開可能アップロードの推奨チャンクサイズ
+MAX_RESUMABLE_CHUNK_SIZE = 16 * 1024 * 1024
+MULTIPART_OVERHEAD = 64 * 1024  # Boundaries and part headers around the file in an upload body
 
-def validate_file(file: UploadFile) -> None:
+# Uploads hold a disk writer and a DB session for their whole duration
+upload_limit = route_limit(max_concurrent=settings.upload_max_concurrent)
+
+def file_too_large() -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"ファイルサイズが大きすぎます。最大 {MAX_FILE_SIZE // (1024*1024)}MB まで対応しています。"
+    )
+
+def validate_file_info(filename: Optional[str], content_type: Optional[str], size: Optional[int]) -> None:
     """ファイルのバリデーション"""
-    # ファイルサイズチェック
-    if file.size and file.size > MAX_FILE_SIZE:
-        raise HTTPException(
-            status_code=413,
-            detail=f"ファイルサイズが大きすぎます。最大 {MAX_FILE_SIZE // (1024*1024)}MB まで対応しています。"
-        )
+    # ファイルサイズチェック（申告値。実際のサイズは受信中にも検査する）
+    if size and size > MAX_FILE_SIZE:
+        raise file_too_large()
     
     # MIMEタイプチェック
-    if file.content_type not in ALLOWED_MIME_TYPES:
+    if content_type not in ALLOWED_MIME_TYPES:
         raise HTTPException(
             status_code=400,
             detail="サポートされていないファイル形式です。"
         )
     
     # 拡張子チェック
-    if file.filename:
-        file_extension = Path(file.filename).suffix.lower()
+    if filename:
+        file_extension = Path(filename).suffix.lower()
         if file_extension not in ALLOWED_EXTENSIONS:
             raise HTTPException(
                 status_code=400,
                 detail="サポートされていないファイル拡張子です。"
             )
 
-def get_safe_filename(filename: str) -> str:
-    """安全なファイル名を生成"""
-    # UUIDを使ってユニークなファイル名を生成
+def _multipart_events(boundary: bytes) -> Tuple[MultipartParser, list]:
+    # The parser calls back synchronously; events are handled after each write so file I/O can be awaited
+    events: list = []
+    callbacks = {
+        "on_part_begin": lambda: events.append(("part_begin", b"")),
+        "on_header_field": lambda data, start, end: events.append(("header_field", data[start:end])),
+        "on_header_value": lambda data, start, end: events.append(("header_value", data[start:end])),
+        "on_header_end": lambda: events.append(("header_end", b"")),
+        "on_headers_finished": lambda: events.append(("headers_finished", b"")),
+        "on_part_data": lambda data, start, end: events.append(("part_data", data[start:end])),
+        "on_part_end": lambda: events.append(("part_end", b"")),
+    }
+    return MultipartParser(boundary, callbacks), events
+
+async def stream_upload_to_temp(request: Request) -> Tuple[Path, str, int, str, str]:
+    """multipartのアップロードを受信しながら一時ファイルへチャンク単位で書き込む
+
+    フォームを先にスプールせず本文を直接読み、"file" パートだけを書き出す。
+    形式はパートのヘッダーで、サイズ上限は受信しながら検査し、SHA-256も同時に計算する。
+    (一時ファイル, SHA-256, サイズ, ファイル名, MIMEタイプ) を返す。
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise HTTPException(status_code=400, detail="multipart/form-data で送信してください。")
+    # Reject a declared oversize body before reading any of it
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > MAX_FILE_SIZE + MULTIPART_OVERHEAD:
+        raise file_too_large()
+    
+    parser, events = _multipart_events(boundary)
+    digest = hashlib.sha256()
+    received = 0
+    tmp_path = UPLOAD_DIRECTORY / f".{uuid.uuid4()}.part"
+    buffer = None
+    filename = mime_type = None
+    headers: dict = {}
+    header_field = header_value = b""
+    in_file = done = False
+    try:
+        async for body in request.stream():
+            parser.write(body)
+            for event, data in events:
+                if event == "part_begin":
+                    headers = {}
+                    header_field = header_value = b""
+                elif event == "header_field":
+                    header_field += data
+                elif event == "header_value":
+                    header_value += data
+                elif event == "header_end":
+                    headers[header_field.lower()] = header_value
+                    header_field = header_value = b""
+                elif event == "headers_finished":
+                    _, options = parse_options_header(headers.get(b"content-disposition", b""))
+                    in_file = not done and options.get(b"name") == b"file" and b"filename" in options
+                    if in_file:
+                        filename = options[b"filename"].decode("utf-8", "replace")
+                        mime_type = headers.get(b"content-type", b"").decode("latin-1")
+                        validate_file_info(filename, mime_type, None)
+                        # Blocking file I/O runs in the threadpool so the event loop is never stalled
+                        buffer = await run_in_threadpool(open, tmp_path, "wb")
+                elif event == "part_data" and in_file:
+                    received += len(data)
+                    if received > MAX_FILE_SIZE:
+                        raise file_too_large()
+                    digest.update(data)
+                    await run_in_threadpool(buffer.write, data)
+                elif event == "part_end" and in_file:
+                    in_file = False
+                    done = True
+            events.clear()
+        parser.finalize()
+        if not done:
+            raise HTTPException(status_code=400, detail="ファイルが含まれていません。")
+        await run_in_threadpool(buffer.close)
+    except BaseException:
+        if buffer is not None:
+            await run_in_threadpool(buffer.close)
+            await run_in_threadpool(_remove_if_exists, tmp_path)
+        raise
+    return tmp_path, digest.hexdigest(), received, filename or "unknown", mime_type
+
+def _remove_if_exists(path: Path) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def get_blob_name(sha256: str, filename: str) -> str:
+    """内容のハッシュから保存ファイル名を生成（同じ内容なら同じ名前）"""
+    file_extension = Path(filename).suffix.lower()
+    return f"{sha256}{file_extension}"
+
+def get_upload_name(filename: str) -> str:
+    """アップロードごとの推測できない公開名を生成（URLにはこちらを使う）"""
     file_extension = Path(filename).suffix.lower()
-    safe_name = f"{uuid.uuid4()}{file_extension}"
-    return safe_name
+    return f"{uuid.uuid4().hex}{file_extension}"
+
+def new_file_record(blob_name: str, filename: str, size: int, user_id: int, mime_type: Optional[str]) -> FileRecord:
+    return FileRecord(
+        name=get_upload_name(filename), blob_name=blob_name, filename=filename,
+        size=size, mime_type=mime_type, user_id=user_id
+    )
+
+def store_blob(
+    db: Session,
+    tmp_path: Path,
+    sha256: str,
+    filename: str,
+    size: int,
+    user_id: int,
+    mime_type: Optional[str]
+) -> FileRecord:
+    """一時ファイルをブロブとして保存し、アップロードの記録（参照1つ分）を作成
+
+    既に同じ内容のブロブがあれば一時ファイルは捨てる。作成した記録を返す。
+    ファイルの配置はブロブの行をロックしたまま行うので、並行する削除やGCと競合しない。
+    """
+    blob_name = get_blob_name(sha256, filename)
+    for _ in range(3):
+        try:
+            db.add(FileBlob(name=blob_name, sha256=sha256, size=size, ref_count=1))
+            db.flush()
+        except IntegrityError:
+            # Known content (possibly uploaded concurrently): lock its row and take another reference
+            db.rollback()
+            blob = db.query(FileBlob).filter(FileBlob.name == blob_name).with_for_update().first()
+            if blob is None:
+                # Released in the meantime: store it as new content
+                continue
+            blob.ref_count += 1
+        
+        try:
+            if storage.exists(blob_name):
+                _remove_if_exists(tmp_path)
+            else:
+                storage.put(tmp_path, blob_name)
+            record = new_file_record(blob_name, filename, size, user_id, mime_type)
+            db.add(record)
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+        return record
+    raise RuntimeError(f"Could not store blob {blob_name}")
+
+def can_claim_blob(db: Session, blob_name: str, user_id: int) -> bool:
+    """既にその内容を見られるユーザーか（自分のアップロード、または閲覧できるチャンネルに投稿済み）"""
+    if db.query(FileRecord.id).filter(
+        FileRecord.blob_name == blob_name, FileRecord.user_id == user_id
+    ).first():
+        return True
+    channel_ids = access_cache.accessible_channel_ids(db, user_id)
+    if not channel_ids:
+        return False
+    return db.query(FileRecord.id).filter(
+        FileRecord.blob_name == blob_name,
+        FileRecord.message_id.isnot(None),
+        FileRecord.channel_id.in_(channel_ids)
+    ).first() is not None
 
-@router.post("/upload")
+def add_blob_reference(db: Session, blob_name: str, filename: str, user_id: int) -> Optional[FileRecord]:
+    """既存ブロブへの参照としてアップロードを記録（ブロブが無ければNone）"""
+    blob = db.query(FileBlob).filter(FileBlob.name == blob_name).with_for_update().first()
+    if not blob or not storage.exists(blob_name):
+        db.rollback()
+        return None
+    blob.ref_count += 1
+    mime_type, _ = mimetypes.guess_type(filename)
+    record = new_file_record(blob_name, filename, blob.size, user_id, mime_type)
+    db.add(record)
+    db.commit()
+    return record
+
+def release_blob(db: Session, blob_name: str, record: Optional[FileRecord] = None) -> bool:
+    """ブロブの参照カウントを1減らし、最後の参照ならファイルを削除（ブロブが無ければFalse）
+
+    record を渡すと、その記録の削除も同じトランザクションで行い、参照カウントとずれないようにする。
+    """
+    blob = db.query(FileBlob).filter(FileBlob.name == blob_name).with_for_update().first()
+    if record is not None:
+        db.delete(record)
+    if not blob:
+        db.commit()
+        return False
+    blob.ref_count -= 1
+    if blob.ref_count <= 0:
+        # Delete the file while the row is still locked so a concurrent store cannot reuse it
+        storage.delete(blob_name)
+        remove_thumbnails(blob_name, THUMBNAIL_DIRECTORY)
+        db.delete(blob)
+    db.commit()
+    return True
+
+def resolve_file_name(db: Session, name: str) -> Optional[str]:
+    """公開名から保存ファイル名を引く（内容アドレスのブロブ名を直接指定されたらNone）"""
+    record = db.query(FileRecord.blob_name).filter(FileRecord.name == name).first()
+    if record:
+        return record.blob_name
+    if db.query(FileBlob.name).filter(FileBlob.name == name).first():
+        return None
+    # Files stored before content addressing are served under their own (random) name
+    return name
+
+def schedule_blob_thumbnails(blob_name: str) -> None:
+    # Remote backends generate thumbnails lazily on first request
+    source_path = storage.local_path(blob_name)
+    if source_path is not None:
+        schedule_thumbnails(source_path, THUMBNAIL_DIRECTORY)
+
+def serialize_file_record(record: FileRecord) -> dict:
+    return {
+        "id": record.id,
+        "filename": record.filename,
+        "file_url": f"/files/{record.name}",
+        "size": record.size,
+        "mime_type": record.mime_type,
+        "user_id": record.user_id,
+        "channel_id": record.channel_id,
+        "message_id": record.message_id,
+        "created_at": record.created_at
+    }
+
+def collect_orphan_files(db: Session, grace_hours: float, batch_size: int) -> Tuple[int, int]:
+    """未参照のアップロードを1バッチ分削除する。(削除した記録数, 削除したブロブ数) を返す
+
+    メッセージに紐付かないまま猶予期間を過ぎた記録を消して参照カウントを減らし、
+    参照が無くなったブロブのファイルを削除する。ロックは1ブロブずつ短時間だけ取る。
+    """
+    cutoff = datetime.utcnow() - timedelta(hours=grace_hours)
+    # Locked so a message cannot link a record between the SELECT and the DELETE
+    records = db.query(FileRecord.id, FileRecord.blob_name).filter(
+        FileRecord.message_id.is_(None),
+        FileRecord.created_at < cutoff
+    ).order_by(FileRecord.id).limit(batch_size).with_for_update().all()
+    if records:
+        record_ids = [record.id for record in records]
+        deleted = db.query(FileRecord).filter(
+            FileRecord.id.in_(record_ids),
+            FileRecord.message_id.is_(None)
+        ).delete(synchronize_session=False)
+        if deleted != len(records):
+            # Linked in the meantime (backends without row locks): only release what was deleted
+            kept = {row.id for row in db.query(FileRecord.id).filter(FileRecord.id.in_(record_ids))}
+            records = [record for record in records if record.id not in kept]
+        for blob_name, count in Counter(record.blob_name for record in records).items():
+            db.query(FileBlob).filter(FileBlob.name == blob_name).update(
+                {FileBlob.ref_count: FileBlob.ref_count - count}, synchronize_session=False
+            )
+        db.commit()
+    
+    removed_blobs = 0
+    candidates = db.query(FileBlob.name).filter(FileBlob.ref_count <= 0).limit(batch_size).all()
+    db.commit()
+    for (blob_name,) in candidates:
+        # Re-check under a row lock: a concurrent upload may have taken a new reference
+        blob = db.query(FileBlob).filter(
+            FileBlob.name == blob_name, FileBlob.ref_count <= 0
+        ).with_for_update().first()
+        if blob:
+            storage.delete(blob_name)
+            remove_thumbnails(blob_name, THUMBNAIL_DIRECTORY)
+            db.delete(blob)
+            removed_blobs += 1
+        db.commit()
+    return len(records), removed_blobs
+
+async def run_file_gc():
+    """未参照のアップロードを定期的に削除するバックグラウンドタスク"""
+    while True:
+        await asyncio.sleep(settings.file_gc_interval_seconds)
+        try:
+            while True:
+                db = SessionLocal()
+                try:
+                    records, blobs = await run_in_threadpool(
+                        collect_orphan_files, db, settings.file_gc_grace_hours, settings.file_gc_batch_size
+                    )
+                finally:
+                    db.close()
+                if records or blobs:
+                    logger.info(f"🧹 Removed {records} unreferenced uploads and {blobs} files")
+                # Full batches mean there may be more; yield between batches
+                if records < settings.file_gc_batch_size and blobs < settings.file_gc_batch_size:
+                    break
+                await asyncio.sleep(0)
+        except Exception as e:
+            logger.error(f"File garbage collection failed: {e}")
+
+@router.post("/upload", dependencies=[Depends(upload_limit)])
 async def upload_file(
-    file: UploadFile = File(...),
-    current_user: User = Depends(get_current_user)
-) -> Dict[str, str]:
-    """ファイルをアップロード"""
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: UserPrincipal = Depends(get_current_user)
+) -> dict:
+    """ファイルをアップロード（multipart/form-data の "file" パート）"""
     try:
-        # ファイルバリデーション
-        validate_file(file)
+        # ファイルを一時保存（受信しながらバリデーションし、チャンク単位でストリーミング）
+        tmp_path, sha256, size, filename, content_type = await stream_upload_to_temp(request)
         
-        # 安全なファイル名を生成
-        safe_filename = get_safe_filename(file.filename or "unknown")
-        file_path = UPLOAD_DIRECTORY / safe_filename
+        # 内容アドレスで保存（同じ内容は1つのファイルを共有）
+        try:
+            record = await run_in_threadpool(
+                store_blob, db, tmp_path, sha256, filename, size, current_user.id, content_type
+            )
+        except BaseException:
+            await run_in_threadpool(_remove_if_exists, tmp_path)
+            raise
         
-        # ファイルを保存
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        # サムネイルはバックグラウンドのプロセスプールで生成
+        schedule_blob_thumbnails(record.blob_name)
         
-        # ファイルURLを生成
-        file_url = f"/files/{safe_filename}"
+        # ファイルURLを生成（アップロードごとの公開名）
+        file_url = f"/files/{record.name}"
         
-        logger.info(f"File uploaded: {safe_filename} by user {current_user.id}")
+        logger.info(f"File uploaded: {record.name} ({record.blob_name}) by user {current_user.id}")
         
-        return {"file_url": file_url}
+        return {"file_url": file_url, "sha256": sha256, "file_id": record.id}
         
     except HTTPException:
         raise
@@ -101,38 +425,288 @@ async def upload_file(
             detail="ファイルのアップロードに失敗しました。"
         )
 
-@router.get("/{filename}")
-async def download_file(filename: str):
-    """ファイルをダウンロード"""
-    file_path = UPLOAD_DIRECTORY / filename
+@router.post("/upload/by-hash")
+def upload_file_by_hash(
+    upload: FileHashUpload,
+    db: Session = Depends(get_db),
+    current_user: UserPrincipal = Depends(get_current_user)
+) -> dict:
+    """既知の内容ならデータを送らずにアップロードを完了（未知なら404で通常アップロードへ）
+
+    参照できるのは既にその内容を見られるユーザーだけ。それ以外には未知の内容と同じく404を返し、
+    他人がアップロードした内容の有無を確かめられないようにする。
+    """
+    file_extension = Path(upload.filename).suffix.lower()
+    if file_extension not in ALLOWED_EXTENSIONS:
+        raise HTTPException(
+            status_code=400,
+            detail="サポートされていないファイル拡張子です。"
+        )
     
-    if not file_path.exists():
+    blob_name = get_blob_name(upload.sha256, upload.filename)
+    record = None
+    if can_claim_blob(db, blob_name, current_user.id):
+        record = add_blob_reference(db, blob_name, upload.filename, current_user.id)
+    if record is None:
         raise HTTPException(status_code=404, detail="ファイルが見つかりません。")
     
+    logger.info(f"File uploaded by hash: {record.name} ({blob_name}) by user {current_user.id}")
+    return {"file_url": f"/files/{record.name}", "sha256": upload.sha256, "file_id": record.id}
+
+def upload_completing() -> HTTPException:
+    return HTTPException(status_code=409, detail="このアップロードは確定処理中です。")
+
+def get_upload_session(upload_id: str, current_user: UserPrincipal) -> dict:
+    meta = upload_sessions.get_meta(upload_id)
+    if not meta or meta["user_id"] != current_user.id:
+        raise HTTPException(status_code=404, detail="アップロードセッションが見つかりません。")
+    return meta
+
+@router.post("/uploads")
+def create_resumable_upload(
+    upload: ResumableUploadCreate,
+    current_user: UserPrincipal = Depends(get_current_user)
+):
+    """再開可能なアップロードを開始"""
+    validate_file_info(upload.filename, upload.content_type, upload.size)
+    try:
+        upload_id = upload_sessions.create(
+            current_user.id, upload.filename, upload.size, upload.content_type,
+            max_sessions=settings.upload_session_max_per_user,
+            max_bytes=settings.upload_session_max_bytes_per_user
+        )
+    except UploadLimitExceeded:
+        raise HTTPException(
+            status_code=429,
+            detail="未完了のアップロードが多すぎます。完了するか中止してから再度お試しください。"
+        )
+    logger.info(f"Resumable upload {upload_id} started by user {current_user.id} ({upload.size} bytes)")
+    return {"upload_id": upload_id, "chunk_size": RESUMABLE_CHUNK_SIZE}
+
+@router.get("/uploads/{upload_id}")
+def get_resumable_upload(
+    upload_id: str,
+    current_user: UserPrincipal = Depends(get_current_user)
+):
+    """受信済みの範囲を取得（再送が必要なのはこれ以外の部分のみ）"""
+    meta = get_upload_session(upload_id, current_user)
+    ranges = upload_sessions.received_ranges(upload_id)
+    return {
+        "upload_id": upload_id,
+        "size": meta["size"],
+        "received": ranges,
+        "complete": upload_sessions.is_complete(ranges, meta["size"])
+    }
+
+@router.put("/uploads/{upload_id}", dependencies=[Depends(upload_limit)])
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0),
+    current_user: UserPrincipal = Depends(get_current_user)
+):
+    """チャンクを指定オフセットに書き込む（順不同・再送可）"""
+    meta = get_upload_session(upload_id, current_user)
+    if upload_sessions.is_completing(upload_id):
+        raise upload_completing()
+    
+    try:
+        fd = await run_in_threadpool(upload_sessions.open_data, upload_id)
+    except FileNotFoundError:
+        # Completed (and removed) since the check above
+        raise upload_completing()
+    position = offset
+    try:
+        async for chunk in request.stream():
+            if not chunk:
+                continue
+            if position + len(chunk) > meta["size"]:
+                raise HTTPException(status_code=400, detail="チャンクがファイルサイズを超えています。")
+            if position + len(chunk) - offset > MAX_RESUMABLE_CHUNK_SIZE:
+                raise HTTPException(status_code=413, detail="チャンクが大きすぎます。")
+            await run_in_threadpool(os.pwrite, fd, chunk, position)
+            position += len(chunk)
+        # Only record the range once the bytes are durable
+        await run_in_threadpool(os.fsync, fd)
+    finally:
+        await run_in_threadpool(os.close, fd)
+    
+    if position > offset:
+        ranges = await run_in_threadpool(upload_sessions.mark_received, upload_id, offset, position)
+        if ranges is None:
+            # Completion started while this chunk was streaming; it worked from its own copy
+            raise upload_completing()
+    else:
+        ranges = upload_sessions.received_ranges(upload_id)
+    return {"received": ranges, "complete": upload_sessions.is_complete(ranges, meta["size"])}
+
+@router.post("/uploads/{upload_id}/complete", dependencies=[Depends(upload_limit)])
+async def complete_resumable_upload(
+    upload_id: str,
+    db: Session = Depends(get_db),
+    current_user: UserPrincipal = Depends(get_current_user)
+) -> dict:
+    """全チャンクが揃ったアップロードを確定してファイルとして保存"""
+    meta = get_upload_session(upload_id, current_user)
+    ranges = upload_sessions.received_ranges(upload_id)
+    if not upload_sessions.is_complete(ranges, meta["size"]):
+        raise HTTPException(status_code=409, detail="まだ受信していない範囲があります。")
+    
+    # Only one request may finalize a session; a concurrent complete gets 409 instead of racing the delete
+    if not await run_in_threadpool(upload_sessions.begin_complete, upload_id):
+        raise upload_completing()
+    try:
+        data_path, sha256, size = await run_in_threadpool(upload_sessions.finalize, upload_id)
+        record = await run_in_threadpool(
+            store_blob, db, data_path, sha256, meta["filename"], size, current_user.id, meta["content_type"]
+        )
+    except BaseException:
+        await run_in_threadpool(upload_sessions.cancel_complete, upload_id)
+        raise
+    await run_in_threadpool(upload_sessions.delete, upload_id)
+    schedule_blob_thumbnails(record.blob_name)
+    
+    logger.info(f"Resumable upload {upload_id} completed as {record.name} ({record.blob_name}) by user {current_user.id}")
+    return {"file_url": f"/files/{record.name}", "sha256": sha256, "file_id": record.id}
+
+@router.delete("/uploads/{upload_id}")
+def abort_resumable_upload(
+    upload_id: str,
+    current_user: UserPrincipal = Depends(get_current_user)
+):
+    """再開可能なアップロードを中止"""
+    get_upload_session(upload_id, current_user)
+    if upload_sessions.is_completing(upload_id):
+        raise upload_completing()
+    upload_sessions.delete(upload_id)
+    return {"message": "アップロードを中止しました。"}
+
+async def run_upload_session_gc():
+    """放置されたアップロードセッションを定期的に削除するバックグラウンドタスク"""
+    while True:
+        await asyncio.sleep(settings.upload_session_gc_interval_seconds)
+        try:
+            removed = await run_in_threadpool(
+                upload_sessions.cleanup_expired, settings.upload_session_ttl_hours * 3600
+            )
+            if removed:
+                logger.info(f"🧹 Removed {removed} abandoned upload sessions")
+        except Exception as e:
+            logger.error(f"Upload session cleanup failed: {e}")
+
+@router.get("/mine", response_model=List[FileRecordResponse])
+def get_my_files(
+    skip: int = 0,
+    limit: int = Query(50, ge=1, le=200),
+    db: Session = Depends(get_db),
+    current_user: UserPrincipal = Depends(get_current_user)
+):
+    """自分がアップロードしたファイルの一覧（新しい順）"""
+    records = db.query(FileRecord).filter(
+        FileRecord.user_id == current_user.id
+    ).order_by(FileRecord.created_at.desc(), FileRecord.id.desc()).offset(skip).limit(limit).all()
+    return [serialize_file_record(record) for record in records]
+
+@router.get("/channel/{channel_id}", response_model=List[FileRecordResponse])
+def get_channel_files(
+    channel_id: int,
+    skip: int = 0,
+    limit: int = Query(50, ge=1, le=200),
+    db: Session = Depends(get_db),
+    _: ChannelInfo = Depends(can_read_channel)
+):
+    """チャンネルに投稿されたファイルの一覧（新しい順）"""
+    records = db.query(FileRecord).filter(
+        FileRecord.channel_id == channel_id,
+        FileRecord.message_id.isnot(None)
+    ).order_by(FileRecord.created_at.desc(), FileRecord.id.desc()).offset(skip).limit(limit).all()
+    return [serialize_file_record(record) for record in records]
+
+@router.get("/{filename}")
+async def download_file(filename: str, request: Request, db: Session = Depends(get_db)):
+    """ファイルをダウンロード（ETag・Range対応、長期キャッシュ可）
+
+    URLはアップロードごとの公開名で、内容アドレスのブロブ名では取得できない。
+    リモートのストレージでは署名付きURLへリダイレクトする。
+    """
+    blob_name = await resolve_download_name(db, filename)
+    
     # MIMEタイプを推定
-    mime_type, _ = mimetypes.guess_type(str(file_path))
+    mime_type, _ = mimetypes.guess_type(filename)
     if mime_type is None:
         mime_type = "application/octet-stream"
     
-    return FileResponse(
-        path=file_path,
-        media_type=mime_type,
-        filename=filename
-    )
+    file_path = storage.local_path(blob_name)
+    if file_path is not None:
+        return cached_file_response(request, file_path, mime_type, filename=filename)
+    
+    url = storage.presigned_url(blob_name, mime_type)
+    if url is None:
+        raise HTTPException(status_code=404, detail="ファイルが見つかりません。")
+    return RedirectResponse(url, status_code=307)
+
+def require_file_name(db: Session, filename: str) -> str:
+    blob_name = resolve_file_name(db, filename) if is_valid_name(filename) else None
+    if blob_name is None:
+        raise HTTPException(status_code=404, detail="ファイルが見つかりません。")
+    return blob_name
+
+async def resolve_download_name(db: Session, filename: str) -> str:
+    return await run_in_threadpool(require_file_name, db, filename)
+
+async def create_thumbnail(filename: str, size: int) -> Optional[Path]:
+    source_path = storage.local_path(filename)
+    if source_path is not None:
+        return await get_or_create_thumbnail(source_path, THUMBNAIL_DIRECTORY, size)
+    
+    if not supports_thumbnail(filename) or not await run_in_threadpool(storage.exists, filename):
+        return None
+    # Remote storage: fetch a temporary local copy to render from
+    with tempfile.TemporaryDirectory(dir=UPLOAD_DIRECTORY, prefix=".thumb-") as tmp_dir:
+        source_path = Path(tmp_dir) / filename
+        await run_in_threadpool(storage.fetch, filename, source_path)
+        return await get_or_create_thumbnail(source_path, THUMBNAIL_DIRECTORY, size)
+
+@router.get("/{filename}/thumb/{size}")
+async def get_thumbnail(filename: str, size: int, request: Request, db: Session = Depends(get_db)):
+    """サムネイル（PDFは1ページ目のプレビュー）を取得。未生成ならその場で生成"""
+    if size not in THUMBNAIL_SIZES:
+        raise HTTPException(status_code=404, detail="サムネイルサイズが不正です。")
+    
+    blob_name = await resolve_download_name(db, filename)
+    
+    # Thumbnails are stored per blob, so every upload of the same content shares them
+    thumb_path = thumbnail_path(THUMBNAIL_DIRECTORY, blob_name, size)
+    if not thumb_path.exists():
+        thumb_path = await create_thumbnail(blob_name, size)
+    if thumb_path is None:
+        raise HTTPException(status_code=404, detail="このファイルのサムネイルは作成できません。")
+    
+    return cached_file_response(request, thumb_path, "image/webp")
 
 @router.delete("/{filename}")
-async def delete_file(
+def delete_file(
     filename: str,
-    current_user: User = Depends(get_current_user)
+    db: Session = Depends(get_db),
+    current_user: UserPrincipal = Depends(get_current_user)
 ):
-    """ファイルを削除"""
-    file_path = UPLOAD_DIRECTORY / filename
+    """ファイルを削除（共有されている内容は最後の参照が消えたときに削除）"""
+    # Plain def: the DB and storage calls below block, so FastAPI runs this in the threadpool
+    blob_name = require_file_name(db, filename)
     
-    if not file_path.exists():
+    record = db.query(FileRecord).filter(FileRecord.name == filename).first()
+    if record:
+        if record.user_id != current_user.id:
+            raise HTTPException(status_code=403, detail="自分がアップロードしたファイルのみ削除できます。")
+    elif not storage.exists(blob_name):
         raise HTTPException(status_code=404, detail="ファイルが見つかりません。")
     
     try:
-        os.remove(file_path)
+        # The record and its reference go in one transaction
+        released = release_blob(db, blob_name, record)
+        if not released:
+            # Files stored before content addressing have no blob record
+            storage.delete(filename)
         logger.info(f"File deleted: {filename} by user {current_user.id}")
         return {"message": "ファイルが削除されました。"}
     except Exception as e:
@@ -5,9 +5,17 @@ from typing import List, Optional
 import logging
 
 from app.database.base import get_db
-from app.database.models import Message, Channel, User, channel_members, Reaction
+from app.database.models import Message, User, Reaction
 from app.models.message import MessageCreate, MessageResponse, MessageUpdate, ReactionCreate
 from app.routers.auth import get_current_user
+from app.services.principal_cache import UserPrincipal
+from app.services.access_cache import ChannelInfo
+from app.services.channel_auth import WRITE, authorize_channel, can_read_channel
+from app.services.channel_stats import record_message_created, record_message_deleted
+from app.services.file_records import link_message_files, unlink_message_files
+from app.services.read_markers import read_markers
+from app.services.search_cache import channel_versions
+from app.services.search_indexer import enqueue_message
 
 logger = logging.getLogger(__name__)
 
@@ -44,21 +52,10 @@ def get_reply_count_for_message(db: Session, message_id: int) -> int:
 def create_message(
     message: MessageCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: UserPrincipal = Depends(get_current_user)
 ):
-    # Check if channel exists and user has access
-    channel = db.query(Channel).filter(Channel.id == message.channel_id).first()
-    if not channel:
-        raise HTTPException(status_code=404, detail="Channel not found")
-    
-    # Check if user is a member of the channel
-    member = db.query(channel_members).filter(
-        channel_members.c.user_id == current_user.id,
-        channel_members.c.channel_id == message.channel_id
-    ).first()
-    
-    if not member and channel.channel_type == 'private':
-        raise HTTPException(status_code=403, detail="Access denied")
+    # Check if channel exists and user can post to it
+    authorize_channel(db, current_user.id, message.channel_id, WRITE)
     
     # Create message
     try:
@@ -71,8 +68,16 @@ def create_message(
             thread_id=message.parent_message_id
         )
         db.add(db_message)
+        db.flush()
+        link_message_files(db, db_message)
+        record_message_created(db, db_message)
+        enqueue_message(db, db_message.id)
         db.commit()
         db.refresh(db_message)
+        if db_message.thread_id is None:
+            # The author has read their own message
+            read_markers.record(current_user.id, db_message.channel_id, db_message.id)
+        channel_versions.bump(db_message.channel_id)
         logger.info(f"Message created successfully with ID: {db_message.id}")
         
         # Get sender information separately to avoid relationship loading issues
@@ -116,22 +121,8 @@ def get_channel_messages(
     skip: int = 0,
     limit: int = 50,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    _: ChannelInfo = Depends(can_read_channel)
 ):
-    # Check if channel exists and user has access
-    channel = db.query(Channel).filter(Channel.id == channel_id).first()
-    if not channel:
-        raise HTTPException(status_code=404, detail="Channel not found")
-    
-    # Check if user is a member of the channel
-    member = db.query(channel_members).filter(
-        channel_members.c.user_id == current_user.id,
-        channel_members.c.channel_id == channel_id
-    ).first()
-    
-    if not member and channel.channel_type == 'private':
-        raise HTTPException(status_code=403, detail="Access denied")
-    
     # Get messages (exclude thread replies - only get top-level messages)
     messages = db.query(Message).filter(
         Message.channel_id == channel_id,
@@ -177,21 +168,14 @@ def get_channel_messages(
 def get_message(
     message_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: UserPrincipal = Depends(get_current_user)
 ):
     message = db.query(Message).filter(Message.id == message_id).first()
     if not message:
         raise HTTPException(status_code=404, detail="Message not found")
     
     # Check if user has access to the channel
-    channel = db.query(Channel).filter(Channel.id == message.channel_id).first()
-    member = db.query(channel_members).filter(
-        channel_members.c.user_id == current_user.id,
-        channel_members.c.channel_id == message.channel_id
-    ).first()
-    
-    if not member and channel.channel_type == 'private':
-        raise HTTPException(status_code=403, detail="Access denied")
+    authorize_channel(db, current_user.id, message.channel_id)
     
     # Get sender information separately
     sender = db.query(User).filter(User.id == message.user_id).first()
@@ -227,7 +211,7 @@ def update_message(
     message_id: int,
     message_update: MessageUpdate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: UserPrincipal = Depends(get_current_user)
 ):
     message = db.query(Message).filter(Message.id == message_id).first()
     if not message:
@@ -241,9 +225,12 @@ def update_message(
     if message_update.content is not None:
         message.content = message_update.content
         message.edited = True
+        link_message_files(db, message)
+        enqueue_message(db, message.id)
     
     db.commit()
     db.refresh(message)
+    channel_versions.bump(message.channel_id)
     
     # Get sender information separately
     sender = db.query(User).filter(User.id == message.user_id).first()
@@ -278,7 +265,7 @@ def update_message(
 def delete_message(
     message_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: UserPrincipal = Depends(get_current_user)
 ):
     try:
         logger.info(f"Attempting to delete message {message_id} by user {current_user.id}")
@@ -296,9 +283,14 @@ def delete_message(
         # Delete related reactions first to avoid foreign key constraint issues
         db.query(Reaction).filter(Reaction.message_id == message_id).delete()
         
-        # Delete the message
+        # Delete the message (the indexer drops its postings)
         db.delete(message)
+        db.flush()
+        record_message_deleted(db, message)
+        unlink_message_files(db, message_id)
+        enqueue_message(db, message_id)
         db.commit()
+        channel_versions.bump(message.channel_id)
         logger.info(f"Message {message_id} deleted successfully by user {current_user.id}")
         
         return {"message": "Message deleted successfully"}
@@ -313,7 +305,7 @@ def add_reaction(
     message_id: int,
     reaction: ReactionCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: UserPrincipal = Depends(get_current_user)
 ):
     # Check if message exists and user has access
     message = db.query(Message).filter(Message.id == message_id).first()
@@ -321,14 +313,7 @@ def add_reaction(
         raise HTTPException(status_code=404, detail="Message not found")
     
     # Check if user has access to the channel
-    channel = db.query(Channel).filter(Channel.id == message.channel_id).first()
-    member = db.query(channel_members).filter(
-        channel_members.c.user_id == current_user.id,
-        channel_members.c.channel_id == message.channel_id
-    ).first()
-    
-    if not member and channel.channel_type == 'private':
-        raise HTTPException(status_code=403, detail="Access denied")
+    authorize_channel(db, current_user.id, message.channel_id)
     
     # Check if reaction already exists
     existing_reaction = db.query(Reaction).filter(
@@ -360,7 +345,7 @@ def get_message_thread(
     skip: int = 0,
     limit: int = 50,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: UserPrincipal = Depends(get_current_user)
 ):
     # Check if parent message exists and user has access
     parent_message = db.query(Message).filter(Message.id == message_id).first()
@@ -368,14 +353,7 @@ def get_message_thread(
         raise HTTPException(status_code=404, detail="Message not found")
     
     # Check if user has access to the channel
-    channel = db.query(Channel).filter(Channel.id == parent_message.channel_id).first()
-    member = db.query(channel_members).filter(
-        channel_members.c.user_id == current_user.id,
-        channel_members.c.channel_id == parent_message.channel_id
-    ).first()
-    
-    if not member and channel.channel_type == 'private':
-        raise HTTPException(status_code=403, detail="Access denied")
+    authorize_channel(db, current_user.id, parent_message.channel_id)
     
     # Get thread messages
     logger.info(f"Getting thread messages for parent message {message_id}")
@@ -1,77 +1,234 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
-from typing import List, Optional
+from sqlalchemy import or_, and_, func
+from typing import List, Optional, Tuple
 
+from app.core.config import settings
 from app.database.base import get_db
-from app.database.models import Message, Channel, User, channel_members, Reaction
-from app.models.message import MessageResponse
+from app.database.models import Message, MessageTerm, SearchIndexQueue, Channel, User, Reaction
+from app.models.message import SearchResultResponse
 from app.routers.auth import get_current_user
+from app.services.principal_cache import UserPrincipal
+from app.services.access_cache import access_cache
+from app.services.channel_auth import authorize_channel, can_read
+from app.services.autocomplete import CHANNEL, USER, prefix_index
+from app.services.rate_limit import route_limit
+from app.services.search_cache import channel_versions, search_cache
+from app.services.search_indexer import MAX_TERM_LENGTH
+from app.services.search_query import parse_search_query
+from app.services.search_ranking import (
+    bm25_score, make_snippet, normalize_text, query_terms, query_words, recency_decay, tokenize
+)
 
 router = APIRouter()
 
 
-@router.get("/messages", response_model=List[MessageResponse])
+def rank_messages(
+    db: Session,
+    candidates: List[Message],
+    q: str,
+    scope_filter,
+    half_life_days: float
+) -> List[Tuple[Message, float]]:
+    """候補メッセージをBM25（＋任意の新しさ減衰）で並べ替え"""
+    terms = query_terms(q)
+    if not candidates or not terms:
+        return [(msg, 0.0) for msg in candidates]
+
+    # Corpus statistics for IDF, restricted to the channels being searched
+    total_docs = db.query(func.count(Message.id)).filter(scope_filter).scalar() or 0
+    # Document frequencies come from the inverted index maintained by the search indexer
+    doc_freqs = dict(
+        db.query(MessageTerm.term, func.count(MessageTerm.message_id))
+        .join(Message, Message.id == MessageTerm.message_id)
+        .filter(MessageTerm.term.in_(terms), scope_filter)
+        .group_by(MessageTerm.term)
+        .all()
+    )
+
+    doc_tokens = {msg.id: tokenize(msg.content) for msg in candidates}
+    avg_doc_length = sum(len(tokens) for tokens in doc_tokens.values()) / len(candidates)
+
+    ranked = []
+    for msg in candidates:
+        score = bm25_score(doc_tokens[msg.id], terms, doc_freqs, total_docs, avg_doc_length)
+        if half_life_days:
+            score *= recency_decay(msg.created_at, half_life_days)
+        ranked.append((msg, score))
+
+    # Candidates are already newest first, and sort() is stable, so ties keep recency order
+    ranked.sort(key=lambda item: item[1], reverse=True)
+    return ranked
+
+
+def text_match_filter(db: Session, q: str, words: List[str]):
+    """全語を含むメッセージの条件（転置インデックスで照合し、未インデックス分のみLIKE）"""
+    like_filter = and_(*[Message.content.ilike(f"%{word}%") for word in words])
+    terms = list(dict.fromkeys(term[:MAX_TERM_LENGTH] for term in query_terms(q)))
+    if not terms:
+        # Nothing tokenizable (punctuation only): there are no postings to look up
+        return like_filter
+
+    # Messages holding every term; the (term, message_id) key makes count() a distinct count
+    matched_ids = (
+        db.query(MessageTerm.message_id)
+        .filter(MessageTerm.term.in_(terms))
+        .group_by(MessageTerm.message_id)
+        .having(func.count() == len(terms))
+    )
+    # Queued messages are new or edited, so their postings are missing or stale
+    pending_ids = db.query(SearchIndexQueue.message_id)
+    return or_(
+        and_(Message.id.in_(matched_ids), ~Message.id.in_(pending_ids)),
+        and_(Message.id.in_(pending_ids), like_filter)
+    )
+
+
+# Search is the most expensive read: cap both per-client rate and total concurrency
+search_limit = route_limit(
+    rate=settings.search_rate_limit_per_second,
+    burst=settings.search_rate_limit_burst,
+    max_concurrent=settings.search_max_concurrent
+)
+
+
+@router.get("/messages", response_model=List[SearchResultResponse], dependencies=[Depends(search_limit)])
 def search_messages(
     q: str = Query(..., description="Search query"),
     channel_id: Optional[int] = Query(None, description="Channel ID to search in"),
     skip: int = 0,
     limit: int = 50,
+    sort: str = Query("relevance", pattern="^(relevance|recent)$", description="relevance or recent"),
+    recency_half_life_days: Optional[float] = Query(None, ge=0, description="Half-life for recency decay (0 disables)"),
+    full_content: bool = Query(False, description="Return full message content instead of a snippet"),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: UserPrincipal = Depends(get_current_user)
 ):
-    """メッセージを検索"""
-    if len(q.strip()) < 2:
+    """メッセージを検索（関連度順、スニペット付き）
+
+    qには from:@user, in:#channel, before:/after:YYYY-MM-DD, has:file, is:thread を指定できる。
+    """
+    parsed = parse_search_query(q)
+    if len(parsed.text.strip()) < 2 and not parsed.has_filters:
         raise HTTPException(status_code=400, detail="Search query must be at least 2 characters")
     
-    # Build search query
-    search_query = db.query(Message)
+    words = query_words(parsed.text)
     
-    # Filter by content (case-insensitive search)
-    search_query = search_query.filter(Message.content.ilike(f"%{q}%"))
+    # Channels named with in:#channel, intersected with channel_id if both are given
+    scope_channel_ids = None
+    if parsed.in_channels:
+        named_channels = db.query(Channel.id).filter(Channel.name.in_(parsed.in_channels)).all()
+        # Names are not unique: same-named channels the caller cannot read just fall out of scope
+        scope_channel_ids = {
+            channel.id for channel in named_channels if can_read(db, current_user.id, channel.id)
+        }
+        if channel_id:
+            scope_channel_ids &= {channel_id}
+        if not scope_channel_ids:
+            return []
+    elif channel_id:
+        scope_channel_ids = {channel_id}
     
-    # If channel_id is specified, filter by it
-    if channel_id:
-        # Check if user has access to the channel
-        channel = db.query(Channel).filter(Channel.id == channel_id).first()
-        if not channel:
+    # If channels are specified, filter by them
+    if scope_channel_ids:
+        channels = [access_cache.channel(db, cid) for cid in scope_channel_ids]
+        channels = [channel for channel in channels if channel is not None]
+        if not channels:
             raise HTTPException(status_code=404, detail="Channel not found")
         
-        member = db.query(channel_members).filter(
-            channel_members.c.user_id == current_user.id,
-            channel_members.c.channel_id == channel_id
-        ).first()
-        
-        if not member and channel.channel_type == 'private':
-            raise HTTPException(status_code=403, detail="Access denied to this channel")
+        # Check if user has access to the channels
+        for channel in channels:
+            authorize_channel(db, current_user.id, channel.id)
         
-        search_query = search_query.filter(Message.channel_id == channel_id)
+        scope_ids = sorted(channel.id for channel in channels)
+        scope_filters = [Message.channel_id.in_(scope_ids)]
     else:
-        # Get all channels the user has access to
-        user_channels = db.query(channel_members.c.channel_id).filter(
-            channel_members.c.user_id == current_user.id
-        ).subquery()
+        # Filter messages to only those in accessible channels
+        scope_ids = access_cache.accessible_channel_ids(db, current_user.id)
+        if not scope_ids:
+            return []
         
-        public_channels = db.query(Channel.id).filter(
-            Channel.channel_type == 'public'
-        ).subquery()
+        scope_filters = [Message.channel_id.in_(scope_ids)]
+    
+    # Structured filters are pushed down as indexed predicates, ahead of the text matching
+    if parsed.from_usernames:
+        sender_ids = [
+            row.id for row in db.query(User.id).filter(User.username.in_(parsed.from_usernames))
+        ]
+        if not sender_ids:
+            return []
+        scope_filters.append(Message.user_id.in_(sender_ids))
+    if parsed.after:
+        scope_filters.append(Message.created_at >= parsed.after)
+    if parsed.before:
+        scope_filters.append(Message.created_at < parsed.before)
+    if parsed.is_thread:
+        scope_filters.append(Message.thread_id.isnot(None))
+    if parsed.has_file:
+        # Uploaded files are posted as messages containing a /files/ URL
+        scope_filters.append(or_(
+            Message.message_type.in_(['file', 'image']),
+            Message.content.like('%/files/%')
+        ))
+    scope_filter = and_(*scope_filters)
+    
+    half_life_days = recency_half_life_days
+    if half_life_days is None:
+        half_life_days = settings.search_recency_half_life_days
+    rank_by_relevance = sort == "relevance" and bool(words)
+    
+    # Cached hits stay valid until a message changes in one of the channels searched
+    scope = tuple(scope_ids)
+    cache_key = (
+        " ".join(normalize_text(parsed.text).split()),
+        tuple(sorted(parsed.from_usernames)),
+        tuple(sorted(parsed.in_channels)),
+        parsed.before,
+        parsed.after,
+        parsed.has_file,
+        parsed.is_thread,
+        half_life_days if rank_by_relevance else None,
+        None if rank_by_relevance else (skip, limit),
+        scope
+    )
+    loaded_messages = {}
+    hits = search_cache.get(cache_key)
+    if hits is None:
+        # Take the sequence before querying so a concurrent write invalidates the entry
+        sequence = channel_versions.current()
         
-        # Filter messages to only those in accessible channels
-        accessible_channel_ids = db.query(Channel.id).filter(
-            or_(
-                Channel.id.in_(user_channels),
-                Channel.id.in_(public_channels)
-            )
-        ).subquery()
+        # Build search query: every term must appear
+        search_query = db.query(Message).filter(scope_filter)
+        if words:
+            search_query = search_query.filter(text_match_filter(db, parsed.text, words))
+        search_query = search_query.order_by(Message.created_at.desc())
         
-        search_query = search_query.filter(Message.channel_id.in_(accessible_channel_ids))
+        if rank_by_relevance:
+            # Rank the most recent matches by relevance; the whole ranking is cached for paging
+            candidates = search_query.limit(settings.search_candidate_limit).all()
+            loaded_messages = {msg.id: msg for msg in candidates}
+            ranked = rank_messages(db, candidates, parsed.text, scope_filter, half_life_days)
+            hits = [(msg.id, score) for msg, score in ranked]
+        else:
+            page_messages = search_query.offset(skip).limit(limit).all()
+            loaded_messages = {msg.id: msg for msg in page_messages}
+            hits = [(msg.id, 0.0) for msg in page_messages]
+        search_cache.put(cache_key, hits, scope, sequence)
     
-    # Order by most recent first and apply pagination
-    messages = search_query.order_by(Message.created_at.desc()).offset(skip).limit(limit).all()
+    page = hits[skip:skip + limit] if rank_by_relevance else hits
+    missing_ids = [message_id for message_id, _ in page if message_id not in loaded_messages]
+    if missing_ids:
+        for msg in db.query(Message).filter(Message.id.in_(missing_ids)):
+            loaded_messages[msg.id] = msg
+    ranked = [
+        (loaded_messages[message_id], score)
+        for message_id, score in page
+        if message_id in loaded_messages
+    ]
     
     # Manually serialize the response to avoid relationship loading issues
     search_results = []
-    for msg in messages:
+    for msg, score in ranked:
         # Get sender information separately
         sender = db.query(User).filter(User.id == msg.user_id).first()
         sender_data = None
@@ -102,9 +259,11 @@ def search_messages(
                 "created_at": reaction.created_at
             })
         
+        snippet, highlights = make_snippet(msg.content, words)
+        
         message_data = {
             "id": msg.id,
-            "content": msg.content,
+            "content": msg.content if full_content else snippet,
             "channel_id": msg.channel_id,
             "user_id": msg.user_id,
             "message_type": msg.message_type,
@@ -114,8 +273,46 @@ def search_messages(
             "updated_at": msg.updated_at,
             "sender": sender_data,
             "reactions": reaction_data,
-            "reply_count": 0
+            "reply_count": 0,
+            "snippet": snippet,
+            "highlights": highlights,
+            "score": round(score, 4)
         }
         search_results.append(message_data)
     
-    return search_results
\ No newline at end of file
+    return search_results
+
+@router.get("/autocomplete")
+def autocomplete(
+    prefix: str = Query(..., min_length=1, description="@user or #channel prefix"),
+    kind: str = Query("all", pattern="^(all|user|channel)$"),
+    limit: int = Query(8, ge=1, le=50),
+    db: Session = Depends(get_db),
+    current_user: UserPrincipal = Depends(get_current_user)
+):
+    """@メンション・#チャンネルの入力補完（かな/ローマ字を区別しない前方一致）"""
+    # A leading @ or # selects the kind of suggestion
+    if prefix.startswith("@"):
+        prefix, kind = prefix[1:], "user"
+    elif prefix.startswith("#"):
+        prefix, kind = prefix[1:], "channel"
+    
+    prefix_index.ensure_loaded(db)
+    
+    users = []
+    if kind in ("all", "user"):
+        users = prefix_index.search(prefix, USER, limit)
+    
+    channels = []
+    if kind in ("all", "channel"):
+        member_channel_ids = access_cache.member_channel_ids(db, current_user.id)
+        channels = prefix_index.search(
+            prefix,
+            CHANNEL,
+            limit,
+            allow=lambda channel: channel["channel_type"] == 'public' or (
+                channel["channel_type"] == 'private' and channel["id"] in member_channel_ids
+            )
+        )
+    
+    return {"users": users, "channels": channels}
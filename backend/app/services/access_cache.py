@@ -0,0 +1,131 @@
+import threading
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Dict, FrozenSet, Iterable, List, Mapping, Optional
+
+from sqlalchemy.orm import Session
+
+from app.database.models import Channel, channel_members
+
+
+@dataclass(frozen=True)
+class ChannelInfo:
+    """権限判定に使うチャンネルの属性"""
+    id: int
+    name: str
+    channel_type: str
+    is_archived: bool
+    created_by: int
+
+
+class ChannelAccessCache:
+    """ユーザーごとの参加チャンネルとロール、チャンネルの属性、公開チャンネル集合のキャッシュ
+
+    参加・退出・作成・チャンネル更新時に invalidate_* で無効化する。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._member_roles: Dict[int, Mapping[int, str]] = {}
+        self._channels: Dict[int, ChannelInfo] = {}
+        self._public_channels: Optional[FrozenSet[int]] = None
+        # Bumped on every invalidation so a load that raced with it is not stored
+        self._generation = 0
+
+    def member_roles(self, db: Session, user_id: int) -> Mapping[int, str]:
+        """ユーザーが参加しているチャンネルID → ロール"""
+        cached = self._member_roles.get(user_id)
+        if cached is not None:
+            return cached
+
+        generation = self._generation
+        rows = db.query(channel_members.c.channel_id, channel_members.c.role).filter(
+            channel_members.c.user_id == user_id
+        ).all()
+        roles = MappingProxyType({row.channel_id: row.role or 'member' for row in rows})
+        with self._lock:
+            if generation == self._generation:
+                self._member_roles[user_id] = roles
+        return roles
+
+    def member_channel_ids(self, db: Session, user_id: int) -> FrozenSet[int]:
+        """ユーザーが参加しているチャンネルID"""
+        return frozenset(self.member_roles(db, user_id))
+
+    def role(self, db: Session, user_id: int, channel_id: int) -> Optional[str]:
+        """チャンネルでのロール（参加していなければNone）"""
+        return self.member_roles(db, user_id).get(channel_id)
+
+    def channel(self, db: Session, channel_id: int) -> Optional[ChannelInfo]:
+        """チャンネルの属性（存在しなければNone）"""
+        cached = self._channels.get(channel_id)
+        if cached is not None:
+            return cached
+
+        generation = self._generation
+        channel = db.query(Channel).filter(Channel.id == channel_id).first()
+        if channel is None:
+            return None
+        info = ChannelInfo(
+            id=channel.id,
+            name=channel.name,
+            channel_type=channel.channel_type,
+            is_archived=bool(channel.is_archived),
+            created_by=channel.created_by
+        )
+        with self._lock:
+            if generation == self._generation:
+                self._channels[channel_id] = info
+        return info
+
+    def public_channel_ids(self, db: Session) -> FrozenSet[int]:
+        """公開チャンネルID"""
+        cached = self._public_channels
+        if cached is not None:
+            return cached
+
+        generation = self._generation
+        rows = db.query(Channel.id).filter(Channel.channel_type == 'public').all()
+        channel_ids = frozenset(row.id for row in rows)
+        with self._lock:
+            if generation == self._generation:
+                self._public_channels = channel_ids
+        return channel_ids
+
+    def accessible_channel_ids(self, db: Session, user_id: int) -> List[int]:
+        """ユーザーが閲覧できるチャンネルID（参加中＋公開）"""
+        return sorted(self.member_channel_ids(db, user_id) | self.public_channel_ids(db))
+
+    def is_member(self, db: Session, user_id: int, channel_id: int) -> bool:
+        return channel_id in self.member_roles(db, user_id)
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            self._generation += 1
+            self._member_roles.pop(user_id, None)
+
+    def invalidate_users(self, user_ids: Iterable[int]) -> None:
+        with self._lock:
+            self._generation += 1
+            for user_id in user_ids:
+                self._member_roles.pop(user_id, None)
+
+    def invalidate_channel(self, channel_id: int) -> None:
+        with self._lock:
+            self._generation += 1
+            self._channels.pop(channel_id, None)
+
+    def invalidate_public(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._public_channels = None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._member_roles.clear()
+            self._channels.clear()
+            self._public_channels = None
+
+
+access_cache = ChannelAccessCache()
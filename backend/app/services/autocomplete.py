@@ -0,0 +1,228 @@
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.database.models import Channel, User
+
+USER = "user"
+CHANNEL = "channel"
+
+# Hepburn romanization of hiragana; two-character entries (e.g. きゃ) are tried first
+_ROMAJI = {
+    "あ": "a", "い": "i", "う": "u", "え": "e", "お": "o",
+    "か": "ka", "き": "ki", "く": "ku", "け": "ke", "こ": "ko",
+    "が": "ga", "ぎ": "gi", "ぐ": "gu", "げ": "ge", "ご": "go",
+    "さ": "sa", "し": "shi", "す": "su", "せ": "se", "そ": "so",
+    "ざ": "za", "じ": "ji", "ず": "zu", "ぜ": "ze", "ぞ": "zo",
+    "た": "ta", "ち": "chi", "つ": "tsu", "て": "te", "と": "to",
+    "だ": "da", "ぢ": "ji", "づ": "zu", "で": "de", "ど": "do",
+    "な": "na", "に": "ni", "ぬ": "nu", "ね": "ne", "の": "no",
+    "は": "ha", "ひ": "hi", "ふ": "fu", "へ": "he", "ほ": "ho",
+    "ば": "ba", "び": "bi", "ぶ": "bu", "べ": "be", "ぼ": "bo",
+    "ぱ": "pa", "ぴ": "pi", "ぷ": "pu", "ぺ": "pe", "ぽ": "po",
+    "ま": "ma", "み": "mi", "む": "mu", "め": "me", "も": "mo",
+    "や": "ya", "ゆ": "yu", "よ": "yo",
+    "ら": "ra", "り": "ri", "る": "ru", "れ": "re", "ろ": "ro",
+    "わ": "wa", "ゐ": "i", "ゑ": "e", "を": "o", "ん": "n", "ゔ": "vu",
+    "ぁ": "a", "ぃ": "i", "ぅ": "u", "ぇ": "e", "ぉ": "o",
+    "ゃ": "ya", "ゅ": "yu", "ょ": "yo", "ゎ": "wa",
+}
+for _kana, _romaji in (
+    ("き", "k"), ("ぎ", "g"), ("に", "n"), ("ひ", "h"), ("び", "b"),
+    ("ぴ", "p"), ("み", "m"), ("り", "r"),
+):
+    for _small, _vowel in (("ゃ", "a"), ("ゅ", "u"), ("ょ", "o")):
+        _ROMAJI[_kana + _small] = f"{_romaji}y{_vowel}"
+for _kana, _romaji in (("し", "sh"), ("じ", "j"), ("ち", "ch"), ("ぢ", "j")):
+    for _small, _vowel in (("ゃ", "a"), ("ゅ", "u"), ("ょ", "o")):
+        _ROMAJI[_kana + _small] = f"{_romaji}{_vowel}"
+
+
+def normalize_name(text: str) -> str:
+    """NFKC・小文字化し、カタカナをひらがなに揃える"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return "".join(
+        chr(ord(char) - 0x60) if "ァ" <= char <= "ヶ" else char
+        for char in text
+    )
+
+
+def to_romaji(text: str) -> str:
+    """ひらがなをローマ字（ヘボン式）に変換（それ以外の文字はそのまま）"""
+    result: List[str] = []
+    double_next = False
+    i = 0
+    while i < len(text):
+        pair = text[i:i + 2]
+        if len(pair) == 2 and pair in _ROMAJI:
+            romaji, i = _ROMAJI[pair], i + 2
+        elif text[i] == "っ":
+            # Sokuon doubles the following consonant
+            double_next, i = True, i + 1
+            continue
+        elif text[i] == "ー":
+            i += 1
+            continue
+        else:
+            romaji, i = _ROMAJI.get(text[i], text[i]), i + 1
+        if double_next and romaji[:1].isalpha() and romaji[0] not in "aiueo":
+            romaji = ("t" if romaji.startswith("ch") else romaji[0]) + romaji
+        double_next = False
+        result.append(romaji)
+    return "".join(result)
+
+
+def _has_kana(text: str) -> bool:
+    return any("ぁ" <= char <= "ゖ" for char in text)
+
+
+def index_keys(*names: Optional[str]) -> Set[str]:
+    """名前からインデックスキー（正規化形とローマ字形）を生成"""
+    keys: Set[str] = set()
+    for name in names:
+        if not name:
+            continue
+        normalized = normalize_name(name)
+        keys.add(normalized)
+        if _has_kana(normalized):
+            keys.add(to_romaji(normalized))
+    return keys
+
+
+class PrefixIndex:
+    """ユーザー名・表示名・チャンネル名の前方一致インデックス（種類ごとのソート済み配列＋二分探索）
+
+    キーは正規化済みの名前とローマ字形で、かな/ローマ字のどちらで入力しても一致する。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Separate arrays per kind, so a channel lookup never walks user keys
+        self._entries: Dict[str, List[Tuple[str, int]]] = {USER: [], CHANNEL: []}  # kind -> sorted (key, id)
+        self._keys: Dict[Tuple[str, int], Set[str]] = {}
+        self._items: Dict[Tuple[str, int], dict] = {}
+        # Changes made before the initial load finishes, replayed on top of it
+        self._pending: Dict[Tuple[str, int], Tuple[dict, Set[str]]] = {}
+        self._loaded = False
+
+    def ensure_loaded(self, db: Session) -> None:
+        """初回利用時にDBから全ユーザー・チャンネルを読み込む"""
+        if self._loaded:
+            return
+        users = db.query(User.id, User.username, User.display_name).all()
+        channels = db.query(Channel.id, Channel.name, Channel.channel_type).all()
+        with self._lock:
+            if self._loaded:
+                return
+            for user in users:
+                self._set_item(USER, user.id, {
+                    "id": user.id,
+                    "username": user.username,
+                    "display_name": user.display_name
+                }, index_keys(user.username, user.display_name))
+            for channel in channels:
+                self._set_item(CHANNEL, channel.id, {
+                    "id": channel.id,
+                    "name": channel.name,
+                    "channel_type": channel.channel_type
+                }, index_keys(channel.name))
+            for (kind, item_id), (item, keys) in self._pending.items():
+                self._keys.pop((kind, item_id), None)
+                self._entries[kind] = [entry for entry in self._entries[kind] if entry[1] != item_id]
+                self._set_item(kind, item_id, item, keys)
+            self._pending.clear()
+            for entries in self._entries.values():
+                entries.sort()
+            self._loaded = True
+
+    def _set_item(self, kind: str, item_id: int, item: dict, keys: Set[str]) -> None:
+        self._items[(kind, item_id)] = item
+        self._keys[(kind, item_id)] = keys
+        self._entries[kind].extend((key, item_id) for key in keys)
+
+    def _remove_keys(self, kind: str, item_id: int) -> None:
+        entries = self._entries[kind]
+        for key in self._keys.pop((kind, item_id), ()):
+            position = bisect_left(entries, (key, item_id))
+            if position < len(entries) and entries[position] == (key, item_id):
+                del entries[position]
+
+    def _upsert(self, kind: str, item_id: int, item: dict, keys: Set[str]) -> None:
+        with self._lock:
+            if not self._loaded:
+                self._pending[(kind, item_id)] = (item, keys)
+                return
+            self._remove_keys(kind, item_id)
+            self._items[(kind, item_id)] = item
+            self._keys[(kind, item_id)] = keys
+            for key in keys:
+                insort(self._entries[kind], (key, item_id))
+
+    def upsert_user(self, user_id: int, username: str, display_name: Optional[str]) -> None:
+        self._upsert(USER, user_id, {
+            "id": user_id,
+            "username": username,
+            "display_name": display_name
+        }, index_keys(username, display_name))
+
+    def upsert_channel(self, channel_id: int, name: str, channel_type: str) -> None:
+        self._upsert(CHANNEL, channel_id, {
+            "id": channel_id,
+            "name": name,
+            "channel_type": channel_type
+        }, index_keys(name))
+
+    def remove(self, kind: str, item_id: int) -> None:
+        with self._lock:
+            self._remove_keys(kind, item_id)
+            self._items.pop((kind, item_id), None)
+
+    def search(
+        self,
+        prefix: str,
+        kind: str,
+        limit: int,
+        allow: Optional[Callable[[dict], bool]] = None,
+        max_scan: int = 200,
+        max_visits: int = 1000
+    ) -> List[dict]:
+        """前方一致する項目を短い（より完全に一致する）キー順に返す
+
+        allow で除外した項目は max_scan に数えないが、調べるキーは合計 max_visits までに抑え、
+        ロックを持つ時間が一致件数に比例して伸びないようにする。
+        """
+        normalized = normalize_name(prefix)
+        if not normalized:
+            return []
+        query_keys = {normalized}
+        if _has_kana(normalized):
+            query_keys.add(to_romaji(normalized))
+
+        matches: Dict[int, int] = {}  # item id -> shortest matching key length
+        visits = 0
+        with self._lock:
+            entries = self._entries[kind]
+            for query_key in query_keys:
+                position = bisect_left(entries, (query_key,))
+                accepted = 0
+                while position < len(entries) and accepted < max_scan and visits < max_visits:
+                    key, item_id = entries[position]
+                    if not key.startswith(query_key):
+                        break
+                    position += 1
+                    visits += 1
+                    if item_id not in matches:
+                        # Filter while scanning so hidden items do not use up the scan budget
+                        if allow is not None and not allow(self._items[(kind, item_id)]):
+                            continue
+                        accepted += 1
+                    matches[item_id] = min(matches.get(item_id, len(key)), len(key))
+            ranked = sorted(matches, key=lambda item_id: (matches[item_id], item_id))
+            items = [self._items[(kind, item_id)] for item_id in ranked[:limit]]
+        return items
+
+
+prefix_index = PrefixIndex()
@@ -0,0 +1,59 @@
+import logging
+from typing import Callable, Dict, Optional, TypeVar
+
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.orm import Session
+
+from app.database.base import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+def flush_batch(
+    name: str,
+    items: Dict[K, V],
+    apply: Callable[[Session, Dict[K, V]], int],
+    describe: Callable[[K], str],
+    requeue: Optional[Callable[[Dict[K, V]], None]] = None,
+    discard: Optional[Callable[[Session, K, V], None]] = None
+) -> int:
+    """itemsを1トランザクションで反映し、apply が返した件数の合計を返す
+
+    データが原因（IntegrityError / DataError）でバッチが失敗したら1件ずつ反映し直し、
+    それでも失敗するものはログに残して破棄する（discard があれば呼んでコミットする）。
+    接続断など他の失敗では、まだ反映していないものを requeue に渡してから送出する。
+    """
+    remaining = dict(items)
+    db = SessionLocal()
+    try:
+        try:
+            applied = apply(db, items)
+            db.commit()
+            return applied
+        except (IntegrityError, DataError):
+            db.rollback()
+            logger.warning(f"{name} flush failed; retrying one by one", exc_info=True)
+
+        applied = 0
+        for key, value in items.items():
+            try:
+                applied += apply(db, {key: value})
+                db.commit()
+            except (IntegrityError, DataError) as e:
+                db.rollback()
+                logger.error(f"Dropping {describe(key)}: {e}")
+                if discard is not None:
+                    discard(db, key, value)
+                    db.commit()
+            del remaining[key]
+        return applied
+    except Exception:
+        db.rollback()
+        if requeue is not None:
+            requeue(remaining)
+        raise
+    finally:
+        db.close()
@@ -0,0 +1,62 @@
+from fastapi import Depends, HTTPException
+from sqlalchemy.orm import Session
+
+from app.database.base import get_db
+from app.routers.auth import get_current_user
+from app.services.access_cache import ChannelInfo, access_cache
+from app.services.principal_cache import UserPrincipal
+
+# Permission levels, each including the previous one
+READ = "read"
+WRITE = "write"
+ADMIN = "admin"
+
+ADMIN_ROLES = ('admin', 'owner')
+
+
+def authorize_channel(db: Session, user_id: int, channel_id: int, permission: str = READ) -> ChannelInfo:
+    """ユーザーがチャンネルに対して権限を持つか判定し、チャンネルの属性を返す
+
+    閲覧・投稿は参加者か公開チャンネル、管理は admin/owner のみ。
+    キャッシュ済みなら問い合わせは発生しない。権限が無ければ HTTPException を送出する。
+    """
+    channel = access_cache.channel(db, channel_id)
+    if channel is None:
+        raise HTTPException(status_code=404, detail="Channel not found")
+
+    role = access_cache.role(db, user_id, channel_id)
+    if permission == ADMIN:
+        if role not in ADMIN_ROLES:
+            raise HTTPException(status_code=403, detail="Admin access required")
+        return channel
+
+    if role is None and channel.channel_type != 'public':
+        raise HTTPException(status_code=403, detail="Access denied")
+    if permission == WRITE and channel.is_archived:
+        raise HTTPException(status_code=403, detail="Channel is archived")
+    return channel
+
+
+def can_read(db: Session, user_id: int, channel_id: int) -> bool:
+    """閲覧権限の有無（例外を送出しない版）"""
+    try:
+        authorize_channel(db, user_id, channel_id, READ)
+    except HTTPException:
+        return False
+    return True
+
+
+def channel_permission(permission: str):
+    """パスの channel_id に対する権限を要求する依存関係"""
+    def dependency(
+        channel_id: int,
+        db: Session = Depends(get_db),
+        current_user: UserPrincipal = Depends(get_current_user)
+    ) -> ChannelInfo:
+        return authorize_channel(db, current_user.id, channel_id, permission)
+    return dependency
+
+
+can_read_channel = channel_permission(READ)
+can_write_channel = channel_permission(WRITE)
+can_admin_channel = channel_permission(ADMIN)
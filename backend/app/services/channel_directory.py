@@ -0,0 +1,89 @@
+import base64
+import binascii
+import json
+import threading
+import time
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from app.core.config import settings
+
+SORTS = ("name", "members", "activity")
+
+
+def encode_cursor(sort: str, key: Any, channel_id: int) -> str:
+    """並び順のキーとIDからページ送り用のカーソルを作る"""
+    raw = json.dumps([sort, key, channel_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str) -> Optional[Tuple[Any, int]]:
+    """カーソルを (キー, チャンネルID) に戻す。不正または並び順が違えばNone"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, key, channel_id = json.loads(raw)
+    except (binascii.Error, ValueError, TypeError):
+        return None
+    if cursor_sort != sort or not isinstance(channel_id, int):
+        return None
+    if sort == "name" and not isinstance(key, str):
+        return None
+    if sort != "name" and not isinstance(key, int):
+        return None
+    return key, channel_id
+
+
+class ChannelDirectoryCache:
+    """公開チャンネル一覧の1ページ目（検索語なし）のキャッシュ
+
+    チャンネルの作成・更新・アーカイブで無効化する。
+    参加者数と最終投稿はTTLの間だけ古い値になり得る。
+    """
+
+    def __init__(self, ttl_seconds: float):
+        self._ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._pages: Dict[Hashable, Tuple[float, dict]] = {}
+        # Bumped on every invalidation so a load that raced with it is not stored
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, key: Hashable) -> Optional[dict]:
+        entry = self._pages.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: Hashable, page: dict, generation: int) -> None:
+        if self._ttl_seconds <= 0:
+            return
+        with self._lock:
+            if generation == self._generation:
+                self._pages[key] = (time.monotonic() + self._ttl_seconds, page)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            self._pages.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._pages),
+            "ttl_seconds": self._ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+        }
+
+
+directory_cache = ChannelDirectoryCache(ttl_seconds=settings.channel_directory_cache_ttl_seconds)
@@ -0,0 +1,277 @@
+import re
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import and_, case, func, literal, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.database.base import insert_ignore_rows, insert_ignore_select
+from app.database.models import ChannelRead, ChannelStats, Message, User, channel_members
+
+_MENTION = re.compile(r"@(\w+)")
+
+
+def _ensure_stats(db: Session, channel_id: int) -> None:
+    if db.query(ChannelStats.channel_id).filter(ChannelStats.channel_id == channel_id).first():
+        return
+    try:
+        with db.begin_nested():
+            db.add(ChannelStats(channel_id=channel_id, message_count=0))
+    except IntegrityError:
+        pass  # Created concurrently
+
+
+def record_message_created(db: Session, message: Message) -> None:
+    """投稿時にチャンネルのカウンターと、メンションされたユーザーの未読メンション数を更新
+
+    コミットは呼び出し側で行う。
+    """
+    if message.thread_id is None:
+        values = {
+            ChannelStats.message_count: ChannelStats.message_count + 1,
+            # Concurrent posts may commit out of order; keep the highest id
+            ChannelStats.last_message_id: case(
+                (ChannelStats.last_message_id.is_(None), message.id),
+                (ChannelStats.last_message_id < message.id, message.id),
+                else_=ChannelStats.last_message_id
+            ),
+            ChannelStats.last_message_at: func.now(),
+        }
+        updated = db.query(ChannelStats).filter(ChannelStats.channel_id == message.channel_id).update(
+            values, synchronize_session=False
+        )
+        if not updated:
+            _ensure_stats(db, message.channel_id)
+            db.query(ChannelStats).filter(ChannelStats.channel_id == message.channel_id).update(
+                values, synchronize_session=False
+            )
+
+    record_mentions(db, message)
+
+
+def record_message_deleted(db: Session, message: Message) -> None:
+    """削除時にカウンターを戻す（メッセージの行を削除した後、同じトランザクションで呼ぶ）"""
+    if message.thread_id is not None:
+        return
+    last_message_id = db.query(func.max(Message.id)).filter(
+        Message.channel_id == message.channel_id,
+        Message.thread_id.is_(None)
+    ).scalar()
+    last_message_at = None
+    if last_message_id is not None:
+        last_message_at = db.query(Message.created_at).filter(Message.id == last_message_id).scalar()
+    db.query(ChannelStats).filter(ChannelStats.channel_id == message.channel_id).update({
+        ChannelStats.message_count: ChannelStats.message_count - 1,
+        ChannelStats.last_message_id: last_message_id,
+        ChannelStats.last_message_at: last_message_at,
+    }, synchronize_session=False)
+    # Readers whose pointer already covered the message counted it as read
+    db.query(ChannelRead).filter(
+        ChannelRead.channel_id == message.channel_id,
+        ChannelRead.last_read_message_id >= message.id,
+        ChannelRead.read_message_count > 0
+    ).update({ChannelRead.read_message_count: ChannelRead.read_message_count - 1}, synchronize_session=False)
+
+
+def mentioned_usernames(content: str) -> set:
+    return set(_MENTION.findall(content or ""))
+
+
+def record_mentions(db: Session, message: Message) -> None:
+    usernames = mentioned_usernames(message.content)
+    if not usernames:
+        return
+    # Only members of the channel, and never the author
+    rows = db.query(User.id).join(
+        channel_members, channel_members.c.user_id == User.id
+    ).filter(
+        User.username.in_(usernames),
+        channel_members.c.channel_id == message.channel_id,
+        User.id != message.user_id
+    ).all()
+    user_ids = [row.id for row in rows]
+    if user_ids:
+        increment_mentions(db, message.channel_id, user_ids)
+
+
+def increment_mentions(db: Session, channel_id: int, user_ids: Iterable[int]) -> None:
+    user_ids = sorted(set(user_ids))
+    # Users who never read this channel get a row with everything unread. INSERT IGNORE
+    # keeps a row created concurrently (e.g. by another post or a read marker flush)
+    insert_ignore_rows(db, ChannelRead.__table__, [
+        {
+            "user_id": user_id,
+            "channel_id": channel_id,
+            "last_read_message_id": 0,
+            "read_message_count": 0,
+            "mention_count": 0,
+        }
+        for user_id in user_ids
+    ])
+    db.query(ChannelRead).filter(
+        ChannelRead.channel_id == channel_id,
+        ChannelRead.user_id.in_(user_ids)
+    ).update({ChannelRead.mention_count: ChannelRead.mention_count + 1}, synchronize_session=False)
+
+
+def read_state_at(db: Session, stats: Optional[ChannelStats], channel_id: int, message_id: Optional[int]):
+    """既読位置 message_id（Noneなら最新）に対応する (既読メッセージID, 既読件数, 最新まで読んだか)
+
+    最新より前の位置では、それ以降の件数だけを数える（未読の末尾分のみの範囲スキャン）。
+    """
+    message_count = stats.message_count if stats else 0
+    last_message_id = (stats.last_message_id if stats else None) or 0
+    if message_id is None or message_id >= last_message_id:
+        return last_message_id, message_count, True
+    newer = db.query(func.count(Message.id)).filter(
+        Message.channel_id == channel_id,
+        Message.thread_id.is_(None),
+        Message.id > message_id
+    ).scalar()
+    return message_id, max(message_count - newer, 0), False
+
+
+def messages_after(db: Session, positions: Dict[int, int]) -> Dict[int, int]:
+    """チャンネルID → 位置 について、位置より後のメッセージ数をまとめて数える（1クエリ）"""
+    if not positions:
+        return {}
+    rows = db.query(Message.channel_id, func.count(Message.id)).filter(
+        Message.thread_id.is_(None),
+        or_(*[
+            and_(Message.channel_id == channel_id, Message.id > message_id)
+            for channel_id, message_id in positions.items()
+        ])
+    ).group_by(Message.channel_id).all()
+    return dict(rows)
+
+
+def apply_read_markers(db: Session, markers: Dict[Tuple[int, int], Optional[int]]) -> int:
+    """(ユーザーID, チャンネルID) → 既読メッセージID をまとめて反映し、更新した件数を返す
+
+    既読位置は進めるだけで戻さない。コミットは呼び出し側で行う。
+    """
+    if not markers:
+        return 0
+    user_ids = {user_id for user_id, _ in markers}
+    channel_ids = {channel_id for _, channel_id in markers}
+    stats_by_channel = {
+        stats.channel_id: stats
+        for stats in db.query(ChannelStats).filter(ChannelStats.channel_id.in_(channel_ids))
+    }
+    reads = {
+        (read.user_id, read.channel_id): read
+        for read in db.query(ChannelRead).filter(
+            ChannelRead.user_id.in_(user_ids),
+            ChannelRead.channel_id.in_(channel_ids)
+        )
+    }
+
+    applied = 0
+    for (user_id, channel_id), message_id in markers.items():
+        read = reads.get((user_id, channel_id))
+        if read is not None and message_id is not None and message_id <= read.last_read_message_id:
+            continue
+        last_read_message_id, read_message_count, caught_up = read_state_at(
+            db, stats_by_channel.get(channel_id), channel_id, message_id
+        )
+        if read is None:
+            db.add(ChannelRead(
+                user_id=user_id,
+                channel_id=channel_id,
+                last_read_message_id=last_read_message_id,
+                read_message_count=read_message_count,
+                mention_count=0
+            ))
+        elif last_read_message_id >= read.last_read_message_id:
+            read.last_read_message_id = last_read_message_id
+            read.read_message_count = read_message_count
+            if caught_up:
+                read.mention_count = 0
+        else:
+            continue
+        applied += 1
+    return applied
+
+
+def mark_read(db: Session, user_id: int, channel_id: int, message_id: Optional[int] = None) -> None:
+    """既読位置を進める（戻ることはない）。コミットは呼び出し側で行う"""
+    apply_read_markers(db, {(user_id, channel_id): message_id})
+
+
+def rebuild_channel_stats(db: Session) -> int:
+    """メッセージからカウンターを作り直す（導入時の初期化用）。対象チャンネル数を返す"""
+    rows = db.query(
+        Message.channel_id,
+        func.count(Message.id).label("message_count"),
+        func.max(Message.id).label("last_message_id")
+    ).filter(Message.thread_id.is_(None)).group_by(Message.channel_id).all()
+    last_times = dict(
+        db.query(Message.id, Message.created_at).filter(
+            Message.id.in_([row.last_message_id for row in rows])
+        ).all()
+    ) if rows else {}
+    db.query(ChannelStats).delete(synchronize_session=False)
+    for row in rows:
+        db.add(ChannelStats(
+            channel_id=row.channel_id,
+            message_count=row.message_count,
+            last_message_id=row.last_message_id,
+            last_message_at=last_times.get(row.last_message_id)
+        ))
+    db.commit()
+    return len(rows)
+
+
+def backfill_channel_reads(db: Session) -> None:
+    """既読位置の行が無い参加者を、各チャンネルの最新まで既読として登録（導入時の初期化用）
+
+    既読位置の導入前からの参加者が、過去のメッセージをすべて未読として数えないようにする。
+    """
+    query = select(
+        channel_members.c.user_id,
+        channel_members.c.channel_id,
+        func.coalesce(ChannelStats.last_message_id, 0),
+        ChannelStats.message_count,
+        literal(0)
+    ).join(ChannelStats, ChannelStats.channel_id == channel_members.c.channel_id)
+    insert_ignore_select(db, ChannelRead.__table__, [
+        "user_id", "channel_id", "last_read_message_id", "read_message_count", "mention_count"
+    ], query)
+    db.commit()
+
+
+def initialize_channel_stats(db: Session) -> None:
+    """カウンターと既読位置が未作成（導入直後）ならメッセージと参加者から作成"""
+    if db.query(ChannelStats.channel_id).first() is None and db.query(Message.id).first() is not None:
+        rebuild_channel_stats(db)
+    if db.query(ChannelRead.user_id).first() is None:
+        backfill_channel_reads(db)
+
+
+def start_reads_at_latest(db: Session, members: Dict[int, Iterable[int]], batch_size: int = 1000) -> None:
+    """チャンネルID → 新しく参加したユーザーID について、既読位置を最新にまとめて設定
+
+    既に既読位置の行があるユーザー（再参加など）も join_channel と同じく最新まで進め、
+    未読メンションを消す。コミットは呼び出し側で行う。
+    """
+    stats_by_channel = {
+        stats.channel_id: stats
+        for stats in db.query(ChannelStats).filter(ChannelStats.channel_id.in_(list(members)))
+    }
+    rows = []
+    for channel_id, user_ids in members.items():
+        user_ids = sorted(set(user_ids))
+        stats = stats_by_channel.get(channel_id)
+        values = {
+            "last_read_message_id": (stats.last_message_id if stats else None) or 0,
+            "read_message_count": stats.message_count if stats else 0,
+            "mention_count": 0,
+        }
+        rows.extend({"user_id": user_id, "channel_id": channel_id, **values} for user_id in user_ids)
+        # Rows left over from an earlier membership would otherwise keep their stale pointer
+        for start in range(0, len(user_ids), batch_size):
+            db.query(ChannelRead).filter(
+                ChannelRead.channel_id == channel_id,
+                ChannelRead.user_id.in_(user_ids[start:start + batch_size])
+            ).update(values, synchronize_session=False)
+    insert_ignore_rows(db, ChannelRead.__table__, rows, batch_size)
@@ -0,0 +1,57 @@
+from typing import Tuple
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.database.models import Channel, ChannelStats, DirectMessagePair, channel_members
+from app.services.access_cache import access_cache
+from app.services.channel_stats import start_reads_at_latest
+
+
+def dm_pair(user_id: int, other_user_id: int) -> Tuple[int, int]:
+    """ユーザーの組を順序によらない (小さいID, 大きいID) にする"""
+    return min(user_id, other_user_id), max(user_id, other_user_id)
+
+
+def find_dm_channel_id(db: Session, user_id: int, other_user_id: int):
+    low, high = dm_pair(user_id, other_user_id)
+    return db.query(DirectMessagePair.channel_id).filter(
+        DirectMessagePair.user_low_id == low,
+        DirectMessagePair.user_high_id == high
+    ).scalar()
+
+
+def find_or_create_dm_channel(db: Session, user_id: int, other_user_id: int) -> Tuple[int, bool]:
+    """2人のDMチャンネルを取得し、無ければ作成する。(チャンネルID, 作成したか) を返す
+
+    同時に開かれた場合は組の一意キーで片方の作成が失敗し、
+    そのトランザクションごと取り消して先に作られたチャンネルを返す。
+    """
+    channel_id = find_dm_channel_id(db, user_id, other_user_id)
+    if channel_id is not None:
+        return channel_id, False
+
+    low, high = dm_pair(user_id, other_user_id)
+    try:
+        channel = Channel(name=f"dm-{low}-{high}", channel_type='dm', created_by=user_id)
+        db.add(channel)
+        db.flush()
+        db.add(DirectMessagePair(user_low_id=low, user_high_id=high, channel_id=channel.id))
+        db.add(ChannelStats(channel_id=channel.id, message_count=0))
+        db.execute(channel_members.insert(), [
+            {"channel_id": channel.id, "user_id": member_id, "role": 'member'}
+            for member_id in sorted({low, high})
+        ])
+        db.flush()
+        start_reads_at_latest(db, {channel.id: sorted({low, high})})
+        db.commit()
+    except IntegrityError:
+        # Opened concurrently: the other request's channel won
+        db.rollback()
+        channel_id = find_dm_channel_id(db, user_id, other_user_id)
+        if channel_id is None:
+            raise
+        return channel_id, False
+
+    access_cache.invalidate_users({low, high})
+    return channel.id, True
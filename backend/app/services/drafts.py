@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.database.models import MessageDraft
+from app.services.batch_flush import flush_batch
+
+logger = logging.getLogger(__name__)
+
+DraftKey = Tuple[int, int]  # (user_id, channel_id)
+
+
+@dataclass(frozen=True)
+class PendingDraft:
+    """DBへ未反映のドラフト（content が None なら削除）"""
+    content: Optional[str]
+    reply_to_id: Optional[int]
+    updated_at: datetime
+
+    @property
+    def deleted(self) -> bool:
+        return self.content is None
+
+
+def apply_drafts(db: Session, drafts: Dict[DraftKey, PendingDraft]) -> int:
+    """ドラフトの保存・削除をまとめて反映し、反映した件数を返す。コミットは呼び出し側で行う"""
+    if not drafts:
+        return 0
+    user_ids = {user_id for user_id, _ in drafts}
+    channel_ids = {channel_id for _, channel_id in drafts}
+    existing = {
+        (draft.user_id, draft.channel_id): draft
+        for draft in db.query(MessageDraft).filter(
+            MessageDraft.user_id.in_(user_ids),
+            MessageDraft.channel_id.in_(channel_ids)
+        )
+    }
+
+    for (user_id, channel_id), pending in drafts.items():
+        row = existing.get((user_id, channel_id))
+        if pending.deleted:
+            if row is not None:
+                db.delete(row)
+        elif row is not None:
+            row.content = pending.content
+            row.reply_to_id = pending.reply_to_id
+            row.updated_at = pending.updated_at
+        else:
+            db.add(MessageDraft(
+                user_id=user_id,
+                channel_id=channel_id,
+                content=pending.content,
+                reply_to_id=pending.reply_to_id,
+                created_at=pending.updated_at,
+                updated_at=pending.updated_at
+            ))
+    return len(drafts)
+
+
+class DraftBuffer:
+    """ドラフトの自動保存をメモリ上でまとめ、定期的にDBへ反映する
+
+    (ユーザー, チャンネル) ごとに最後の保存だけを保持する（後勝ち）ので、
+    入力中に何度保存されても、DBへの書き込みは反映間隔ごとに1行で済む。
+    読み出し側は get / pending で未反映の値を優先する。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Flushes run one at a time so an older value never lands after a newer one
+        self._flush_lock = threading.Lock()
+        self._pending: Dict[DraftKey, PendingDraft] = {}
+        self.saved = 0
+        self.flushed = 0
+
+    def save(self, user_id: int, channel_id: int, content: str, reply_to_id: Optional[int]) -> PendingDraft:
+        draft = PendingDraft(content=content, reply_to_id=reply_to_id, updated_at=datetime.now())
+        with self._lock:
+            self._pending[(user_id, channel_id)] = draft
+            self.saved += 1
+        return draft
+
+    def delete(self, user_id: int, channel_id: int) -> None:
+        with self._lock:
+            self._pending[(user_id, channel_id)] = PendingDraft(
+                content=None, reply_to_id=None, updated_at=datetime.now()
+            )
+
+    def get(self, user_id: int, channel_id: int) -> Optional[PendingDraft]:
+        with self._lock:
+            return self._pending.get((user_id, channel_id))
+
+    def pending(self, user_id: int) -> Dict[int, PendingDraft]:
+        """ユーザーの未反映のドラフト（チャンネルID → ドラフト）"""
+        with self._lock:
+            return {
+                channel_id: draft
+                for (draft_user_id, channel_id), draft in self._pending.items()
+                if draft_user_id == user_id
+            }
+
+    def _requeue(self, drafts: Dict[DraftKey, PendingDraft]) -> None:
+        # Keep anything saved again since the flush started
+        with self._lock:
+            for key, draft in drafts.items():
+                self._pending.setdefault(key, draft)
+
+    def flush(self) -> int:
+        """溜まったドラフトを1トランザクションで反映し、反映した件数を返す
+
+        データが原因でバッチが失敗したら1件ずつ反映し直し、それでも失敗するものは
+        ログに残して破棄する（1件のために全員のドラフトが保存されなくならないように）。
+        接続断など他の失敗では、その後に上書きされていないものだけをバッファに戻す。
+        """
+        with self._flush_lock:
+            with self._lock:
+                drafts, self._pending = self._pending, {}
+            if not drafts:
+                return 0
+            applied = flush_batch(
+                "Draft",
+                drafts,
+                apply_drafts,
+                lambda key: f"draft of user {key[0]} in channel {key[1]}",
+                requeue=self._requeue
+            )
+            self.flushed += applied
+            return applied
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "saved": self.saved,
+            "flushed": self.flushed,
+        }
+
+
+draft_buffer = DraftBuffer()
+
+
+async def run_draft_flusher() -> None:
+    """ドラフトを定期的にDBへ反映するバックグラウンドタスク"""
+    while True:
+        await asyncio.sleep(settings.draft_flush_interval_seconds)
+        try:
+            await run_in_threadpool(draft_buffer.flush)
+        except Exception as e:
+            logger.error(f"Draft flush failed: {e}", exc_info=True)
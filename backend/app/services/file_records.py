@@ -0,0 +1,43 @@
+import re
+from typing import Set
+
+from sqlalchemy.orm import Session
+
+from app.database.models import FileRecord, Message
+
+# File messages carry the download URL in their text (e.g. "📎 a.pdf\n/files/<name>")
+_FILE_URL = re.compile(r"/files/([0-9A-Za-z_.-]{1,80})")
+
+
+def referenced_files(content: str) -> Set[str]:
+    """メッセージ本文から参照しているファイル名を抽出"""
+    return set(_FILE_URL.findall(content or ""))
+
+
+def link_message_files(db: Session, message: Message) -> None:
+    """本文で参照しているアップロードをメッセージに紐付け、参照しなくなったものは外す
+
+    紐付けるのは投稿者自身の未使用のアップロードのみ。コミットは呼び出し側で行う。
+    """
+    names = referenced_files(message.content)
+    unlinked = db.query(FileRecord).filter(FileRecord.message_id == message.id)
+    if names:
+        unlinked = unlinked.filter(FileRecord.name.notin_(names))
+    unlinked.update({FileRecord.message_id: None}, synchronize_session=False)
+
+    if names:
+        db.query(FileRecord).filter(
+            FileRecord.user_id == message.user_id,
+            FileRecord.message_id.is_(None),
+            FileRecord.name.in_(names)
+        ).update(
+            {FileRecord.message_id: message.id, FileRecord.channel_id: message.channel_id},
+            synchronize_session=False
+        )
+
+
+def unlink_message_files(db: Session, message_id: int) -> None:
+    """削除されたメッセージのファイルを未参照に戻す（ファイル本体はGCが削除する）"""
+    db.query(FileRecord).filter(FileRecord.message_id == message_id).update(
+        {FileRecord.message_id: None}, synchronize_session=False
+    )
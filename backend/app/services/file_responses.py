@@ -0,0 +1,206 @@
+import os
+import re
+import uuid
+from email.utils import formatdate
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import anyio
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+from starlette.types import Receive, Scope, Send
+
+# File names are unique per content, so clients may cache them forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+MAX_RANGES = 16
+
+_SHA256_NAME = re.compile(r"^[0-9a-f]{64}$")
+_RANGE_SPEC = re.compile(r"^\s*(\d*)\s*-\s*(\d*)\s*$")
+
+ByteRange = Tuple[int, int]  # inclusive start, inclusive end
+
+
+def file_etag(path: Path, stat_result: os.stat_result) -> str:
+    """強いETag（内容アドレスのファイルはハッシュ、それ以外はmtime+サイズ）"""
+    if _SHA256_NAME.match(path.stem):
+        return f'"{path.stem}"'
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # If-None-Match uses weak comparison
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def parse_range_header(range_header: str, file_size: int) -> Optional[List[ByteRange]]:
+    """Rangeヘッダーを解析。満たせない場合は空リスト、形式が不正ならNone（無視して全体を返す）"""
+    unit, _, specs = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or not specs:
+        return None
+
+    ranges: List[ByteRange] = []
+    for spec in specs.split(","):
+        match = _RANGE_SPEC.match(spec)
+        if not match or not (match.group(1) or match.group(2)):
+            return None
+        first, last = match.group(1), match.group(2)
+        if first:
+            start = int(first)
+            end = min(int(last), file_size - 1) if last else file_size - 1
+            if last and int(last) < start:
+                return None
+        else:
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length == 0:
+                continue
+            start, end = max(file_size - length, 0), file_size - 1
+        if start < file_size:
+            ranges.append((start, end))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+    return _merge_ranges(ranges)
+
+
+def _merge_ranges(ranges: List[ByteRange]) -> List[ByteRange]:
+    merged: List[ByteRange] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class RangeFileResponse(FileResponse):
+    """ファイルの一部（単一・複数範囲）を返すレスポンス
+
+    サーバーが `http.response.zerocopysend` 拡張に対応していれば sendfile でゼロコピー送信する。
+    """
+
+    def __init__(self, path: Path, ranges: List[ByteRange], stat_result: os.stat_result, **kwargs):
+        super().__init__(path, status_code=206, stat_result=stat_result, **kwargs)
+        self.ranges = ranges
+        file_size = stat_result.st_size
+        content_type = self.media_type
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            self.parts = [(start, end, b"")]
+            self.closing = b""
+            self.headers["content-range"] = f"bytes {start}-{end}/{file_size}"
+        else:
+            boundary = uuid.uuid4().hex
+            self.parts = [
+                (
+                    start,
+                    end,
+                    (
+                        f"--{boundary}\r\n"
+                        f"Content-Type: {content_type}\r\n"
+                        f"Content-Range: bytes {start}-{end}/{file_size}\r\n\r\n"
+                    ).encode("latin-1")
+                )
+                for start, end in ranges
+            ]
+            self.closing = f"\r\n--{boundary}--\r\n".encode("latin-1")
+            # Each part after the first is preceded by a CRLF
+            self.parts = [
+                (start, end, (b"\r\n" if i else b"") + header)
+                for i, (start, end, header) in enumerate(self.parts)
+            ]
+            self.headers["content-type"] = f"multipart/byteranges; boundary={boundary}"
+        content_length = sum(end - start + 1 + len(header) for start, end, header in self.parts) + len(self.closing)
+        self.headers["content-length"] = str(content_length)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        if self.send_header_only:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        zerocopy = "http.response.zerocopysend" in scope.get("extensions", {})
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            for start, end, header in self.parts:
+                if header:
+                    await send({"type": "http.response.body", "body": header, "more_body": True})
+                if zerocopy:
+                    await send({
+                        "type": "http.response.zerocopysend",
+                        "file": file.wrapped.fileno(),
+                        "offset": start,
+                        "count": end - start + 1,
+                        "more_body": True,
+                    })
+                    continue
+                await file.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    chunk = await file.read(min(self.chunk_size, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": self.closing, "more_body": False})
+        if self.background is not None:
+            await self.background()
+
+
+def cached_file_response(
+    request: Request,
+    path: Path,
+    media_type: str,
+    filename: Optional[str] = None
+) -> Response:
+    """ETag・条件付きGET・Range・immutableキャッシュに対応したファイルレスポンスを生成"""
+    stat_result = os.stat(path)
+    file_size = stat_result.st_size
+    etag = file_etag(path, stat_result)
+    headers = {
+        "etag": etag,
+        "cache-control": IMMUTABLE_CACHE_CONTROL,
+        "accept-ranges": "bytes",
+        "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    # A stale If-Range validator means the client must get the whole file
+    if range_header and (not if_range or if_range.strip() == etag):
+        ranges = parse_range_header(range_header, file_size)
+        if ranges == []:
+            return Response(
+                status_code=416,
+                headers={**headers, "content-range": f"bytes */{file_size}"}
+            )
+        if ranges:
+            return RangeFileResponse(
+                path,
+                ranges,
+                stat_result,
+                headers=headers,
+                media_type=media_type,
+                filename=filename,
+                method=request.method
+            )
+
+    return FileResponse(
+        path=path,
+        headers=headers,
+        media_type=media_type,
+        filename=filename,
+        stat_result=stat_result,
+        method=request.method
+    )
@@ -0,0 +1,93 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class PasswordHasherBusy(Exception):
+    """ハッシュ計算の待ち行列が満杯（呼び出し側は503で即座に断る）"""
+
+
+@lru_cache(maxsize=None)
+def _crypt_context(rounds: int) -> CryptContext:
+    # Hashes with a different cost are reported as needing an update
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+
+
+def _hash(password: str, rounds: int) -> str:
+    return _crypt_context(rounds).hash(password)
+
+
+def _verify_and_update(password: str, password_hash: str, rounds: int) -> Tuple[bool, Optional[str]]:
+    return _crypt_context(rounds).verify_and_update(password, password_hash)
+
+
+class PasswordHasher:
+    """bcryptのハッシュ計算・検証を専用のプロセスプールで実行
+
+    同時に計算するのはワーカー数まで、待ちはmax_queueまで。それを超えると
+    PasswordHasherBusy を送出し、ログインの集中が共有スレッドプールを占有しないようにする。
+    ワーカー数0ではプールを使わず呼び出し元のスレッドで計算する。
+    """
+
+    def __init__(self, workers: int, max_queue: int, rounds: int):
+        self.workers = workers
+        self.rounds = rounds
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + max_queue)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self.rejected = 0
+
+    def start(self) -> None:
+        """プロセスプールを作成（アプリ起動時に呼ぶ）"""
+        if self.workers > 0:
+            self._get_executor()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                # Forking a threaded server can copy locks held by other threads into the workers
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("forkserver")
+                )
+            return self._executor
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise PasswordHasherBusy()
+        try:
+            if self.workers <= 0:
+                return func(*args)
+            return self._get_executor().submit(func, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password: str) -> str:
+        return self._run(_hash, password, self.rounds)
+
+    def verify_and_update(self, password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+        """(一致したか, 設定のコストで作り直したハッシュ（不要ならNone）)"""
+        return self._run(_verify_and_update, password, password_hash, self.rounds)
+
+    def shutdown(self) -> None:
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+password_hasher = PasswordHasher(
+    workers=settings.password_hash_workers,
+    max_queue=settings.password_hash_max_queue,
+    rounds=settings.bcrypt_rounds
+)
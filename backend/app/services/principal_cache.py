@@ -0,0 +1,141 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.database.models import User
+
+
+@dataclass(frozen=True)
+class UserPrincipal:
+    """認証済みユーザーのスナップショット（リクエスト間で共有する読み取り専用の値）
+
+    ユーザーを更新するハンドラーはこれを直接変更せず、DBから読み直してから更新する。
+    """
+    id: int
+    username: str
+    email: str
+    display_name: Optional[str]
+    avatar_url: Optional[str]
+    status: Optional[str]
+    is_online: bool
+    created_at: datetime
+    updated_at: datetime
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserPrincipal":
+        return cls(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            display_name=user.display_name,
+            avatar_url=user.avatar_url,
+            status=user.status,
+            is_online=bool(user.is_online),
+            created_at=user.created_at,
+            updated_at=user.updated_at
+        )
+
+
+class PrincipalCache:
+    """アクセストークン → ユーザーのスナップショット のTTL付きLRUキャッシュ
+
+    エントリはTTLとトークン自体の有効期限の早い方で失効する。
+    ログアウト・ステータス変更・プロフィール編集時に invalidate_user で無効化する。
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, UserPrincipal]]" = OrderedDict()
+        self._tokens_by_user: Dict[int, Set[str]] = {}
+        self._max_entries = max_entries
+        self._ttl_seconds = ttl_seconds
+        # Bumped on every invalidation so a load that raced with it is not stored
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, token: str) -> Optional[UserPrincipal]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    self._remove(token)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, token: str, principal: UserPrincipal, token_expires_at: Optional[float], generation: int) -> None:
+        """token_expires_at はトークンのexp（UNIX時刻）"""
+        if self._max_entries <= 0 or self._ttl_seconds <= 0:
+            return
+        ttl = self._ttl_seconds
+        if token_expires_at is not None:
+            ttl = min(ttl, token_expires_at - time.time())
+        if ttl <= 0:
+            return
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._remove(token)
+            self._entries[token] = (time.monotonic() + ttl, principal)
+            self._tokens_by_user.setdefault(principal.id, set()).add(token)
+            while len(self._entries) > self._max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, token: str) -> None:
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._tokens_by_user.get(entry[1].id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[entry[1].id]
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            self._generation += 1
+            for token in self._tokens_by_user.pop(user_id, set()):
+                self._entries.pop(token, None)
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self._max_entries,
+            "ttl_seconds": self._ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "evictions": self.evictions,
+        }
+
+
+principal_cache = PrincipalCache(
+    max_entries=settings.principal_cache_max_entries,
+    ttl_seconds=settings.principal_cache_ttl_seconds
+)
@@ -0,0 +1,185 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse
+from jose import JWTError, jwt
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.core.config import settings
+
+# Never limited, so health checks keep working under overload
+EXEMPT_PATHS = {"/", "/health"}
+
+
+def ip_key(scope: Scope) -> str:
+    client = scope.get("client")
+    return "ip:" + (client[0] if client else "unknown")
+
+
+def client_key(scope: Scope) -> str:
+    """レート制限の単位（署名を検証できたトークンならユーザー、それ以外は接続元IP）
+
+    ヘッダーの文字列そのものは使わない。偽のトークンを毎回変えても制限を逃れられないようにする。
+    """
+    for name, value in scope.get("headers", []):
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() != "bearer" or not token:
+                break
+            try:
+                payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
+            except JWTError:
+                break
+            username = payload.get("sub")
+            if username:
+                return "u:" + username
+            break
+    return ip_key(scope)
+
+
+class RateLimiter:
+    """キーごとのトークンバケット（rate 個/秒で補充、最大 burst 個）
+
+    バケット数は max_keys までで、古いものから破棄する。
+    """
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self.rejected = 0
+
+    def take(self, key: str) -> Tuple[bool, float]:
+        """トークンを1つ消費。(許可されたか, 拒否時に次のトークンまでの秒数)"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (float(self.burst), now))
+            tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            else:
+                self.rejected += 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        if allowed:
+            return True, 0.0
+        return False, self._retry_after(tokens)
+
+    def check(self, key: str) -> Tuple[bool, float]:
+        """トークンを消費せずに残りがあるか確認（失敗したときだけ take する用途）"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                return True, 0.0
+            tokens, updated = bucket
+            tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                return True, 0.0
+            self.rejected += 1
+        return False, self._retry_after(tokens)
+
+    def _retry_after(self, tokens: float) -> float:
+        return (1 - tokens) / self.rate if self.rate > 0 else 60.0
+
+
+class ConcurrencyLimiter:
+    """同時実行数の上限（待たせずに断る）"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.active >= self.limit:
+                self.rejected += 1
+                return False
+            self.active += 1
+            return True
+
+    def release(self) -> None:
+        with self._lock:
+            self.active -= 1
+
+
+def too_many_requests(retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail="Too many requests",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+
+
+def route_limit(
+    rate: Optional[float] = None,
+    burst: Optional[int] = None,
+    max_concurrent: Optional[int] = None,
+    by_ip: bool = False
+):
+    """ルートごとのレート制限・同時実行数制限を行う依存関係
+
+    イベントループ上で判定するため、拒否されたリクエストはスレッドプールもDB接続も使わない。
+    by_ip なら認証情報によらず接続元IPごとに数える（ログイン・登録用）。
+    """
+    key_func = ip_key if by_ip else client_key
+    limiter = RateLimiter(rate, burst or 1) if rate else None
+    slots = ConcurrencyLimiter(max_concurrent) if max_concurrent else None
+
+    async def dependency(request: Request):
+        if not settings.rate_limit_enabled:
+            yield
+            return
+        if limiter is not None:
+            allowed, retry_after = limiter.take(key_func(request.scope))
+            if not allowed:
+                raise too_many_requests(retry_after)
+        if slots is not None and not slots.try_acquire():
+            raise HTTPException(
+                status_code=503,
+                detail="Server is busy, please retry shortly",
+                headers={"Retry-After": "1"}
+            )
+        try:
+            yield
+        finally:
+            if slots is not None:
+                slots.release()
+
+    return dependency
+
+
+class RateLimitMiddleware:
+    """クライアントごとの全体のレート制限（超過は429とRetry-Afterで即座に返す）"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.limiter = RateLimiter(settings.rate_limit_per_second, settings.rate_limit_burst)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            not settings.rate_limit_enabled
+            or scope["type"] != "http"
+            or scope["method"] == "OPTIONS"
+            or scope["path"] in EXEMPT_PATHS
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        allowed, retry_after = self.limiter.take(client_key(scope))
+        if not allowed:
+            error = too_many_requests(retry_after)
+            response = JSONResponse({"detail": error.detail}, status_code=error.status_code, headers=error.headers)
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.services.batch_flush import flush_batch
+from app.services.channel_stats import apply_read_markers
+
+logger = logging.getLogger(__name__)
+
+
+class ReadMarkerBuffer:
+    """既読位置の書き込みをメモリ上でまとめ、定期的にDBへ反映する
+
+    (ユーザー, チャンネル) ごとに最大の既読メッセージIDだけを保持するので、
+    スクロール中に何度報告されても、DBへの書き込みは反映間隔ごとに1行で済む。
+    読み出し側は pending で未反映の値を重ねる。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # user_id -> channel_id -> message_id
+        self._pending: Dict[int, Dict[int, int]] = {}
+        self.recorded = 0
+        self.flushed = 0
+
+    def record(self, user_id: int, channel_id: int, message_id: int) -> None:
+        with self._lock:
+            channels = self._pending.setdefault(user_id, {})
+            if message_id > channels.get(channel_id, 0):
+                channels[channel_id] = message_id
+            self.recorded += 1
+
+    def pending(self, user_id: int) -> Dict[int, int]:
+        """未反映の既読位置（チャンネルID → メッセージID）"""
+        with self._lock:
+            return dict(self._pending.get(user_id, {}))
+
+    def pending_for(self, user_id: int, channel_id: int) -> Optional[int]:
+        with self._lock:
+            return self._pending.get(user_id, {}).get(channel_id)
+
+    def _take(self) -> Dict[Tuple[int, int], int]:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return {
+            (user_id, channel_id): message_id
+            for user_id, channels in pending.items()
+            for channel_id, message_id in channels.items()
+        }
+
+    def _requeue(self, markers: Dict[Tuple[int, int], int]) -> None:
+        with self._lock:
+            for (user_id, channel_id), message_id in markers.items():
+                channels = self._pending.setdefault(user_id, {})
+                if message_id > channels.get(channel_id, 0):
+                    channels[channel_id] = message_id
+
+    def flush(self) -> int:
+        """溜まった既読位置を1トランザクションで反映し、反映した件数を返す
+
+        データが原因でバッチが失敗したら1件ずつ反映し直し、それでも失敗するものは
+        ログに残して破棄する。接続断など他の失敗では値をバッファに戻し、次回に再試行する。
+        """
+        markers = self._take()
+        if not markers:
+            return 0
+        applied = flush_batch(
+            "Read marker",
+            markers,
+            apply_read_markers,
+            lambda key: f"read marker of user {key[0]} in channel {key[1]}",
+            requeue=self._requeue
+        )
+        self.flushed += applied
+        return applied
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = sum(len(channels) for channels in self._pending.values())
+        return {
+            "pending": pending,
+            "recorded": self.recorded,
+            "flushed": self.flushed,
+        }
+
+
+read_markers = ReadMarkerBuffer()
+
+
+async def run_read_marker_flusher() -> None:
+    """既読位置を定期的にDBへ反映するバックグラウンドタスク"""
+    while True:
+        await asyncio.sleep(settings.read_marker_flush_interval_seconds)
+        try:
+            await run_in_threadpool(read_markers.flush)
+        except Exception as e:
+            logger.error(f"Read marker flush failed: {e}", exc_info=True)
@@ -0,0 +1,199 @@
+import sys
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+from app.core.config import settings
+
+# Ranked hits: (message_id, score)
+RankedHits = List[Tuple[int, float]]
+
+# Sorted channel ids a search ran over
+Scope = Tuple[int, ...]
+
+# Rough per-hit overhead of a (int, float) tuple inside a list
+_HIT_SIZE = sys.getsizeof((0, 0.0)) + sys.getsizeof(0) + sys.getsizeof(0.0) + 8
+
+
+def deep_size(value) -> int:
+    """タプル・リスト・集合をたどった概算のメモリ使用量"""
+    size = sys.getsizeof(value)
+    if isinstance(value, (tuple, list, set, frozenset)):
+        size += sum(deep_size(item) for item in value)
+    return size
+
+
+class _ScopeState:
+    __slots__ = ("changed", "refs")
+
+    def __init__(self, changed: int):
+        self.changed = changed  # Sequence number of the last write to any channel in the scope
+        self.refs = 0
+
+
+class ChannelVersions:
+    """メッセージの作成・編集・削除を通番で記録し、検索範囲ごとの最終更新を保持する
+
+    範囲の最終更新は登録時に一度だけ対象チャンネルから求め、以後は bump で
+    その範囲に含まれるチャンネルが更新されたときだけ進める。
+    そのため照会のコストは範囲の大きさによらず一定。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sequence = 0
+        self._channel_changed: Dict[int, int] = {}
+        self._scopes: Dict[Scope, _ScopeState] = {}
+        self._scopes_by_channel: Dict[int, Set[Scope]] = {}
+
+    def current(self) -> int:
+        """現在の通番（検索の実行前に取得し、put に渡す）"""
+        return self._sequence
+
+    def acquire(self, scope: Scope) -> None:
+        """範囲を登録（参照カウント付き）。初回のみ範囲の大きさに比例するコストがかかる"""
+        with self._lock:
+            state = self._scopes.get(scope)
+            if state is None:
+                channel_changed = self._channel_changed
+                state = _ScopeState(max((channel_changed.get(channel_id, 0) for channel_id in scope), default=0))
+                self._scopes[scope] = state
+                for channel_id in scope:
+                    self._scopes_by_channel.setdefault(channel_id, set()).add(scope)
+            state.refs += 1
+
+    def release(self, scope: Scope) -> None:
+        with self._lock:
+            state = self._scopes.get(scope)
+            if state is None:
+                return
+            state.refs -= 1
+            if state.refs > 0:
+                return
+            del self._scopes[scope]
+            for channel_id in scope:
+                scopes = self._scopes_by_channel.get(channel_id)
+                if scopes is not None:
+                    scopes.discard(scope)
+                    if not scopes:
+                        del self._scopes_by_channel[channel_id]
+
+    def changed_since(self, scope: Scope, sequence: int) -> bool:
+        """通番 sequence の後に範囲内のチャンネルが更新されたか（未登録の範囲は更新ありとみなす）"""
+        state = self._scopes.get(scope)
+        return state is None or state.changed > sequence
+
+    def bump(self, channel_id: int) -> None:
+        with self._lock:
+            self._sequence += 1
+            self._channel_changed[channel_id] = self._sequence
+            # Only scopes that currently back a cache entry are tracked
+            for scope in self._scopes_by_channel.get(channel_id, ()):
+                self._scopes[scope].changed = self._sequence
+
+    def stats(self) -> dict:
+        return {"tracked_scopes": len(self._scopes)}
+
+
+class _Entry:
+    __slots__ = ("hits", "scope", "sequence", "size")
+
+    def __init__(self, hits: RankedHits, scope: Scope, sequence: int, size: int):
+        self.hits = hits
+        self.scope = scope
+        self.sequence = sequence
+        self.size = size
+
+
+class SearchResultCache:
+    """検索結果（ランキング済みのメッセージID）のLRUキャッシュ
+
+    各エントリは検索した範囲と実行前の通番を保持し、
+    その後に範囲内のチャンネルが更新されていれば無効として扱う。
+    """
+
+    def __init__(self, versions: ChannelVersions, max_entries: int, max_bytes: int):
+        self._versions = versions
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[RankedHits]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if self._versions.changed_since(entry.scope, entry.sequence):
+                # A channel in scope changed since this entry was stored
+                self._remove(key)
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.hits
+
+    def put(self, key: Hashable, hits: RankedHits, scope: Scope, sequence: int) -> None:
+        """検索結果を保存（sequenceは検索実行前に ChannelVersions.current で取得した通番）"""
+        # The scope is usually part of the key; it is only counted once
+        size = deep_size(key) + sys.getsizeof(hits) + len(hits) * _HIT_SIZE
+        if size > self._max_bytes:
+            return
+        self._versions.acquire(scope)
+        if self._versions.changed_since(scope, sequence):
+            # Written while the search ran
+            self._versions.release(scope)
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(hits, scope, sequence, size)
+            self._bytes += size
+            while self._entries and (
+                len(self._entries) > self._max_entries or self._bytes > self._max_bytes
+            ):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        self._versions.release(entry.scope)
+
+    def clear(self) -> None:
+        with self._lock:
+            for entry in self._entries.values():
+                self._versions.release(entry.scope)
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self._max_entries,
+            "memory_bytes": self._bytes,
+            "max_memory_bytes": self._max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "evictions": self.evictions,
+            **self._versions.stats(),
+        }
+
+
+channel_versions = ChannelVersions()
+search_cache = SearchResultCache(
+    channel_versions,
+    max_entries=settings.search_cache_max_entries,
+    max_bytes=settings.search_cache_max_bytes
+)
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Sequence, Set, Tuple
+
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.database.base import SessionLocal
+from app.database.models import Message, MessageTerm, SearchIndexQueue
+from app.services.batch_flush import flush_batch
+from app.services.search_cache import channel_versions
+from app.services.search_ranking import tokenize
+
+logger = logging.getLogger(__name__)
+
+MAX_TERM_LENGTH = 64
+
+
+def term_counts(content: str) -> Dict[str, int]:
+    """本文を語ごとの出現回数に変換"""
+    counts: Dict[str, int] = {}
+    for token in tokenize(content):
+        term = token[:MAX_TERM_LENGTH]
+        counts[term] = counts.get(term, 0) + 1
+    return counts
+
+
+def enqueue_message(db: Session, message_id: int) -> None:
+    """メッセージをインデックス更新キューに追加（呼び出し側のトランザクションでコミット）"""
+    db.add(SearchIndexQueue(message_id=message_id))
+
+
+def write_postings(db: Session, message_ids: Sequence[int], documents: Iterable[Tuple[int, str]]) -> int:
+    """指定メッセージの転置インデックスを置き換える（削除済みメッセージは消すだけ）"""
+    if not message_ids:
+        return 0
+    db.query(MessageTerm).filter(MessageTerm.message_id.in_(message_ids)).delete(synchronize_session=False)
+    rows: List[dict] = []
+    for message_id, content in documents:
+        rows.extend(
+            {"term": term, "message_id": message_id, "tf": tf}
+            for term, tf in term_counts(content).items()
+        )
+    if rows:
+        db.execute(MessageTerm.__table__.insert(), rows)
+    return len(rows)
+
+
+def index_messages(db: Session, message_ids: Sequence[int], queue_ids: Sequence[int]) -> Set[int]:
+    """指定メッセージのインデックスを更新し、対応するキューの行を消す。コミットは呼び出し側で行う
+
+    インデックスを更新したメッセージのチャンネルIDを返す。
+    """
+    # Deleted messages are simply absent here, which removes their postings
+    rows = db.query(Message.id, Message.content, Message.channel_id).filter(Message.id.in_(message_ids)).all()
+    write_postings(db, message_ids, [(row.id, row.content) for row in rows])
+    db.query(SearchIndexQueue).filter(SearchIndexQueue.id.in_(queue_ids)).delete(synchronize_session=False)
+    return {row.channel_id for row in rows}
+
+
+def _dequeue(db: Session, message_id: int, queue_ids: List[int]) -> None:
+    db.query(SearchIndexQueue).filter(SearchIndexQueue.id.in_(queue_ids)).delete(synchronize_session=False)
+
+
+def drain_queue(batch_size: int) -> int:
+    """キューから最大batch_size件を取り出してインデックスを更新し、処理件数を返す
+
+    バッチが失敗したら1件ずつ処理し直し、データが原因で失敗するメッセージはキューから外して
+    ログに残す（他のメッセージのインデックス更新を止めないため）。
+    """
+    db = SessionLocal()
+    try:
+        queued = [
+            (item.id, item.message_id)
+            for item in db.query(SearchIndexQueue).order_by(SearchIndexQueue.id).limit(batch_size).all()
+        ]
+    finally:
+        db.close()
+    if not queued:
+        return 0
+    queue_ids_by_message: Dict[int, List[int]] = {}
+    for queue_id, message_id in sorted(queued, key=lambda item: item[1]):
+        queue_ids_by_message.setdefault(message_id, []).append(queue_id)
+
+    touched: Set[int] = set()
+
+    def apply(db: Session, batch: Dict[int, List[int]]) -> int:
+        touched.update(index_messages(db, list(batch), [queue_id for ids in batch.values() for queue_id in ids]))
+        return len(batch)
+
+    try:
+        # Rows stay queued on other failures, so there is nothing to requeue
+        flush_batch(
+            "Search index",
+            queue_ids_by_message,
+            apply,
+            lambda message_id: f"message {message_id} from the search index queue",
+            discard=_dequeue
+        )
+    finally:
+        # Indexed messages switch from LIKE to token matching, so cached results may change
+        for channel_id in touched:
+            channel_versions.bump(channel_id)
+    return len(queued)
+
+
+async def run_search_indexer() -> None:
+    """検索インデックスキューを定期的にバッチ処理するバックグラウンドタスク"""
+    batch_size = settings.search_index_batch_size
+    while True:
+        await asyncio.sleep(settings.search_index_interval_seconds)
+        try:
+            # Keep draining while full batches come back
+            while await run_in_threadpool(drain_queue, batch_size) == batch_size:
+                pass
+        except Exception as e:
+            logger.error(f"Search indexing failed: {e}", exc_info=True)
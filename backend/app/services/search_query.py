@@ -0,0 +1,74 @@
+import re
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+
+# operator:value tokens such as from:@alice, in:#general, before:2024-01-31
+_OPERATOR = re.compile(r"^(from|in|before|after|has|is):(\S+)$", re.IGNORECASE)
+
+
+@dataclass
+class SearchQuery:
+    """検索クエリを解析した結果（フリーテキスト＋構造化フィルタ）"""
+    text: str = ""
+    from_usernames: List[str] = field(default_factory=list)
+    in_channels: List[str] = field(default_factory=list)
+    before: Optional[datetime] = None  # created_at < before
+    after: Optional[datetime] = None  # created_at >= after
+    has_file: bool = False
+    is_thread: bool = False
+
+    @property
+    def has_filters(self) -> bool:
+        return bool(
+            self.from_usernames or self.in_channels or self.before or self.after
+            or self.has_file or self.is_thread
+        )
+
+
+def _parse_date(value: str) -> Optional[date]:
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+
+def parse_search_query(q: str) -> SearchQuery:
+    """`from:@user in:#channel before:/after:YYYY-MM-DD has:file is:thread` を解析
+
+    解釈できない演算子はそのままフリーテキストとして扱う。
+    """
+    parsed = SearchQuery()
+    text_parts: List[str] = []
+
+    for token in q.split():
+        match = _OPERATOR.match(token)
+        if not match:
+            text_parts.append(token)
+            continue
+
+        operator, value = match.group(1).lower(), match.group(2)
+        if operator == "from":
+            parsed.from_usernames.append(value.lstrip("@"))
+        elif operator == "in":
+            parsed.in_channels.append(value.lstrip("#"))
+        elif operator in ("before", "after"):
+            day = _parse_date(value)
+            if day is None:
+                text_parts.append(token)
+                continue
+            start_of_day = datetime.combine(day, datetime.min.time())
+            if operator == "before":
+                parsed.before = start_of_day
+            else:
+                # after:D means after that day, as in Slack
+                parsed.after = start_of_day + timedelta(days=1)
+        elif operator == "has" and value.lower() == "file":
+            parsed.has_file = True
+        elif operator == "is" and value.lower() == "thread":
+            parsed.is_thread = True
+        else:
+            text_parts.append(token)
+
+    parsed.text = " ".join(text_parts)
+    return parsed
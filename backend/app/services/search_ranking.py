@@ -0,0 +1,168 @@
+import math
+import re
+import unicodedata
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Maximum number of distinct query terms used for scoring
+MAX_QUERY_TERMS = 8
+
+SNIPPET_LENGTH = 160
+
+# CJK (kana / kanji) runs have no word boundaries, so they are split into bigrams
+_CJK_RUN = re.compile(r"[぀-ヿ㐀-䶿一-鿿豈-﫿]+")
+_WORD = re.compile(r"\w+")
+
+
+def normalize_text(text: str) -> str:
+    """検索用にテキストを正規化（全角/半角・大文字小文字を統一）"""
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def tokenize(text: str) -> List[str]:
+    """テキストを検索用トークンに分割"""
+    tokens: List[str] = []
+    for word in _WORD.findall(normalize_text(text)):
+        position = 0
+        for run in _CJK_RUN.finditer(word):
+            # Latin / digit part before the CJK run
+            if run.start() > position:
+                tokens.append(word[position:run.start()])
+            chars = run.group()
+            if len(chars) == 1:
+                tokens.append(chars)
+            else:
+                tokens.extend(chars[i:i + 2] for i in range(len(chars) - 1))
+            position = run.end()
+        if position < len(word):
+            tokens.append(word[position:])
+    return tokens
+
+
+def query_terms(query: str) -> List[str]:
+    """検索クエリから重複を除いたスコアリング用の語を取得"""
+    terms: List[str] = []
+    for token in tokenize(query):
+        if token not in terms:
+            terms.append(token)
+    return terms[:MAX_QUERY_TERMS]
+
+
+def query_words(query: str) -> List[str]:
+    """検索クエリを空白区切りの語に分割（LIKE検索とハイライト用）"""
+    words: List[str] = []
+    for word in query.lower().split():
+        if word not in words:
+            words.append(word)
+    return words
+
+
+def bm25_score(
+    doc_tokens: List[str],
+    terms: Iterable[str],
+    doc_freqs: Dict[str, int],
+    total_docs: int,
+    avg_doc_length: float
+) -> float:
+    """BM25スコアを計算"""
+    if not doc_tokens:
+        return 0.0
+
+    term_counts: Dict[str, int] = {}
+    for token in doc_tokens:
+        term_counts[token] = term_counts.get(token, 0) + 1
+
+    doc_length = len(doc_tokens)
+    avg_doc_length = avg_doc_length or doc_length
+    score = 0.0
+    for term in terms:
+        tf = term_counts.get(term, 0)
+        if not tf:
+            continue
+        df = doc_freqs.get(term, 0)
+        idf = math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_length / avg_doc_length)
+        score += idf * tf * (BM25_K1 + 1) / (tf + norm)
+    return score
+
+
+def recency_decay(created_at: Optional[datetime], half_life_days: float, now: Optional[datetime] = None) -> float:
+    """半減期に基づく新しさの重み（0〜1）"""
+    if created_at is None or half_life_days <= 0:
+        return 1.0
+    now = now or datetime.utcnow()
+    age_days = max((now - created_at).total_seconds(), 0) / 86400
+    return 0.5 ** (age_days / half_life_days)
+
+
+def normalize_with_offsets(text: str) -> Tuple[str, List[int]]:
+    """1文字ずつ normalize_text を適用した文字列と、その各文字の元のテキストでの位置
+
+    NFKCや小文字化で長さが変わる文字（例: İ, ﬁ）があっても、一致位置を元の位置へ戻せる。
+    """
+    folded: List[str] = []
+    offsets: List[int] = []
+    for index, char in enumerate(text):
+        char_folded = char.lower() if char.isascii() else normalize_text(char)
+        folded.append(char_folded)
+        offsets.extend([index] * len(char_folded))
+    return "".join(folded), offsets
+
+
+def make_snippet(content: str, words: List[str], length: int = SNIPPET_LENGTH) -> Tuple[str, List[List[int]]]:
+    """検索語の周辺を切り出したスニペットとハイライト位置を生成
+
+    ハイライトはスニペット内の [開始, 終了) オフセットのリスト。
+    照合は tokenize と同じ正規化（NFKC・小文字化）で行い、位置は元の本文に戻す。
+    """
+    folded, offsets = normalize_with_offsets(content)
+    matches: List[Tuple[int, int]] = []  # [start, end) in content
+    for needle in {normalize_text(word) for word in words}:
+        if not needle:
+            continue
+        index = folded.find(needle)
+        while index != -1:
+            matches.append((offsets[index], offsets[index + len(needle) - 1] + 1))
+            index = folded.find(needle, index + len(needle))
+    first_match = min(matches)[0] if matches else None
+
+    if len(content) <= length:
+        start, end = 0, len(content)
+    else:
+        anchor = first_match or 0
+        start = max(0, anchor - length // 3)
+        end = min(len(content), start + length)
+        start = max(0, end - length)
+        # Avoid cutting words in half where possible
+        if start > 0:
+            space = content.rfind(" ", start - 15, start)
+            if space != -1:
+                start = space + 1
+        if end < len(content):
+            space = content.find(" ", end, end + 15)
+            if space != -1:
+                end = space
+
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if end < len(content) else ""
+    snippet = prefix + content[start:end] + suffix
+
+    shift = len(prefix) - start
+    highlights = sorted(
+        [begin + shift, finish + shift]
+        for begin, finish in matches
+        if begin >= start and finish <= end
+    )
+
+    # Merge overlapping highlight ranges
+    merged: List[List[int]] = []
+    for begin, finish in highlights:
+        if merged and begin <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], finish)
+        else:
+            merged.append([begin, finish])
+    return snippet, merged
@@ -0,0 +1,170 @@
+import logging
+import os
+import re
+import shutil
+from pathlib import Path
+from typing import Iterator, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# boto3 is only needed for the S3-compatible backend
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+    BOTO3_AVAILABLE = True
+except ImportError:
+    BOTO3_AVAILABLE = False
+
+_VALID_NAME = re.compile(r"^[0-9A-Za-z_-][0-9A-Za-z_.-]{3,}$")
+
+
+def is_valid_name(name: str) -> bool:
+    """保存名として安全か（URLから来る名前でディレクトリ外を指せないように）"""
+    return bool(_VALID_NAME.match(name)) and ".." not in name
+
+
+def shard_key(name: str) -> str:
+    """名前の先頭4文字で2階層に分散したキー（例: ab/cd/abcd...）"""
+    return f"{name[:2]}/{name[2:4]}/{name}"
+
+
+def shard_path(root: Path, name: str) -> Path:
+    return root / name[:2] / name[2:4] / name
+
+
+class LocalStorage:
+    """ローカルディスクに `ab/cd/<name>` の形で分散して保存するバックエンド
+
+    移行前のフラットな配置（`<root>/<name>`）にあるファイルも読み出せる。
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def local_path(self, name: str) -> Optional[Path]:
+        """ファイルのパス（存在しなければNone）"""
+        if not is_valid_name(name):
+            return None
+        for path in (shard_path(self.root, name), self.root / name):
+            if path.is_file():
+                return path
+        return None
+
+    def exists(self, name: str) -> bool:
+        return self.local_path(name) is not None
+
+    def put(self, source: Path, name: str) -> None:
+        """ローカルの一時ファイルを保存先へ移動"""
+        path = shard_path(self.root, name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Atomic rename, so readers never see a partially written file
+        os.replace(source, path)
+
+    def fetch(self, name: str, destination: Path) -> None:
+        shutil.copyfile(self.local_path(name), destination)
+
+    def delete(self, name: str) -> None:
+        path = self.local_path(name)
+        if path is not None:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def presigned_url(self, name: str, media_type: str) -> Optional[str]:
+        # Served by the API process itself
+        return None
+
+
+class S3Storage:
+    """S3互換オブジェクトストレージのバックエンド（MinIOなども endpoint_url で利用可能）
+
+    ダウンロードは署名付きURLへリダイレクトし、APIプロセスはデータを中継しない。
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        endpoint_url: Optional[str] = None,
+        region: Optional[str] = None,
+        access_key: Optional[str] = None,
+        secret_key: Optional[str] = None,
+        prefix: str = "",
+        presign_expires_seconds: int = 3600
+    ):
+        if not BOTO3_AVAILABLE:
+            raise RuntimeError("S3ストレージを使うには boto3 をインストールしてください")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.presign_expires_seconds = presign_expires_seconds
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key
+        )
+
+    def _key(self, name: str) -> str:
+        key = shard_key(name)
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def local_path(self, name: str) -> Optional[Path]:
+        return None
+
+    def exists(self, name: str) -> bool:
+        if not is_valid_name(name):
+            return False
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(name))
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def put(self, source: Path, name: str) -> None:
+        """ローカルの一時ファイルをアップロードして削除"""
+        self.client.upload_file(str(source), self.bucket, self._key(name))
+        os.remove(source)
+
+    def fetch(self, name: str, destination: Path) -> None:
+        self.client.download_file(self.bucket, self._key(name), str(destination))
+
+    def delete(self, name: str) -> None:
+        if is_valid_name(name):
+            self.client.delete_object(Bucket=self.bucket, Key=self._key(name))
+
+    def presigned_url(self, name: str, media_type: str) -> Optional[str]:
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self._key(name), "ResponseContentType": media_type},
+            ExpiresIn=self.presign_expires_seconds
+        )
+
+
+def create_storage(upload_directory: Path):
+    """設定に応じたストレージバックエンドを生成"""
+    if settings.storage_backend == "s3":
+        return S3Storage(
+            bucket=settings.storage_s3_bucket,
+            endpoint_url=settings.storage_s3_endpoint_url,
+            region=settings.storage_s3_region,
+            access_key=settings.storage_s3_access_key,
+            secret_key=settings.storage_s3_secret_key,
+            prefix=settings.storage_s3_prefix,
+            presign_expires_seconds=settings.storage_presign_expires_seconds
+        )
+    if settings.storage_backend != "local":
+        raise ValueError(f"Unknown storage backend: {settings.storage_backend}")
+    return LocalStorage(upload_directory)
+
+
+def iter_flat_files(upload_directory: Path) -> Iterator[Path]:
+    """移行前のフラットな配置で保存されているファイル"""
+    for path in upload_directory.iterdir():
+        if path.is_file() and is_valid_name(path.name):
+            yield path
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from app.core.config import settings
+from app.services.storage import shard_path
+
+logger = logging.getLogger(__name__)
+
+# Longest edge of each standard variant, in pixels
+THUMBNAIL_SIZES = (128, 360, 720)
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
+PDF_EXTENSIONS = {'.pdf'}
+
+# Pillow is required for thumbnails, PyMuPDF only for PDF previews
+try:
+    from PIL import Image  # noqa: F401
+    PILLOW_AVAILABLE = True
+except ImportError:
+    PILLOW_AVAILABLE = False
+
+try:
+    import fitz  # noqa: F401  (PyMuPDF)
+    PDF_PREVIEW_AVAILABLE = True
+except ImportError:
+    PDF_PREVIEW_AVAILABLE = False
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def supports_thumbnail(filename: str) -> bool:
+    extension = Path(filename).suffix.lower()
+    if extension in IMAGE_EXTENSIONS:
+        return PILLOW_AVAILABLE
+    if extension in PDF_EXTENSIONS:
+        return PILLOW_AVAILABLE and PDF_PREVIEW_AVAILABLE
+    return False
+
+
+def thumbnail_path(thumbnail_dir: Path, filename: str, size: int) -> Path:
+    return shard_path(thumbnail_dir, f"{Path(filename).stem}_{size}.webp")
+
+
+def _load_image(source_path: str):
+    from PIL import Image
+
+    if Path(source_path).suffix.lower() in PDF_EXTENSIONS:
+        import fitz
+
+        # First page of the PDF as the preview
+        with fitz.open(source_path) as document:
+            pixmap = document.load_page(0).get_pixmap(dpi=96)
+            return Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+
+    image = Image.open(source_path)
+    image.seek(0)  # First frame of animated images
+    return image
+
+
+def generate_thumbnails(source_path: str, thumbnail_dir: str, sizes=THUMBNAIL_SIZES) -> int:
+    """サムネイルを生成（ワーカープロセスで実行）。既存のものはスキップし、生成数を返す"""
+    from PIL import ImageOps
+
+    filename = Path(source_path).name
+    targets = [
+        (size, thumbnail_path(Path(thumbnail_dir), filename, size)) for size in sizes
+    ]
+    targets = [(size, path) for size, path in targets if not path.exists()]
+    if not targets:
+        return 0
+
+    image = _load_image(source_path)
+    targets[0][1].parent.mkdir(parents=True, exist_ok=True)
+    # Honour EXIF orientation from phone cameras
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+
+    # Largest first, so each smaller variant is resized from an already reduced image
+    for size, path in sorted(targets, reverse=True):
+        image.thumbnail((size, size))
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.part")
+        image.save(tmp_path, format="WEBP", quality=80)
+        os.replace(tmp_path, path)
+    return len(targets)
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Forking a threaded server can copy locks held by other threads into the workers
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.thumbnail_workers,
+                mp_context=multiprocessing.get_context("forkserver")
+            )
+        return _executor
+
+
+def start_thumbnail_executor() -> None:
+    """サムネイル生成用のプロセスプールを作成（アプリ起動時に呼ぶ）"""
+    if PILLOW_AVAILABLE:
+        _get_executor()
+
+
+def _log_failure(future) -> None:
+    if not future.cancelled() and future.exception():
+        logger.error(f"Thumbnail generation failed: {future.exception()}")
+
+
+def schedule_thumbnails(source_path: Path, thumbnail_dir: Path) -> None:
+    """アップロード後にサムネイル生成をプロセスプールへ投入（完了を待たない）"""
+    if not supports_thumbnail(source_path.name):
+        return
+    future = _get_executor().submit(generate_thumbnails, str(source_path), str(thumbnail_dir))
+    future.add_done_callback(_log_failure)
+
+
+async def get_or_create_thumbnail(source_path: Path, thumbnail_dir: Path, size: int) -> Optional[Path]:
+    """サムネイルを返す。無ければその場でプロセスプールで生成する"""
+    path = thumbnail_path(thumbnail_dir, source_path.name, size)
+    if path.exists():
+        return path
+    if not supports_thumbnail(source_path.name):
+        return None
+
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(
+            _get_executor(), generate_thumbnails, str(source_path), str(thumbnail_dir), (size,)
+        )
+    except Exception as e:
+        logger.error(f"Thumbnail generation failed for {source_path.name}: {e}")
+        return None
+    return path if path.exists() else None
+
+
+def remove_thumbnails(filename: str, thumbnail_dir: Path) -> None:
+    for size in THUMBNAIL_SIZES:
+        try:
+            os.remove(thumbnail_path(thumbnail_dir, filename, size))
+        except FileNotFoundError:
+            pass
+
+
+def shutdown_thumbnail_executor() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
@@ -0,0 +1,203 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# Received byte ranges as [start, end) pairs
+Ranges = List[List[int]]
+
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+# One lock per session serializes updates of its range file
+_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+# Serializes the per-user limit check with the creation it allows
+_create_lock = threading.Lock()
+
+
+class UploadLimitExceeded(Exception):
+    """ユーザーごとのセッション数・合計サイズの上限を超える（呼び出し側は429で断る）"""
+
+
+def _session_lock(upload_id: str) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(upload_id, threading.Lock())
+
+
+def _write_json(path: Path, data) -> None:
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def merge_range(ranges: Ranges, start: int, end: int) -> Ranges:
+    """[start, end) を受信済み範囲に追加して結合"""
+    merged: Ranges = []
+    for begin, finish in sorted(ranges + [[start, end]]):
+        if merged and begin <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], finish)
+        else:
+            merged.append([begin, finish])
+    return merged
+
+
+class UploadSessionStore:
+    """再開可能なアップロードのセッションをディスク上で管理
+
+    セッションごとにディレクトリを作り、meta.json（ファイル情報）、
+    data（事前確保した本体）、ranges.json（受信済み範囲）を保存する。
+    確定処理中は completing を置き、同じセッションの確定・書き込み・中止を断る。
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, upload_id: str) -> Path:
+        # upload_id comes from the URL; only accept our own hex ids
+        if len(upload_id) != 32 or any(c not in "0123456789abcdef" for c in upload_id):
+            raise KeyError(upload_id)
+        return self.directory / upload_id
+
+    def create(
+        self,
+        user_id: int,
+        filename: str,
+        size: int,
+        content_type: str,
+        max_sessions: int,
+        max_bytes: int
+    ) -> str:
+        """セッションを作成してIDを返す（ユーザーの上限を超えるなら UploadLimitExceeded）"""
+        with _create_lock:
+            sessions, reserved = self.usage(user_id)
+            if sessions >= max_sessions or reserved + size > max_bytes:
+                raise UploadLimitExceeded()
+            upload_id = uuid.uuid4().hex
+            path = self.directory / upload_id
+            path.mkdir()
+            with open(path / "data", "wb") as f:
+                f.truncate(size)
+            now = time.time()
+            _write_json(path / "meta.json", {
+                "user_id": user_id,
+                "filename": filename,
+                "size": size,
+                "content_type": content_type,
+                "created_at": now,
+            })
+            _write_json(path / "ranges.json", [])
+        return upload_id
+
+    def usage(self, user_id: int) -> Tuple[int, int]:
+        """ユーザーの未完了セッションの (数, 確保済みの合計サイズ)"""
+        sessions = reserved = 0
+        for path in self.directory.iterdir():
+            meta = self.get_meta(path.name)
+            if meta and meta["user_id"] == user_id:
+                sessions += 1
+                reserved += meta["size"]
+        return sessions, reserved
+
+    def get_meta(self, upload_id: str) -> Optional[dict]:
+        try:
+            with open(self._path(upload_id) / "meta.json") as f:
+                return json.load(f)
+        except (KeyError, FileNotFoundError):
+            return None
+
+    def received_ranges(self, upload_id: str) -> Ranges:
+        with open(self._path(upload_id) / "ranges.json") as f:
+            return json.load(f)
+
+    def open_data(self, upload_id: str) -> int:
+        """チャンク書き込み用にデータファイルを開く（os.pwriteで書く）"""
+        return os.open(self._path(upload_id) / "data", os.O_WRONLY)
+
+    def mark_received(self, upload_id: str, start: int, end: int) -> Optional[Ranges]:
+        """書き込み済みの範囲を記録（データをfsyncした後に呼ぶ）
+
+        書き込み中に確定処理が始まった、または終わっていたらNone（その書き込みは確定内容に含まれない）。
+        """
+        path = self._path(upload_id)
+        with _session_lock(upload_id):
+            if (path / "completing").exists() or not path.exists():
+                return None
+            ranges = merge_range(self.received_ranges(upload_id), start, end)
+            _write_json(path / "ranges.json", ranges)
+        os.utime(path)  # Activity timestamp for garbage collection
+        return ranges
+
+    def begin_complete(self, upload_id: str) -> bool:
+        """確定処理を開始する。既に他のリクエストが確定中（または削除済み）ならFalse"""
+        try:
+            # O_EXCL makes the marker creation atomic, even across worker processes
+            fd = os.open(self._path(upload_id) / "completing", os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except (KeyError, FileExistsError, FileNotFoundError):
+            return False
+        os.close(fd)
+        return True
+
+    def cancel_complete(self, upload_id: str) -> None:
+        """失敗した確定処理の印を外し、再試行できるようにする"""
+        try:
+            os.remove(self._path(upload_id) / "completing")
+        except (KeyError, FileNotFoundError):
+            pass
+
+    def is_completing(self, upload_id: str) -> bool:
+        try:
+            return (self._path(upload_id) / "completing").exists()
+        except KeyError:
+            return False
+
+    @staticmethod
+    def is_complete(ranges: Ranges, size: int) -> bool:
+        return size == 0 or (len(ranges) == 1 and ranges[0] == [0, size])
+
+    def finalize(self, upload_id: str) -> Tuple[Path, str, int]:
+        """全範囲が揃ったデータを確定用のファイルへ複写しながらSHA-256を計算する
+
+        (確定用ファイル, SHA-256, サイズ) を返す。まだ続いているPUTは元のデータファイルに
+        書くので、保存する内容とハッシュが後から食い違うことはない（begin_complete の後に呼ぶ）。
+        """
+        path = self._path(upload_id)
+        final_path = path / "final"
+        digest = hashlib.sha256()
+        size = 0
+        with open(path / "data", "rb") as source, open(final_path, "wb") as target:
+            while True:
+                block = source.read(_HASH_BLOCK_SIZE)
+                if not block:
+                    break
+                digest.update(block)
+                target.write(block)
+                size += len(block)
+        return final_path, digest.hexdigest(), size
+
+    def delete(self, upload_id: str) -> None:
+        try:
+            shutil.rmtree(self._path(upload_id), ignore_errors=True)
+        except KeyError:
+            pass
+        with _locks_guard:
+            _locks.pop(upload_id, None)
+
+    def cleanup_expired(self, max_age_seconds: float) -> int:
+        """最後の書き込みから一定時間経過したセッションを削除し、削除数を返す"""
+        cutoff = time.time() - max_age_seconds
+        removed = 0
+        for path in self.directory.iterdir():
+            try:
+                if path.is_dir() and path.stat().st_mtime < cutoff:
+                    self.delete(path.name)
+                    removed += 1
+            except FileNotFoundError:
+                continue
+        return removed
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+アップロードファイルをフラットな uploads/ から設定中のストレージへ移行するスクリプト
+
+ローカルストレージでは `uploads/ab/cd/<name>` の分散配置へ移動し、
+S3ストレージ（STORAGE_BACKEND=s3）ではアップロードしてからローカルのファイルを削除する。
+移行済みのファイルは対象外になるため、中断しても再実行すれば続きから処理される。
+
+    python migrate_storage.py [--dry-run]
+"""
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services.storage import create_storage, iter_flat_files, shard_path
+
+UPLOAD_DIRECTORY = Path("uploads")
+THUMBNAIL_DIRECTORY = UPLOAD_DIRECTORY / "thumbs"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="アップロードファイルを分散配置・外部ストレージへ移行")
+    parser.add_argument("--dry-run", action="store_true", help="移行対象を表示するだけで移動しない")
+    args = parser.parse_args()
+
+    if not UPLOAD_DIRECTORY.exists():
+        print("uploads ディレクトリがありません")
+        return
+
+    storage = create_storage(UPLOAD_DIRECTORY)
+    started = time.time()
+    moved = 0
+    for path in iter_flat_files(UPLOAD_DIRECTORY):
+        if args.dry_run:
+            print(f"  {path.name}")
+        else:
+            storage.put(path, path.name)
+        moved += 1
+        if moved % 1000 == 0:
+            print(f"⏳ {moved}件を移行しました")
+
+    # Thumbnails always stay on local disk, but use the same sharded layout
+    thumbnails = 0
+    if THUMBNAIL_DIRECTORY.exists():
+        for path in iter_flat_files(THUMBNAIL_DIRECTORY):
+            if not args.dry_run:
+                target = shard_path(THUMBNAIL_DIRECTORY, path.name)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(path, target)
+            thumbnails += 1
+
+    action = "移行対象" if args.dry_run else "移行完了"
+    print(f"🎉 {action}: ファイル{moved}件、サムネイル{thumbnails}件 ({time.time() - started:.1f}秒)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+検索インデックス（message_terms）を全メッセージから再構築するスクリプト
+
+メッセージIDの範囲をワーカー数で分割し、各プロセスがサーバーサイドカーソルで
+チャンク単位に読み込んでインデックスを書き込む。範囲ごとのチェックポイントを保存するため、
+中断しても同じ引数で再実行すれば続きから再開できる。
+
+    python reindex.py --workers 4 --chunk-size 1000
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import func, select
+
+from app.database.base import SessionLocal, engine
+from app.database.models import Base, Message
+from app.services.search_indexer import write_postings
+
+
+def checkpoint_path(checkpoint_dir: Path, start_id: int, end_id: int) -> Path:
+    return checkpoint_dir / f"range-{start_id}-{end_id}.json"
+
+
+def load_checkpoint(path: Path) -> int:
+    """範囲内で処理済みの最大メッセージID（未処理なら0）"""
+    if not path.exists():
+        return 0
+    with open(path) as f:
+        return json.load(f)["last_id"]
+
+
+def save_checkpoint(path: Path, last_id: int, indexed: int) -> None:
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({"last_id": last_id, "indexed": indexed, "updated_at": time.time()}, f)
+    os.replace(tmp_path, path)
+
+
+def reindex_range(start_id: int, end_id: int, chunk_size: int, checkpoint_dir: str) -> int:
+    """[start_id, end_id] のメッセージを再インデックス（ワーカープロセスで実行）"""
+    # Connections inherited from the parent process must not be shared
+    engine.dispose(close=False)
+
+    path = checkpoint_path(Path(checkpoint_dir), start_id, end_id)
+    last_id = max(load_checkpoint(path), start_id - 1)
+    indexed = 0
+
+    stream = engine.connect().execution_options(stream_results=True, yield_per=chunk_size)
+    db = SessionLocal()
+    try:
+        result = stream.execute(
+            select(Message.id, Message.content)
+            .where(Message.id > last_id, Message.id <= end_id)
+            .order_by(Message.id)
+        )
+        for chunk in result.partitions(chunk_size):
+            message_ids = [row.id for row in chunk]
+            write_postings(db, message_ids, chunk)
+            db.commit()
+            indexed += len(chunk)
+            save_checkpoint(path, message_ids[-1], indexed)
+        save_checkpoint(path, end_id, indexed)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+        stream.close()
+    return indexed
+
+
+def split_ranges(min_id: int, max_id: int, workers: int):
+    size = max((max_id - min_id + 1) // workers, 1)
+    ranges = []
+    start = min_id
+    while start <= max_id:
+        end = max_id if len(ranges) == workers - 1 else min(start + size - 1, max_id)
+        ranges.append((start, end))
+        start = end + 1
+    return ranges
+
+
+def main():
+    parser = argparse.ArgumentParser(description="検索インデックスを再構築")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="並列プロセス数")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="1回に読み書きするメッセージ数")
+    parser.add_argument("--checkpoint-dir", default="reindex_checkpoints", help="チェックポイントの保存先")
+    parser.add_argument("--reset", action="store_true", help="チェックポイントを破棄して最初からやり直す")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+
+    checkpoint_dir = Path(args.checkpoint_dir)
+    checkpoint_dir.mkdir(exist_ok=True)
+    plan_path = checkpoint_dir / "plan.json"
+    if args.reset:
+        for path in checkpoint_dir.glob("*.json"):
+            path.unlink()
+
+    # Reuse the saved ID ranges so checkpoints stay valid when resuming
+    if plan_path.exists():
+        with open(plan_path) as f:
+            ranges = [tuple(r) for r in json.load(f)["ranges"]]
+        print(f"🔁 前回のチェックポイントから再開します（{len(ranges)}範囲）")
+    else:
+        with engine.connect() as conn:
+            min_id, max_id = conn.execute(select(func.min(Message.id), func.max(Message.id))).one()
+        if min_id is None:
+            print("メッセージがありません")
+            return
+        ranges = split_ranges(min_id, max_id, args.workers)
+        with open(plan_path, "w") as f:
+            json.dump({"ranges": ranges}, f)
+
+    started = time.time()
+    total = 0
+    engine.dispose()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {
+            executor.submit(reindex_range, start, end, args.chunk_size, str(checkpoint_dir)): (start, end)
+            for start, end in ranges
+        }
+        for future in as_completed(futures):
+            start, end = futures[future]
+            count = future.result()
+            total += count
+            print(f"✅ {start}〜{end}: {count}件をインデックスしました")
+
+    # Everything is done; the next run starts from scratch
+    for path in checkpoint_dir.glob("*.json"):
+        path.unlink()
+    print(f"🎉 再インデックス完了: {total}件 ({time.time() - started:.1f}秒)")
+
+
+if __name__ == "__main__":
+    main()
@@ -70,7 +70,8 @@ def create_database_and_tables():
             FOREIGN KEY (created_by) REFERENCES users(id) ON DELETE CASCADE,
             INDEX idx_name (name),
             INDEX idx_type (channel_type),
-            INDEX idx_archived (is_archived)
+            INDEX idx_archived (is_archived),
+            INDEX idx_type_name (channel_type, name)
         )
         """)
         print("✅ channelsテーブルを作成しました")
@@ -110,7 +111,9 @@ def create_database_and_tables():
             INDEX idx_channel (channel_id),
             INDEX idx_user (user_id),
             INDEX idx_created_at (created_at),
-            INDEX idx_thread (thread_id)
+            INDEX idx_thread (thread_id),
+            INDEX idx_user_created (user_id, created_at),
+            INDEX idx_channel_created (channel_id, created_at)
         )
         """)
         print("✅ messagesテーブルを作成しました")
@@ -131,6 +134,23 @@ def create_database_and_tables():
         """)
         print("✅ reactionsテーブルを作成しました")
         
+        # 6. 検索用転置インデックス（語は大文字小文字・アクセントを区別して比較する）
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS message_terms (
+            term VARCHAR(64) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+            message_id INT NOT NULL,
+            tf INT NOT NULL DEFAULT 1,
+            PRIMARY KEY (term, message_id),
+            INDEX ix_message_terms_message_id (message_id)
+        )
+        """)
+        # Tables created before the collation was fixed
+        cursor.execute("""
+        ALTER TABLE message_terms
+            MODIFY term VARCHAR(64) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL
+        """)
+        print("✅ message_termsテーブルを作成しました")
+        
         # サンプルデータ投入
         insert_sample_data(cursor)
         
@@ -88,10 +88,17 @@ export default function FileMessage({ fileName, fileUrl, fileSize }: FileMessage
         // Image preview
         <div className="border border-gray-200 dark:border-gray-700 rounded-lg overflow-hidden">
           <img
-            src={fileUrl}
+            src={`${fileUrl}/thumb/360`}
             alt={fileName}
             className="max-w-full max-h-64 object-contain"
-            onError={() => setError('画像の読み込みに失敗しました')}
+            onError={(e) => {
+              // サムネイルが無ければ元画像にフォールバック
+              if (e.currentTarget.src.endsWith('/thumb/360')) {
+                e.currentTarget.src = fileUrl;
+              } else {
+                setError('画像の読み込みに失敗しました');
+              }
+            }}
           />
           <div className="p-3 bg-gray-50 dark:bg-gray-800 border-t border-gray-200 dark:border-gray-700">
             <div className="flex items-center justify-between">
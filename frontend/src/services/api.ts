@@ -1,5 +1,5 @@
 import axios, { AxiosInstance, AxiosResponse } from 'axios';
-import { User, Channel, Message, LoginCredentials, RegisterData, AuthResponse } from '../types';
+import { User, Channel, ChannelDirectoryPage, Message, MessageDraft, LoginCredentials, RegisterData, AuthResponse } from '../types';
 
 const API_BASE_URL = 'http://localhost:8000';
 
@@ -111,6 +111,42 @@ class ApiService {
     return response.data;
   }
 
+  async getChannelDirectory(params: {
+    q?: string;
+    match?: 'prefix' | 'substring';
+    sort?: 'name' | 'members' | 'activity';
+    cursor?: string;
+    limit?: number;
+  } = {}): Promise<ChannelDirectoryPage> {
+    const response: AxiosResponse<ChannelDirectoryPage> = await this.api.get('/channels/directory', { params });
+    return response.data;
+  }
+
+  async createOrGetDMChannel(userId: number): Promise<Channel> {
+    const response: AxiosResponse<Channel> = await this.api.post(`/channels/dm/${userId}`);
+    return response.data;
+  }
+
+  // Drafts
+  async getChannelDraft(channelId: number): Promise<MessageDraft | null> {
+    const response: AxiosResponse<MessageDraft | null> = await this.api.get(`/drafts/channel/${channelId}`);
+    return response.data;
+  }
+
+  async saveChannelDraft(channelId: number, content: string, replyToId?: number): Promise<MessageDraft> {
+    const response: AxiosResponse<MessageDraft> = await this.api.post(`/drafts/channel/${channelId}`, {
+      content,
+      channel_id: channelId,
+      reply_to_id: replyToId ?? null,
+    });
+    return response.data;
+  }
+
+  async deleteChannelDraft(channelId: number): Promise<{ message: string }> {
+    const response: AxiosResponse<{ message: string }> = await this.api.delete(`/drafts/channel/${channelId}`);
+    return response.data;
+  }
+
   // Messages
   async getChannelMessages(channelId: number, skip = 0, limit = 50): Promise<Message[]> {
     const response: AxiosResponse<Message[]> = await this.api.get(
@@ -145,6 +181,19 @@ class ApiService {
   }
 
   async uploadFile(file: File): Promise<string> {
+    // 同じ内容がサーバーにあればデータを送らずに完了する
+    try {
+      const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+      const sha256 = Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+      const response: AxiosResponse<{ file_url: string }> = await this.api.post('/files/upload/by-hash', {
+        sha256,
+        filename: file.name,
+      });
+      return response.data.file_url;
+    } catch {
+      // 未知の内容（404）やハッシュ計算できない環境では通常のアップロードへ
+    }
+
     const formData = new FormData();
     formData.append('file', file);
     
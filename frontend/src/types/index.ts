@@ -25,6 +25,28 @@ export interface Channel {
   is_direct_message?: boolean;
 }
 
+export interface MessageDraft {
+  id?: number | null;
+  content: string;
+  channel_id: number;
+  user_id: number;
+  reply_to_id?: number | null;
+  created_at?: string | null;
+  updated_at: string;
+  reply_to?: {
+    id: number;
+    content: string;
+    user_id: number;
+    created_at: string;
+    sender?: Pick<User, 'id' | 'username' | 'display_name'> | null;
+  } | null;
+}
+
+export interface ChannelDirectoryPage {
+  channels: (Channel & { last_message_at?: string | null })[];
+  next_cursor: string | null;
+}
+
 export interface Message {
   id: number;
   content: string;